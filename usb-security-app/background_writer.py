@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Background file writer for USB Security Software
+Configuration files are written on a dedicated thread so a slow or
+network-backed config directory never stalls the GUI or device threads
+"""
+
+import os
+import json
+import queue
+import threading
+
+
+def atomic_write(path, data):
+    """Write data to a temp file, fsync it and rename it over `path`"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class BackgroundWriter:
+    """
+    Replaces whole files asynchronously. Writes to the same path that
+    queue up before the thread gets to them are coalesced, so only the
+    newest content is written.
+    """
+
+    def __init__(self, max_queue=256):
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._latest = {}   # path -> newest data not yet written
+        self._closed = False
+        self.writes = 0
+        self.coalesced = 0
+        self._thread = threading.Thread(target=self._run, name="config-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path, data):
+        """Queue `data` (str or bytes) to replace the file at `path`"""
+        if self._closed:
+            # Late writes after shutdown still have to land somewhere
+            atomic_write(path, data)
+            return
+
+        with self._lock:
+            queued = path in self._latest
+            self._latest[path] = data
+            if queued:
+                self.coalesced += 1
+        if not queued:
+            self._queue.put(path)
+
+    def write_json(self, path, obj):
+        """Serialize now (so later mutation can't race) and write in the background"""
+        self.write(path, json.dumps(obj, indent=2))
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if path is None:
+                    return
+                with self._lock:
+                    data = self._latest.pop(path, None)
+                if data is not None:
+                    try:
+                        atomic_write(path, data)
+                        self.writes += 1
+                    except OSError as e:
+                        print(f"Error writing {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued write has completed"""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """Flush outstanding writes and stop the thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+        # Anything that raced in behind the stop marker
+        with self._lock:
+            leftovers, self._latest = self._latest, {}
+        for path, data in leftovers.items():
+            atomic_write(path, data)
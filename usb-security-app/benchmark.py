@@ -0,0 +1,911 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for USB Security Software
+Measures hot-path costs without requiring actual USB devices. The end-to-end
+benchmarks drive a real USBSecurityApp (offscreen Qt) from a simulated
+device source. Results can be saved as a baseline and later checked against
+it, failing when a metric regresses by more than its threshold
+Usage: python benchmark.py [names...] [--save-baseline | --check] [--baseline FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import threading
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Allowed slowdown before --check fails (fraction of the baseline value)
+DEFAULT_THRESHOLD = 0.25
+THRESHOLDS = {
+    # Subprocess and wall-clock measurements are noisier
+    'startup.tray_visible_ms': 0.5,
+    'startup.first_detection_ms': 0.5,
+    'startup.process_exit_ms': 0.5,
+    'handoff.second_launch_ms': 0.5,
+    'overlay.cpu_percent': 1.0,
+    'lockout.rss_growth_kb': 1.0,
+    'soak.rss_growth_kb': 1.0,
+    'soak.python_growth_kb': 1.0,
+    # Disk cache state and process start-up dominate short scans
+    'scan.mb_per_s': 0.5,
+    'scan.files_per_s': 0.5,
+    # Sub-microsecond timings move with CPU frequency
+    'blocklist.lookup_ns': 0.5,
+    'blocklist.serial_ns': 0.5,
+}
+
+# Differences below these are noise whatever the relative change (by unit suffix)
+ABSOLUTE_SLACK = {'_ms': 1.0, '_kb': 1024}
+
+# Every other metric is a cost: lower is better
+HIGHER_IS_BETTER = {'storm.events_per_s', 'policy.decisions_per_s',
+                    'events.events_per_s', 'log.records_per_s',
+                    'codec.size_ratio', 'codec.csv_events_per_s',
+                    'scan.mb_per_s', 'scan.files_per_s'}
+
+
+def bench_whitelist_lookup():
+    """Whitelist membership cost as the whitelist grows"""
+    print("\nBenchmarking whitelist lookup...")
+
+    from whitelist_store import WhitelistStore
+
+    results = {}
+    lookups = 100000
+    for size in (10, 1000, 100000, 1000000):
+        store = WhitelistStore()
+        store.import_entries({'id': f"USBSTOR\\DISK&VEN_TEST&PROD_{i:08d}", 'name': f"Drive {i}"}
+                             for i in range(size))
+        # A couple of prefix rules like fleet whitelists carry
+        store.add("USBSTOR\\DISK&VEN_TRUSTED*", "Trusted vendor")
+        store.add("USBSTOR\\DISK&VEN_CORP&PROD_*", "Corporate sticks")
+
+        hits = [f"USBSTOR\\DISK&VEN_TEST&PROD_{random.randrange(size):08d}" for _ in range(lookups // 2)]
+        misses = [f"USBSTOR\\DISK&VEN_OTHER&PROD_{i:08d}" for i in range(lookups // 2)]
+        probes = hits + misses
+        random.shuffle(probes)
+
+        start = time.perf_counter()
+        for device_id in probes:
+            store.is_whitelisted(device_id)
+        elapsed = time.perf_counter() - start
+
+        print(f"  {size:>9,} entries: {elapsed / lookups * 1e9:8.0f} ns/lookup")
+        results[f'whitelist.lookup_ns_{size}'] = elapsed / lookups * 1e9
+    return results
+
+
+def bench_event_storm():
+    """Throughput and latency of the coalescing stage under a plug storm"""
+    print("\nBenchmarking event storm...")
+
+    from event_coalescer import EventCoalescer
+    from device_sources import ReplaySource
+
+    count = 200000
+    # 64 sticks with 3 partitions each, flapping as fast as events arrive
+    events = ReplaySource.synthetic_storm(count, devices=64, partitions=3)
+    delivered = []
+
+    def deliver(batch):
+        delivered.append(len(batch))
+
+    coalescer = EventCoalescer(deliver, window=0.05)
+    source = ReplaySource(events, callback=coalescer.submit, speed=0)
+
+    start = time.perf_counter()
+    source.start()
+    source.wait()
+    submit_elapsed = time.perf_counter() - start
+    coalescer.stop()
+    total_elapsed = time.perf_counter() - start
+    stats = coalescer.stats()
+
+    print(f"  {count:,} events submitted in {submit_elapsed:.2f}s "
+          f"({count / submit_elapsed:,.0f} events/s)")
+    print(f"  {stats['delivered']:,} events delivered in {stats['batches']:,} batches "
+          f"({stats['cancelled']:,} cancelled, {stats['merged']:,} merged) in {total_elapsed:.2f}s")
+    print(f"  Window latency: avg {stats['latency_avg'] * 1000:.1f} ms, "
+          f"max {stats['latency_max'] * 1000:.1f} ms")
+    return {'storm.events_per_s': count / submit_elapsed,
+            'storm.window_latency_max_ms': stats['latency_max'] * 1000}
+
+
+def bench_startup(runs=5):
+    """Time-to-tray and time-to-first-detection of a real app launch"""
+    print("\nBenchmarking startup...")
+
+    import tempfile
+    import statistics
+    import subprocess
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    results = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        replay_file = os.path.join(workdir, 'startup_replay.json')
+        with open(replay_file, 'w') as f:
+            json.dump([{'delay': 0, 'event': 'device_connected',
+                        'device': {'device': '/dev/sdz1', 'fstype': 'vfat'}}], f)
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, script, '--source', f'replay:{replay_file}', '--startup-benchmark'],
+                cwd=workdir, env=env, capture_output=True, text=True, timeout=60
+            )
+            wall = (time.perf_counter() - start) * 1000
+            timings = None
+            for line in process.stdout.splitlines():
+                if line.startswith('{'):
+                    timings = json.loads(line)
+            if timings is None:
+                print(f"  Startup run failed: {(process.stderr or process.stdout).strip()[-300:]}")
+                return {}
+            timings['process_exit'] = wall
+            results.append(timings)
+
+    medians = {}
+    for stage in ('tray_visible', 'monitor_started', 'first_detection', 'process_exit'):
+        values = [r[stage] for r in results if stage in r]
+        if values:
+            print(f"  {stage:<16} median {statistics.median(values):7.1f} ms "
+                  f"(min {min(values):.1f}, max {max(values):.1f})")
+            medians[f'startup.{stage}_ms'] = statistics.median(values)
+    return medians
+
+
+def bench_overlay(seconds=10):
+    """Paint time and CPU of the pre-rendered overlay on a 4K-sized window"""
+    print("\nBenchmarking overlay rendering...")
+
+    from PyQt5.QtCore import QTimer
+    from overlay_rendering import RenderedOverlay
+
+    # Shares the QApplication with the end-to-end benchmarks
+    app = _bench_app().app
+    overlay = RenderedOverlay(duration_minutes=60, profile=True)
+    overlay.show()
+    overlay.setGeometry(0, 0, 3840, 2160)
+
+    QTimer.singleShot(int(seconds * 1000), app.quit)
+    app.exec_()
+    report = overlay.profiler.report()
+    overlay.close()
+
+    print(f"  {report['frames']} frames in {report['wall_seconds']:.1f}s")
+    print(f"  Paint: avg {report['paint_avg_ms']:.2f} ms, p99 {report['paint_p99_ms']:.2f} ms, "
+          f"max {report['paint_max_ms']:.2f} ms (max includes building the cached frames)")
+    print(f"  CPU while locked: {report['cpu_percent']:.1f}%")
+    return {'overlay.paint_avg_ms': report['paint_avg_ms'],
+            'overlay.paint_p99_ms': report['paint_p99_ms'],
+            'overlay.cpu_percent': report['cpu_percent']}
+
+
+def bench_policy(rule_count=10000, decisions=20000):
+    """Decision rate of the compiled policy against a rule-by-rule scan"""
+    print("\nBenchmarking policy engine...")
+
+    from datetime import datetime
+    from policy_engine import CompiledPolicy, device_values
+
+    rng = random.Random(15)
+    fstypes = ['vfat', 'exfat', 'ntfs', 'ext4', 'hfsplus']
+    rules = []
+    for i in range(rule_count):
+        vendor = rng.randrange(0xffff - 256)
+        rule = {'name': f"rule {i}", 'action': rng.choice(['allow', 'block']),
+                'vendor_id': f"{vendor:04x}-{vendor + rng.randrange(256):04x}"}
+        if rng.random() < 0.5:
+            rule['fstype'] = rng.sample(fstypes, 2)
+        if rng.random() < 0.3:
+            rule['capacity'] = f"{rng.randrange(1, 64)}GB-{rng.randrange(64, 4096)}GB"
+        if rng.random() < 0.3:
+            rule['hours'] = f"{rng.randrange(24):02d}:00-{rng.randrange(24):02d}:00"
+        if rng.random() < 0.1:
+            rule['users'] = [f"user{rng.randrange(100)}"]
+        rules.append(rule)
+
+    start = time.perf_counter()
+    policy = CompiledPolicy(rules)
+    compile_ms = (time.perf_counter() - start) * 1000
+    print(f"  Compiled {rule_count:,} rules in {compile_ms:.0f} ms")
+
+    probes = [device_values({'vendor_id': f"{rng.randrange(0xffff):04x}",
+                             'product_id': f"{rng.randrange(0xffff):04x}",
+                             'fstype': rng.choice(fstypes),
+                             'size': rng.randrange(1, 4096) * 1024 ** 3},
+                            now=datetime(2024, 1, 1, rng.randrange(24), 0),
+                            user=f"user{rng.randrange(100)}")
+              for _ in range(decisions)]
+
+    start = time.perf_counter()
+    for values in probes:
+        policy.match(values)
+    indexed = time.perf_counter() - start
+
+    scanned_probes = probes[:max(1, decisions // 20)]
+    policy.scan(scanned_probes[0])   # build the per-rule matchers outside the timing
+    start = time.perf_counter()
+    for values in scanned_probes:
+        policy.scan(values)
+    scanned = (time.perf_counter() - start) / len(scanned_probes) * len(probes)
+
+    print(f"  Indexed: {decisions / indexed:,.0f} decisions/s")
+    print(f"  Linear scan: {decisions / scanned:,.0f} decisions/s ({scanned / indexed:.0f}x slower)")
+    return {'policy.compile_ms': compile_ms, 'policy.decisions_per_s': decisions / indexed}
+
+
+def bench_handoff(runs=10):
+    """Cost of a second launch forwarding its arguments to the running instance"""
+    print("\nBenchmarking single-instance hand-off...")
+
+    import statistics
+    import subprocess
+    from instance_lock import InstanceLock, forward_to_running_instance
+
+    lock = InstanceLock()
+    if not lock.acquire():
+        print("  An instance is already running; stop it first")
+        return {}
+    received = []
+    lock.serve(received.append)
+
+    try:
+        start = time.perf_counter()
+        for _ in range(1000):
+            forward_to_running_instance(['reload', 'whitelist'])
+        forward_ms = time.perf_counter() - start
+        print(f"  In-process forward: {forward_ms:.3f} ms/request")
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        launches, baseline = [], []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, 'show', 'logs'], capture_output=True, timeout=30)
+            launches.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], capture_output=True, timeout=30)
+            baseline.append((time.perf_counter() - start) * 1000)
+    finally:
+        lock.release()
+
+    print(f"  Second launch: median {statistics.median(launches):.1f} ms "
+          f"(bare interpreter start {statistics.median(baseline):.1f} ms), "
+          f"{len(received) - 1000} of {runs} forwarded")
+    return {'handoff.forward_ms': forward_ms,
+            'handoff.second_launch_ms': statistics.median(launches)}
+
+
+# End-to-end benchmarks: one USBSecurityApp per process, driven by a fake source
+
+_app = None
+
+
+def _bench_app():
+    """The shared offscreen application, started in a scratch directory"""
+    global _app
+    if _app is not None:
+        return _app
+
+    import atexit
+    import shutil
+    import tempfile
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from main import USBSecurityApp
+    from device_sources import ReplaySource
+
+    # config/, logs and metrics land in the scratch directory
+    workdir = tempfile.mkdtemp(prefix='usb-security-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    os.chdir(workdir)
+
+    _app = USBSecurityApp(device_source=ReplaySource([]))
+    if not _wait_until(_app, lambda: _app.started):
+        raise RuntimeError("Application did not start")
+    return _app
+
+
+def _wait_until(app, predicate, timeout=10.0):
+    """Run the Qt event loop until predicate() holds; returns False on timeout"""
+    from PyQt5.QtCore import QEventLoop, QTimer
+    # Keeps WaitForMoreEvents from sleeping past the deadline
+    keepalive = QTimer()
+    keepalive.start(10)
+    deadline = time.monotonic() + timeout
+    try:
+        while not predicate():
+            if time.monotonic() > deadline:
+                return False
+            app.app.processEvents(QEventLoop.AllEvents | QEventLoop.WaitForMoreEvents)
+        return True
+    finally:
+        keepalive.stop()
+
+
+def _submit(app, events):
+    """Feed (event_type, device_info) pairs to the app from a source thread"""
+    thread = threading.Thread(target=lambda: [app.handle_device_event(event_type, dict(info))
+                                              for event_type, info in events])
+    thread.start()
+    return thread
+
+
+def _unlock(app):
+    """Forget every device and close any lockout left by a benchmark"""
+    app.device_table.reconcile([])
+    app.update_lockout()
+    _wait_until(app, lambda: not app.overlay_active)
+
+
+def _bench_device(number):
+    return {'device': f'/dev/bench{number}', 'disk': f'bench{number}',
+            'drive_letter': f'B{number}:', 'fstype': 'vfat'}
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values), max(1, int(fraction * len(values) + 0.999999))) - 1]
+
+
+def _rss_kb():
+    """Resident set size of this process in KB, or None if unknown"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss // 1024
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def bench_events(count=50000):
+    """Events/s from handle_device_event through the coalescer to the GUI thread"""
+    print("\nBenchmarking end-to-end event throughput...")
+
+    from device_sources import ReplaySource
+    from metrics import DETECTION_LATENCY
+
+    app = _bench_app()
+    storm = [(e['event'], e['device'])
+             for e in ReplaySource.synthetic_storm(count, devices=64, partitions=3)]
+    dispatched_before = DETECTION_LATENCY.count
+    delivered_before = app.event_coalescer.stats()['delivered']
+
+    start = time.perf_counter()
+    _submit(app, storm).join()
+    submitted = time.perf_counter() - start
+    app.event_coalescer.flush()
+    delivered = app.event_coalescer.stats()['delivered'] - delivered_before
+    _wait_until(app, lambda: DETECTION_LATENCY.count - dispatched_before >= delivered)
+    elapsed = time.perf_counter() - start
+    _unlock(app)
+
+    print(f"  {count:,} events submitted in {submitted:.2f}s ({count / submitted:,.0f} events/s)")
+    print(f"  {delivered:,} coalesced events handled on the GUI thread after {elapsed:.2f}s "
+          f"({count / elapsed:,.0f} events/s end to end)")
+    return {'events.events_per_s': count / elapsed}
+
+
+def bench_alerts(cycles=30):
+    """Insertion-to-lock latency (first overlay paint) over repeated alerts"""
+    print("\nBenchmarking alert latency...")
+
+    from metrics import LOCK_LATENCY, FIRST_PAINT, SIGNAL_QUEUE_DELAY, LOCK_SLA
+
+    app = _bench_app()
+    _unlock(app)
+    latencies, paints, queue_delays = [], [], []
+    for number in range(cycles):
+        device = _bench_device(number)
+        locks, first_paints, queued = LOCK_LATENCY.count, FIRST_PAINT.count, SIGNAL_QUEUE_DELAY.count
+        _submit(app, [('device_connected', device)])
+        if not _wait_until(app, lambda: LOCK_LATENCY.count > locks):
+            print("  Overlay never painted; is a display (or QT_QPA_PLATFORM=offscreen) available?")
+            return {}
+        latencies.append(LOCK_LATENCY.last)
+        if FIRST_PAINT.count > first_paints:
+            paints.append(FIRST_PAINT.last)
+        if SIGNAL_QUEUE_DELAY.count > queued:
+            queue_delays.append(SIGNAL_QUEUE_DELAY.last)
+        _submit(app, [('device_removed', device)])
+        _wait_until(app, lambda: not app.overlay_active)
+
+    window_ms = app.event_coalescer.window * 1000
+    print(f"  {cycles} alerts: lock p50 {_percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {_percentile(latencies, 0.99) * 1000:.1f} ms "
+          f"(includes the {window_ms:.0f} ms debounce window; target {LOCK_SLA * 1000:.0f} ms)")
+    print(f"  Overlay show to first paint p99 {_percentile(paints, 0.99) * 1000:.1f} ms, "
+          f"signal queue delay p99 {_percentile(queue_delays, 0.99) * 1000:.2f} ms")
+    return {'alert.lock_p50_ms': _percentile(latencies, 0.5) * 1000,
+            'alert.lock_p99_ms': _percentile(latencies, 0.99) * 1000,
+            'alert.first_paint_p99_ms': _percentile(paints, 0.99) * 1000}
+
+
+def bench_log(count=50000):
+    """Security log append throughput including fsync batching"""
+    print("\nBenchmarking security log writes...")
+
+    import tempfile
+    from security_log import SecurityLog
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        log = SecurityLog(log_dir)
+        device = _bench_device(0)
+        start = time.perf_counter()
+        for _ in range(count):
+            log.append('DEVICE_CONNECTED', device)
+        log.flush()
+        elapsed = time.perf_counter() - start
+        log.close()
+
+    print(f"  {count:,} records written and synced in {elapsed:.2f}s "
+          f"({count / elapsed:,.0f} records/s)")
+    return {'log.records_per_s': count / elapsed}
+
+
+def bench_lockout(seconds=30):
+    """Memory of the running app while an overlay stays up"""
+    print("\nBenchmarking memory during a lockout...")
+
+    import tracemalloc
+    from metrics import LOCK_LATENCY
+
+    app = _bench_app()
+    _unlock(app)
+    device = _bench_device(10000)
+    locks = LOCK_LATENCY.count
+    _submit(app, [('device_connected', device)])
+    if not _wait_until(app, lambda: LOCK_LATENCY.count > locks):
+        print("  Overlay never painted")
+        return {}
+
+    tracemalloc.start()
+    rss_start = _rss_kb()
+    samples = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        _wait_until(app, lambda: False, timeout=1.0)
+        samples.append(_rss_kb())
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_end = _rss_kb()
+
+    _submit(app, [('device_removed', device)])
+    _wait_until(app, lambda: not app.overlay_active)
+
+    results = {'lockout.python_alloc_kb': current / 1024, 'lockout.python_peak_kb': peak / 1024}
+    print(f"  Python allocations after {seconds}s: {current / 1024:.0f} KB "
+          f"(peak {peak / 1024:.0f} KB)")
+    if rss_start is not None:
+        print(f"  RSS {rss_start / 1024:.1f} MB -> {rss_end / 1024:.1f} MB "
+              f"(max {max(samples) / 1024:.1f} MB)")
+        results['lockout.rss_growth_kb'] = rss_end - rss_start
+    return results
+
+
+def bench_soak(alerts=2000, warmup=2100, dialog_every=50):
+    """
+    Memory stays flat over thousands of alerts: cycles lockouts (and opens
+    the dialogs now and then), sampling RSS and tracemalloc after a warmup
+    """
+    print("\nSoak test: repeated alerts...")
+
+    import tracemalloc
+    from PyQt5.QtCore import QTimer
+    from metrics import LOCK_LATENCY
+
+    app = _bench_app()
+    _unlock(app)
+    # Memory, not latency, is measured here; don't wait out the debounce window
+    window, app.event_coalescer.window = app.event_coalescer.window, 0.005
+
+    def open_dialog(name, show):
+        # Close the modal dialog from inside its own event loop
+        QTimer.singleShot(0, lambda: app.dialogs[name].reject())
+        show()
+
+    def cycle(number):
+        device = _bench_device(number % 64)
+        locks = LOCK_LATENCY.count
+        _submit(app, [('device_connected', device)])
+        if not _wait_until(app, lambda: LOCK_LATENCY.count > locks):
+            raise RuntimeError(f"alert {number} never painted")
+        _submit(app, [('device_removed', device)])
+        _wait_until(app, lambda: not app.overlay_active)
+        if number % dialog_every == 0:
+            open_dialog('logs', app.show_logs)
+            open_dialog('settings', app.show_settings)
+
+    # The warmup also fills the bounded latency reservoirs in metrics.py
+    # (2,048 samples each, one or two per alert)
+    for number in range(warmup):
+        cycle(number)
+    # Let deleteLater() and Python's collector settle before the first sample
+    _wait_until(app, lambda: False, timeout=0.2)
+    import gc
+    gc.collect()
+
+    # Module imports are one-off costs, not leaks
+    ignore = [tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+              tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+              tracemalloc.Filter(False, tracemalloc.__file__)]
+    rss_samples = [_rss_kb()]
+    tracemalloc.start(10)
+    start_snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+    start = time.perf_counter()
+    for number in range(warmup, warmup + alerts):
+        cycle(number)
+        if number % 100 == 0:
+            rss_samples.append(_rss_kb())
+    elapsed = time.perf_counter() - start
+    _wait_until(app, lambda: False, timeout=0.2)
+    gc.collect()
+    growth = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(start_snapshot, 'traceback')
+    tracemalloc.stop()
+    rss_samples.append(_rss_kb())
+
+    python_growth = sum(stat.size_diff for stat in growth) / 1024
+    print(f"  {alerts:,} alerts in {elapsed:.1f}s ({alerts / elapsed:.1f} alerts/s)")
+    print(f"  Python heap growth: {python_growth:+.0f} KB "
+          f"({python_growth / alerts * 1000:+.1f} KB per 1,000 alerts)")
+    for stat in growth[:3]:
+        if stat.size_diff > 0:
+            frame = stat.traceback[-1]
+            print(f"    {stat.size_diff / 1024:+.1f} KB at {frame.filename}:{frame.lineno}")
+    results = {'soak.python_growth_kb': python_growth}
+    if rss_samples[0] is not None:
+        rss_growth = rss_samples[-1] - rss_samples[0]
+        print(f"  RSS {rss_samples[0] / 1024:.1f} MB -> {rss_samples[-1] / 1024:.1f} MB "
+              f"(max {max(rss_samples) / 1024:.1f} MB)")
+        results['soak.rss_growth_kb'] = rss_growth
+
+    app.event_coalescer.window = window
+
+    # Flat means no steady per-alert growth: allow 1 KB per alert of slack
+    flat = python_growth < alerts
+    print(f"  Memory {'flat' if flat else 'GROWING'}")
+    return results
+
+
+def bench_codec(count=200000, devices=500):
+    """Size and load time of the columnar event file against legacy JSON"""
+    print("\nBenchmarking event codec...")
+
+    import tempfile
+    from datetime import datetime, timedelta
+    from event_codec import EventTable
+
+    start_time = datetime(2024, 1, 1)
+    drives = [{'drive_letter': f"{chr(68 + i % 22)}:", 'device': f"/dev/sd{chr(97 + i % 26)}1",
+               'fstype': 'vfat', 'id': f"USBSTOR\\DISK&VEN_TEST&PROD_{i:08d}",
+               'name': f"Drive {i}"} for i in range(devices)]
+    records = [{'timestamp': (start_time + timedelta(seconds=i, microseconds=i % 997)).isoformat(),
+                'event': 'DEVICE_CONNECTED' if i % 2 == 0 else 'DEVICE_REMOVED',
+                'device': drives[random.randrange(devices)]} for i in range(count)]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy_path = os.path.join(workdir, 'security_log.json')
+        packed_path = os.path.join(workdir, 'security_log.evc')
+        with open(legacy_path, 'w') as f:
+            json.dump(records, f, indent=2)
+
+        start = time.perf_counter()
+        EventTable.from_legacy_file(legacy_path).write(packed_path)
+        convert_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(legacy_path, 'r') as f:
+            json.load(f)
+        legacy_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        table = EventTable.read(packed_path)
+        packed_load = time.perf_counter() - start
+
+        legacy_size = os.path.getsize(legacy_path)
+        packed_size = os.path.getsize(packed_path)
+
+        start = time.perf_counter()
+        with open(os.path.join(workdir, 'export.csv'), 'w', newline='') as f:
+            table.export_csv(f)
+        csv_elapsed = time.perf_counter() - start
+
+    print(f"  {count:,} events, {devices:,} devices, converted in {convert_elapsed:.2f}s")
+    print(f"  Size: {legacy_size / 1024:,.0f} KB JSON vs {packed_size / 1024:,.0f} KB packed "
+          f"({legacy_size / packed_size:.1f}x smaller)")
+    print(f"  Load: {legacy_load * 1000:,.1f} ms JSON vs {packed_load * 1000:,.1f} ms packed "
+          f"({legacy_load / packed_load:.0f}x faster)")
+    print(f"  CSV export: {count / csv_elapsed:,.0f} events/s")
+    results['codec.size_ratio'] = legacy_size / packed_size
+    results['codec.load_ms'] = packed_load * 1000
+    results['codec.csv_events_per_s'] = count / csv_elapsed
+    return results
+
+
+def bench_manifest(size=100000, changes=1000):
+    """Verify-and-apply time of a large whitelist manifest, full and incremental"""
+    print("\nBenchmarking whitelist manifest...")
+
+    import tempfile
+    from whitelist_store import WhitelistStore
+    from whitelist_manifest import ManagedWhitelist, sign_manifest
+
+    key = b'benchmark-key'
+    fleet = [{'id': f"USBSTOR\\DISK&VEN_FLEET&PROD_{i:08d}", 'name': f"Drive {i}"} for i in range(size)]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        key_path = os.path.join(workdir, 'manifest.key')
+        with open(key_path, 'wb') as f:
+            f.write(key)
+        source = os.path.join(workdir, 'fleet.manifest')
+        managed = ManagedWhitelist(os.path.join(workdir, 'active.manifest'), key_path)
+        store = WhitelistStore()
+
+        for label, version, entries in (('full', 1, fleet),
+                                         ('incremental', 2, fleet[changes:] + fleet[:changes // 2])):
+            with open(source, 'wb') as f:
+                f.write(sign_manifest(entries, version, key))
+            start = time.perf_counter()
+            manifest, diff = managed.prepare(source)
+            prepared = time.perf_counter()
+            managed.apply(store, manifest, diff)
+            applied = time.perf_counter()
+            print(f"  {label:<11} {diff.summary():<36} verify+diff {(prepared - start) * 1000:6.0f} ms "
+                  f"(worker), apply {(applied - prepared) * 1000:5.1f} ms (GUI thread)")
+            results[f'manifest.{label}_prepare_ms'] = (prepared - start) * 1000
+            results[f'manifest.{label}_apply_ms'] = (applied - prepared) * 1000
+    return results
+
+
+def bench_whitelist_search(size=1000000, pages=200):
+    """Index build and type-ahead page time of a very large whitelist"""
+    print("\nBenchmarking whitelist search...")
+
+    import random
+    from whitelist_store import WhitelistStore, WhitelistSearch
+
+    rng = random.Random(1)
+    store = WhitelistStore()
+    store.apply_changes((f"usbstor\\disk&ven_fleet&prod_{i:08d}",
+                         {'id': f"USBSTOR\\DISK&VEN_FLEET&PROD_{i:08d}", 'name': f"Drive {rng.randrange(size)}"})
+                        for i in range(size))
+    search = WhitelistSearch(store)
+
+    start = time.perf_counter()
+    snapshot = search.snapshot()
+    snapshotted = time.perf_counter()
+    search.install(search.build(snapshot))
+    built = time.perf_counter()
+
+    prefixes = [f"drive {rng.randrange(1000)}" for _ in range(pages // 2)]
+    prefixes += [f"usbstor\\disk&ven_fleet&prod_{rng.randrange(10000):04d}" for _ in range(pages // 2)]
+    page_start = time.perf_counter()
+    for prefix in prefixes:
+        search.search(prefix, limit=200)
+    page_ms = (time.perf_counter() - page_start) * 1000 / len(prefixes)
+
+    edit_start = time.perf_counter()
+    for i in range(100):
+        store.add(f"BENCH-{i}", f"Bench {i}")
+        store.remove(f"BENCH-{i}")
+    edit_ms = (time.perf_counter() - edit_start) * 1000 / 200
+
+    print(f"  {size:,} entries: snapshot {(snapshotted - start) * 1000:.0f} ms (GUI thread), "
+          f"build {built - snapshotted:.2f} s (worker)")
+    print(f"  200-row page {page_ms:.2f} ms, single add/remove {edit_ms:.2f} ms")
+    return {
+        'search.snapshot_ms': (snapshotted - start) * 1000,
+        'search.build_s': built - snapshotted,
+        'search.page_ms': page_ms,
+        'search.edit_ms': edit_ms,
+    }
+
+
+def bench_scan(files=2000, file_kb=64, large_mb=64):
+    """Content scan throughput over a temporary volume of small files and one large file"""
+    print("\nBenchmarking content scan...")
+
+    import tempfile
+    from blocklist import Blocklist
+    from content_scanner import ContentScanner
+
+    with tempfile.TemporaryDirectory() as volume:
+        for i in range(files):
+            folder = os.path.join(volume, f"dir{i % 50}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"file{i}.bin"), 'wb') as f:
+                f.write(os.urandom(file_kb * 1024))
+        with open(os.path.join(volume, 'disk.img'), 'wb') as f:
+            for _ in range(large_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        blocklist = Blocklist('hashes', os.path.join(volume, 'no-blocklists'))
+        result = ContentScanner(blocklist).scan_now(volume)
+        print(f"  {result.verdict}: {result.summary()}")
+    return {'scan.mb_per_s': result.mb_per_s, 'scan.files_per_s': result.files_per_s}
+
+
+def bench_blocklist(size=1000000, lookups=200000):
+    """Known-bad blocklist compile time, lookup cost and resident size per key"""
+    print("\nBenchmarking blocklist...")
+
+    import shutil
+    import tempfile
+    from blocklist import Blocklist, import_feed, serial_key, FENCE_BYTES
+
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        path, count = import_feed('serials', (f"SN{i:012d}" for i in range(size)), directory)
+        build_s = time.perf_counter() - start
+        blocklist = Blocklist('serials', directory)
+        blocklist.refresh()
+
+        # Device events ask about unlisted serials; the key path is what they cost after the first event
+        keys = [serial_key(f"UNLISTED{i}") for i in range(lookups)]
+        contains_key = blocklist.contains_key
+        start = time.perf_counter()
+        for key in keys:
+            contains_key(key)
+        lookup_ns = (time.perf_counter() - start) / lookups * 1e9
+        serials = [f"DEVICE{i}" for i in range(64)] * (lookups // 64)
+        start = time.perf_counter()
+        for serial in serials:
+            serial in blocklist
+        serial_ns = (time.perf_counter() - start) / len(serials) * 1e9
+
+        # Only the bloom filter and fence are touched by a miss; the sorted keys stay on disk
+        bloom_bytes = len(blocklist._table[0])
+        resident_mb_10m = (bloom_bytes / count * 10000000 + FENCE_BYTES) / 1048576
+        print(f"  {count:,} serials compiled in {build_s:.2f} s ({os.path.getsize(path) / 1048576:.1f} MB file)")
+        print(f"  lookup {lookup_ns:.0f} ns per key, {serial_ns:.0f} ns per serial; "
+              f"10M entries keep {resident_mb_10m:.1f} MB resident")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'blocklist.build_s': build_s,
+        'blocklist.lookup_ns': lookup_ns,
+        'blocklist.serial_ns': serial_ns,
+        'blocklist.resident_mb_10m': resident_mb_10m,
+    }
+
+
+# Baselines
+
+def environment():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'machine': platform.machine()}
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    """Write results as the new baseline, keeping metrics not re-measured"""
+    try:
+        with open(path, 'r') as f:
+            baseline = json.load(f).get('results', {})
+    except (OSError, ValueError):
+        baseline = {}
+    baseline.update(results)
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'results': baseline}, f, indent=2, sort_keys=True)
+    print(f"\nBaseline saved to {path} ({len(baseline)} metrics)")
+
+
+def compare(results, baseline, thresholds=None):
+    """
+    Return (metric, baseline, current, change) for every metric that got
+    worse than its threshold allows; change is the fractional slowdown
+    """
+    thresholds = dict(THRESHOLDS, **(thresholds or {}))
+    regressions = []
+    for metric, current in sorted(results.items()):
+        expected = baseline.get(metric)
+        if expected is None or current is None:
+            continue
+        if metric in HIGHER_IS_BETTER:
+            change = (expected - current) / expected if expected else 0.0
+        else:
+            slack = next((amount for suffix, amount in ABSOLUTE_SLACK.items()
+                          if metric.endswith(suffix)), 0)
+            if current - expected <= slack:
+                continue
+            # Memory growth can legitimately be ~0; don't divide by it
+            change = (current - expected) / max(abs(expected), 1e-9)
+        if change > thresholds.get(metric, DEFAULT_THRESHOLD):
+            regressions.append((metric, expected, current, change))
+    return regressions
+
+
+def check_baseline(results, path=BASELINE_FILE):
+    """Print a comparison with the saved baseline; returns the number of regressions"""
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"\nNo usable baseline at {path}: {e}")
+        return 1
+    baseline = saved.get('results', {})
+    if saved.get('environment') != environment():
+        print(f"\nWarning: baseline was recorded on {saved.get('environment')}")
+
+    regressions = compare(results, baseline)
+    print("\nComparison with baseline:")
+    for metric in sorted(results):
+        if metric in baseline:
+            marker = 'REGRESSION' if any(r[0] == metric for r in regressions) else 'ok'
+            print(f"  {metric:<34} {baseline[metric]:>14,.2f} -> {results[metric]:>14,.2f}  {marker}")
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed beyond their threshold")
+    return len(regressions)
+
+
+BENCHMARKS = {
+    'whitelist': bench_whitelist_lookup,
+    'storm': bench_event_storm,
+    'startup': bench_startup,
+    'overlay': bench_overlay,
+    'handoff': bench_handoff,
+    'policy': bench_policy,
+    'events': bench_events,
+    'alerts': bench_alerts,
+    'log': bench_log,
+    'lockout': bench_lockout,
+    'soak': bench_soak,
+    'codec': bench_codec,
+    'manifest': bench_manifest,
+    'search': bench_whitelist_search,
+    'scan': bench_scan,
+    'blocklist': bench_blocklist,
+}
+
+
+def parse_arguments(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="USB Security Software benchmarks")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--save-baseline', action='store_true',
+                      help="record the results as the baseline")
+    mode.add_argument('--check', action='store_true',
+                      help="exit with status 1 if any metric regressed against the baseline")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline file")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Run the selected benchmarks (all by default)"""
+    args = parse_arguments(sys.argv[1:])
+    print("USB Security Software - Benchmarks")
+    print("=" * 50)
+
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name} (available: {', '.join(BENCHMARKS)})")
+            return 1
+
+    # The baseline file path is resolved before the app benchmarks chdir
+    baseline = os.path.abspath(args.baseline)
+    results = {}
+    for name in names:
+        results.update(BENCHMARKS[name]() or {})
+
+    if args.save_baseline:
+        save_baseline(results, baseline)
+    elif args.check:
+        return 1 if check_baseline(results, baseline) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Known-bad device serial and file hash blocklists for USB Security Software
+Threat-intel feeds run to millions of entries, so each blocklist is compiled
+into one file that is memory-mapped instead of loaded: a two-probe bloom
+filter that answers the usual case (not listed) after one or two bit tests,
+then a fence table and the sorted 16-byte keys, binary-searched only to
+confirm a bloom hit.
+A feed update writes the next generation of the file and renames it into
+place; readers switch to it on their next refresh()
+Usage: python blocklist.py import <serials | hashes> <feed.txt> [--dir DIR]
+       python blocklist.py check <serials | hashes> <value> [--dir DIR]
+"""
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+
+BLOCKLIST_DIR = os.path.join('config', 'blocklists')
+FILE_SUFFIX = '.blk'
+
+MAGIC = b'USBBLK01'
+# magic, key count, bloom bits
+HEADER = struct.Struct('<8sQQ')
+KEY_SIZE = 16
+# The two bloom probes are the key's halves: keys are uniform hashes already
+PROBES = struct.Struct('<QQ')
+# 20 bits per key keeps two probes at about 1% false positives (25 MB per 10M keys)
+BLOOM_BITS_PER_KEY = 20
+# Keys are bucketed by their first two bytes; the fence holds each bucket's first index
+FENCE_ENTRIES = 65536 + 1
+FENCE_BYTES = FENCE_ENTRIES * 8
+# Serial keys remembered per Blocklist (the device path asks about the same few)
+KEY_CACHE_SIZE = 4096
+
+
+def serial_key(value):
+    """16-byte key of a device serial number (case and surrounding space ignored)"""
+    text = str(value or '').strip().upper()
+    if not text:
+        return None
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+
+def hash_key(value):
+    """16-byte key of a file digest (hex or raw bytes): its leading bytes"""
+    if isinstance(value, (bytes, bytearray)):
+        digest = bytes(value)
+    else:
+        try:
+            digest = bytes.fromhex(value.strip())
+        except (AttributeError, ValueError):
+            return None
+    return digest[:KEY_SIZE] if len(digest) >= KEY_SIZE else None
+
+
+KEY_FUNCTIONS = {'serials': serial_key, 'hashes': hash_key}
+
+
+def _generation(name, kind):
+    prefix = kind + '-'
+    if name.startswith(prefix) and name.endswith(FILE_SUFFIX):
+        try:
+            return int(name[len(prefix):-len(FILE_SUFFIX)])
+        except ValueError:
+            return None
+    return None
+
+
+def list_generations(kind, directory=BLOCKLIST_DIR):
+    """Return [(generation, path)] of a blocklist kind, oldest first"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    found = ((_generation(name, kind), name) for name in names)
+    return sorted((number, os.path.join(directory, name)) for number, name in found if number is not None)
+
+
+def write_blocklist(keys, path):
+    """Compile an iterable of 16-byte keys into a blocklist file; returns the distinct key count"""
+    # Radix-partition first: one bytearray per bucket instead of a bytes object per key
+    buckets = [bytearray() for _ in range(FENCE_ENTRIES - 1)]
+    for key in keys:
+        buckets[key[0] << 8 | key[1]] += key
+    total = sum(len(bucket) for bucket in buckets) // KEY_SIZE
+    bits = max(64, total * BLOOM_BITS_PER_KEY)
+    bloom = bytearray((bits + 7) // 8)
+    fence = array('Q', [0])
+    keys_start = HEADER.size + FENCE_BYTES + len(bloom)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.seek(keys_start)
+            count = 0
+            for number, bucket in enumerate(buckets):
+                if bucket:
+                    ordered = sorted({bytes(bucket[i:i + KEY_SIZE]) for i in range(0, len(bucket), KEY_SIZE)})
+                    buckets[number] = None
+                    for key in ordered:
+                        for probe in PROBES.unpack(key):
+                            position = probe % bits
+                            bloom[position >> 3] |= 1 << (position & 7)
+                    f.write(b''.join(ordered))
+                    count += len(ordered)
+                fence.append(count)
+
+            if sys.byteorder == 'big':
+                fence.byteswap()
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, count, bits))
+            f.write(fence.tobytes())
+            f.write(bloom)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return count
+
+
+def read_feed(path):
+    """Yield the entries of a feed file: one per line, '#' starts a comment"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            value = line.split('#', 1)[0].strip()
+            if value:
+                yield value
+
+
+def import_feed(kind, values, directory=BLOCKLIST_DIR):
+    """
+    Compile feed values into the next generation of a blocklist and retire
+    older generations; returns (path, key count)
+    """
+    key_function = KEY_FUNCTIONS[kind]
+    os.makedirs(directory, exist_ok=True)
+    generations = list_generations(kind, directory)
+    number = generations[-1][0] + 1 if generations else 1
+    path = os.path.join(directory, f"{kind}-{number:06d}{FILE_SUFFIX}")
+    count = write_blocklist((key for key in map(key_function, values) if key), path)
+    for _, old_path in generations:
+        try:
+            os.remove(old_path)
+        except OSError:
+            # Still mapped by a reader on Windows; removed by a later import
+            pass
+    return path, count
+
+
+class Blocklist:
+    """
+    Read side of one blocklist kind. Lookups take no lock: refresh()
+    replaces the mapped table in a single assignment, and a lookup that
+    started on the old table keeps it alive until it returns.
+    """
+
+    def __init__(self, kind, directory=BLOCKLIST_DIR):
+        self.kind = kind
+        self.directory = directory
+        self.key_function = KEY_FUNCTIONS[kind]
+        self.path = None
+        self._directory_mtime = None
+        # (bloom, bits, fence, keys, count) of the mapped generation
+        self._table = None
+        self._key_cache = {} if kind == 'serials' else None
+
+    def refresh(self):
+        """Map the newest generation if a new one appeared; returns True if switched"""
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._directory_mtime:
+            return False
+
+        generations = list_generations(self.kind, self.directory)
+        path = generations[-1][1] if generations else None
+        if path == self.path:
+            self._directory_mtime = mtime
+            return False
+        try:
+            table = self._map(path) if path else None
+        except (OSError, ValueError) as e:
+            # Leave the mtime unrecorded so the next refresh() tries again
+            print(f"Blocklist {path} not loaded: {e}")
+            return False
+        self._table = table
+        self.path = path
+        self._directory_mtime = mtime
+        return True
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapped) < HEADER.size + FENCE_BYTES:
+            raise ValueError("truncated blocklist file")
+        magic, count, bits = HEADER.unpack_from(mapped)
+        bloom_start = HEADER.size + FENCE_BYTES
+        keys_start = bloom_start + (bits + 7) // 8
+        if magic != MAGIC or not bits or len(mapped) != keys_start + count * KEY_SIZE:
+            raise ValueError("not a blocklist file")
+
+        fence = array('Q')
+        fence.frombytes(mapped[HEADER.size:bloom_start])
+        if sys.byteorder == 'big':
+            fence.byteswap()
+        view = memoryview(mapped)
+        return view[bloom_start:keys_start], bits, fence, view[keys_start:], count
+
+    def contains_key(self, key, _probes=PROBES.unpack):
+        """Membership of a 16-byte key"""
+        table = self._table
+        if table is None:
+            return False
+        bloom, bits = table[0], table[1]
+        first, second = _probes(key)
+        position = first % bits
+        if not bloom[position >> 3] & (1 << (position & 7)):
+            return False
+        position = second % bits
+        if not bloom[position >> 3] & (1 << (position & 7)):
+            return False
+        return self._confirm(key, table[2], table[3])
+
+    @staticmethod
+    def _confirm(key, fence, keys):
+        """Rule out a bloom false positive by binary search in the key's bucket"""
+        bucket = key[0] << 8 | key[1]
+        low, high = fence[bucket], fence[bucket + 1]
+        while low < high:
+            middle = (low + high) // 2
+            candidate = keys[middle * KEY_SIZE:(middle + 1) * KEY_SIZE].tobytes()
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return True
+        return False
+
+    def __contains__(self, value):
+        cache = self._key_cache
+        if cache is None:
+            key = self.key_function(value)
+        else:
+            key = cache.get(value)
+            if key is None:
+                if len(cache) >= KEY_CACHE_SIZE:
+                    cache.clear()
+                key = cache[value] = self.key_function(value) or b''
+        return bool(key) and self.contains_key(key)
+
+    def __len__(self):
+        table = self._table
+        return table[4] if table else 0
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Compile or query known-bad blocklists")
+    parser.add_argument('command', choices=('import', 'check'))
+    parser.add_argument('kind', choices=sorted(KEY_FUNCTIONS))
+    parser.add_argument('value', help="feed file (import) or serial/hash (check)")
+    parser.add_argument('--dir', default=BLOCKLIST_DIR, help="blocklist directory")
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        try:
+            path, count = import_feed(args.kind, read_feed(args.value), args.dir)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"{count:,} {args.kind} written to {path} ({os.path.getsize(path) / 1048576:.1f} MB)")
+        return 0
+
+    blocklist = Blocklist(args.kind, args.dir)
+    blocklist.refresh()
+    listed = args.value in blocklist
+    print(f"{args.value}: {'listed' if listed else 'not listed'} ({len(blocklist):,} {args.kind})")
+    return 0 if listed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
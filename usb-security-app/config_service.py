@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Live configuration for USB Security Software
+Watches config/ (inotify on Linux, polling elsewhere), parses and validates
+settings.json on the watcher thread and reports typed per-key changes, so
+pushed configuration takes effect without restarting the application
+"""
+
+import os
+import sys
+import json
+import select
+import struct
+import threading
+from collections import namedtuple
+
+CONFIG_DIR = 'config'
+SETTINGS_FILE = 'settings.json'
+
+COLLECTOR_SCHEMES = ('http', 'https', 'syslog', 'syslog+udp', 'syslog+tcp')
+
+# key -> (type, default, check); check returns True for acceptable values
+SETTINGS_SCHEMA = {
+    'lockout_duration': (int, 15, lambda v: 1 <= v <= 60),   # minutes
+    'enable_blinking': (bool, True, None),
+    'enable_notifications': (bool, True, None),
+    'auto_start': (bool, True, None),
+    'debounce_window_ms': (int, 150, lambda v: 0 <= v <= 5000),
+    'overlay_renderer': (str, 'prerendered', lambda v: v in ('prerendered', 'classic')),
+    'metrics_port': (int, 0, lambda v: 0 <= v <= 65535),            # 0 = file only
+    # '' = no shipping; http(s)://..., syslog://host[:port] or syslog+tcp://host[:port]
+    'log_collector': (str, '', lambda v: not v or v.split('://')[0] in COLLECTOR_SCHEMES),
+    'log_compression': (str, 'gzip', lambda v: v in ('gzip', 'zstd', 'none')),
+    # Scan devices nothing else trusts; a clean scan lifts the lockout
+    'content_scan': (bool, False, None),
+    'scan_workers': (int, 0, lambda v: 0 <= v <= 32),              # 0 = up to 4
+    'scan_max_mb_per_s': (int, 20, lambda v: 0 <= v <= 10000),     # 0 = unlimited
+    'scan_timeout': (int, 300, lambda v: 10 <= v <= 86400),        # seconds
+    'scan_blocked_extensions': (list, [], lambda v: all(isinstance(e, str) for e in v)),
+    'scan_block_executables': (bool, False, None),
+    # Accept whitelist manifests with a plain SHA-256 instead of an HMAC (no authenticity)
+    'manifest_integrity_only': (bool, False, None),
+    'whitelist': (list, [], lambda v: all(isinstance(e, dict) for e in v)),
+}
+
+ConfigChange = namedtuple('ConfigChange', 'key old new')
+
+
+def default_settings():
+    return {key: (list(default) if isinstance(default, list) else default)
+            for key, (_, default, _) in SETTINGS_SCHEMA.items()}
+
+
+def validate_settings(raw, current=None):
+    """
+    Return (settings, problems). Invalid or missing keys keep their current
+    value (or the default); unknown keys are passed through untouched.
+    """
+    base = dict(current) if current is not None else default_settings()
+    problems = []
+    if not isinstance(raw, dict):
+        return base, ["settings must be a JSON object"]
+
+    settings = dict(base)
+    for key, value in raw.items():
+        if key not in SETTINGS_SCHEMA:
+            settings[key] = value
+            continue
+        expected, _, check = SETTINGS_SCHEMA[key]
+        # bool is an int subclass; don't accept True as a duration
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            problems.append(f"{key}: expected {expected.__name__}, got {type(value).__name__}")
+        elif check and not check(value):
+            problems.append(f"{key}: {value!r} is out of range")
+        else:
+            settings[key] = value
+    return settings, problems
+
+
+def load_settings(path=os.path.join(CONFIG_DIR, SETTINGS_FILE), current=None):
+    """Read and validate a settings file, reporting (not swallowing) problems"""
+    try:
+        with open(path, 'r') as f:
+            raw = json.load(f)
+    except FileNotFoundError:
+        return dict(current) if current is not None else default_settings()
+    except (OSError, ValueError) as e:
+        print(f"Settings not loaded from {path}: {e}")
+        return dict(current) if current is not None else default_settings()
+
+    settings, problems = validate_settings(raw, current)
+    for problem in problems:
+        print(f"Ignoring invalid setting in {path}: {problem}")
+    return settings
+
+
+def diff_settings(old, new):
+    """List ConfigChange entries for every key whose value differs"""
+    return [ConfigChange(key, old.get(key), new.get(key))
+            for key in sorted(set(old) | set(new)) if old.get(key) != new.get(key)]
+
+
+class ConfigWatcher:
+    """
+    Calls callback(name) on a background thread when one of `names` in
+    `directory` is written, replaced or removed
+    """
+
+    # inotify event bits
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory, names, callback, interval=2.0):
+        self.directory = directory
+        self.names = set(names)
+        self.callback = callback
+        self.interval = interval
+        self.backend = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._inotify_fd = None
+        self._wake_read = self._wake_write = None
+
+    def _open_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+            if fd < 0:
+                return None
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_DELETE
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._inotify_fd = self._open_inotify()
+        if self._inotify_fd is not None:
+            self.backend = 'inotify'
+            self._wake_read, self._wake_write = os.pipe()
+            target = self._run_inotify
+        else:
+            self.backend = 'poll'
+            target = self._run_poll
+        self._thread = threading.Thread(target=target, name="config-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._wake_write is not None:
+            os.write(self._wake_write, b'x')
+        if self._thread:
+            self._thread.join(self.interval + 1)
+        for fd in (self._inotify_fd, self._wake_read, self._wake_write):
+            if fd is not None:
+                os.close(fd)
+        self._inotify_fd = self._wake_read = self._wake_write = None
+
+    def _notify(self, names):
+        for name in sorted(names):
+            try:
+                self.callback(name)
+            except Exception as e:
+                print(f"Error applying change to {name}: {e}")
+
+    def _run_inotify(self):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._inotify_fd, self._wake_read], [], [])
+            if self._wake_read in readable:
+                return
+            try:
+                data = os.read(self._inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            changed = set()
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+                offset += length
+                if name in self.names:
+                    changed.add(name)
+            self._notify(changed)
+
+    def _signatures(self):
+        signatures = {}
+        for name in self.names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+                signatures[name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signatures[name] = None
+        return signatures
+
+    def _run_poll(self):
+        known = self._signatures()
+        while not self._stop_event.wait(self.interval):
+            current = self._signatures()
+            self._notify(name for name in current if current[name] != known.get(name))
+            known = current
+
+
+class ConfigService:
+    """
+    Current validated settings plus change notification. callback(changes)
+    receives a list of ConfigChange and runs on the watcher thread.
+    """
+
+    def __init__(self, path=os.path.join(CONFIG_DIR, SETTINGS_FILE), writer=None, interval=2.0):
+        self.path = path
+        self.writer = writer
+        self._lock = threading.Lock()
+        self.settings = load_settings(path)
+        self.watcher = ConfigWatcher(os.path.dirname(path) or '.', [os.path.basename(path)],
+                                     self._on_file_changed, interval)
+        self.callback = None
+
+    def start(self, callback):
+        self.callback = callback
+        self.watcher.start()
+
+    def stop(self):
+        self.watcher.stop()
+
+    def get(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def reload(self):
+        """Re-read the file; returns the list of changes applied"""
+        with self._lock:
+            new = load_settings(self.path, current=self.settings)
+            changes = diff_settings(self.settings, new)
+            self.settings = new
+        return changes
+
+    def _on_file_changed(self, name):
+        changes = self.reload()
+        if changes and self.callback:
+            self.callback(changes)
+
+    def save(self, settings):
+        """Adopt and persist settings (our own write then produces no changes)"""
+        with self._lock:
+            self.settings = dict(settings)
+        if self.writer:
+            self.writer.write_json(self.path, self.settings)
+        else:
+            from background_writer import atomic_write
+            atomic_write(self.path, json.dumps(self.settings, indent=2))
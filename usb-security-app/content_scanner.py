@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Content scanning of newly connected volumes for USB Security Software
+A device that neither a policy rule nor the whitelist trusts can be cleared
+by scanning it instead of being locked out for the full lockout duration.
+A coordinating thread walks the volume and hands batches of files to a
+process pool, where each file is hashed with throttled streaming (or, for
+large files, mmap) reads; digests are checked against the hash blocklist
+and names and leading bytes against file-type rules. The first hit blocks
+the device and stops the scan
+Usage: python content_scanner.py <directory> [--blocklist-dir DIR] [--workers N] [--max-mb-per-s N]
+"""
+
+import os
+import sys
+import mmap
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from metrics import registry
+
+READ_BLOCK = 1024 * 1024
+# Files at least this large are hashed through mmap instead of read()
+MMAP_THRESHOLD = 8 * 1024 * 1024
+HEADER_BYTES = 16
+
+# Leading bytes of native executables, whatever their file name says
+EXECUTABLE_MAGIC = {b'MZ': 'Windows executable', b'\x7fELF': 'ELF executable',
+                    b'\xcf\xfa\xed\xfe': 'Mach-O executable'}
+
+SCANS = registry.counter('content_scans_total', "Finished content scans by verdict", ('verdict',))
+SCANNED_BYTES = registry.counter('content_scan_bytes_total', "Bytes hashed by content scans")
+SCAN_THROUGHPUT = registry.gauge('content_scan_mb_per_second', "Read throughput of the last content scan")
+
+
+class ScanCancelled(Exception):
+    """Raised in a worker once the scan it works for was cancelled"""
+
+
+class FileTypeRules:
+    """Blocks files by name, extension or, optionally, executable content"""
+
+    def __init__(self, blocked_names=('autorun.inf',), blocked_extensions=(), block_executables=False):
+        self.blocked_names = {name.lower() for name in blocked_names}
+        self.blocked_extensions = {ext.lower() if ext.startswith('.') else '.' + ext.lower()
+                                   for ext in blocked_extensions}
+        self.block_executables = block_executables
+
+    def check_name(self, name):
+        """Return why a file name is blocked, or None"""
+        lowered = name.lower()
+        if lowered in self.blocked_names:
+            return f"blocked file {name}"
+        extension = os.path.splitext(lowered)[1]
+        if extension and extension in self.blocked_extensions:
+            return f"blocked file type {extension}"
+        return None
+
+    def check_header(self, header):
+        """Return why a file's leading bytes are blocked, or None"""
+        if self.block_executables and header:
+            for magic, kind in EXECUTABLE_MAGIC.items():
+                if header.startswith(magic):
+                    return kind
+        return None
+
+
+class Throttle:
+    """Paces reads to an average of `rate` bytes per second (0 = unlimited)"""
+
+    def __init__(self, rate, cancel=None):
+        self.rate = rate
+        self.cancel = cancel
+        self.next_read = time.monotonic()
+
+    def __call__(self, size):
+        if self.cancel is not None and self.cancel.is_set():
+            raise ScanCancelled()
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.next_read = max(self.next_read, now) + size / self.rate
+        # Sleep off any debt beyond a small burst, waking early on cancel
+        delay = self.next_read - now - 0.05
+        if delay > 0:
+            if self.cancel is not None and self.cancel.wait(delay):
+                raise ScanCancelled()
+            if self.cancel is None:
+                time.sleep(delay)
+
+
+def hash_file(path, throttle=None, block=READ_BLOCK):
+    """Return (sha256 hex digest, size, leading bytes) of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                header = mapped[:HEADER_BYTES]
+                for start in range(0, size, block):
+                    if throttle:
+                        throttle(min(block, size - start))
+                    digest.update(mapped[start:start + block])
+            return digest.hexdigest(), size, header
+
+        buffer = bytearray(block)
+        view = memoryview(buffer)
+        header = None
+        size = 0
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            if throttle:
+                throttle(count)
+            if header is None:
+                header = bytes(view[:HEADER_BYTES])
+            digest.update(view[:count])
+            size += count
+        return digest.hexdigest(), size, header or b''
+
+
+# Worker process state, set once per process by _init_worker
+_worker = {}
+
+
+def _init_worker(cancel, rate, rules):
+    _worker['throttle'] = Throttle(rate, cancel)
+    _worker['rules'] = rules
+
+
+def _hash_batch(paths):
+    """Pool task: [(path, digest or None, size, blocked reason or error)]"""
+    throttle, rules = _worker['throttle'], _worker['rules']
+    results = []
+    for path in paths:
+        try:
+            digest, size, header = hash_file(path, throttle)
+        except ScanCancelled:
+            break
+        except (OSError, ValueError) as e:
+            results.append((path, None, 0, str(e)))
+            continue
+        results.append((path, digest, size, rules.check_header(header)))
+    return results
+
+
+class ScanResult:
+    """Progress or outcome of a scan; verdict is 'scanning' until it ends"""
+
+    def __init__(self, root):
+        self.root = root
+        self.verdict = 'scanning'
+        self.reason = None
+        self.path = None
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.found = 0
+        self.walked = False
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def mb_per_s(self):
+        return self.bytes / 1048576 / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def files_per_s(self):
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        text = (f"{self.files:,} files, {self.bytes / 1048576:.1f} MB in {self.elapsed:.1f} s "
+                f"({self.mb_per_s:.1f} MB/s, {self.files_per_s:.0f} files/s)")
+        if self.reason:
+            where = f": {self.path}" if self.path else ""
+            text = f"{self.reason}{where} - {text}"
+        return text
+
+    def to_dict(self):
+        return {'verdict': self.verdict, 'reason': self.reason, 'path': self.path,
+                'files': self.files, 'bytes': self.bytes, 'errors': self.errors,
+                'seconds': round(self.elapsed, 3), 'mb_per_s': round(self.mb_per_s, 2),
+                'files_per_s': round(self.files_per_s, 1)}
+
+
+class ScanJob:
+    """
+    One scan of one directory tree on its own coordinating thread.
+    on_progress(result) is called every progress_interval seconds and
+    on_done(result) once at the end, both on the coordinating thread.
+    """
+
+    def __init__(self, scanner, root, on_progress=None, on_done=None):
+        self.scanner = scanner
+        self.root = root
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.result = ScanResult(root)
+        self.cancelled = False
+        # Never fork: the caller is typically a multithreaded Qt process
+        self._context = multiprocessing.get_context('spawn')
+        # Seen by the workers too; set to stop them mid-file
+        self._cancel = self._context.Event()
+        self._thread = threading.Thread(target=self._run, name="content-scan", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop the scan (e.g. the device was removed); it ends as 'cancelled'"""
+        self.cancelled = True
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        return self.result
+
+    def _walk(self):
+        """Yield (path, name) of regular files below root, not following links"""
+        stack = [self.root]
+        while stack and not self._cancel.is_set():
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                yield entry.path, entry.name
+                        except OSError:
+                            self.result.errors += 1
+            except OSError:
+                self.result.errors += 1
+        self.result.walked = True
+
+    def _finish(self, verdict, reason=None, path=None):
+        if self.result.verdict == 'scanning':
+            self.result.verdict = verdict
+            self.result.reason = reason
+            self.result.path = path
+
+    def _run(self):
+        scanner, result = self.scanner, self.result
+        try:
+            scanner.blocklist.refresh()
+            self._scan()
+        except Exception as e:
+            self._finish('error', str(e))
+        result.elapsed = time.monotonic() - result.started
+        if self.cancelled:
+            self._finish('cancelled')
+        elif result.errors:
+            # Whatever we could not read may be exactly what a blocklist would catch
+            self._finish('incomplete', f"{result.errors:,} unreadable files or directories")
+        elif not result.walked:
+            self._finish('incomplete', "volume was not fully walked")
+        self._finish('allow')
+        SCANS.inc(1, result.verdict)
+        SCANNED_BYTES.inc(result.bytes)
+        SCAN_THROUGHPUT.set(round(result.mb_per_s, 2))
+        if self.on_done:
+            self.on_done(result)
+
+    def _scan(self):
+        scanner, result = self.scanner, self.result
+        workers = scanner.workers
+        deadline = result.started + scanner.timeout if scanner.timeout else None
+        next_progress = result.started + scanner.progress_interval
+        pending = set()
+        batch = []
+        batch_bytes = 0
+
+        # Each worker gets an equal share of the bandwidth cap
+        pool = ProcessPoolExecutor(workers, mp_context=self._context, initializer=_init_worker,
+                                   initargs=(self._cancel, scanner.max_bytes_per_s / workers,
+                                             scanner.rules))
+        try:
+            def collect():
+                done, still_pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                pending.intersection_update(still_pending)
+                for future in done:
+                    for path, digest, size, problem in future.result():
+                        if digest is None:
+                            result.errors += 1
+                            continue
+                        result.files += 1
+                        result.bytes += size
+                        if problem:
+                            self._finish('block', problem, path)
+                        elif digest in scanner.blocklist:
+                            self._finish('block', "known-bad file hash", path)
+
+            def checkpoint():
+                nonlocal next_progress
+                now = time.monotonic()
+                if deadline and now > deadline:
+                    self._finish('incomplete', f"scan did not finish within {scanner.timeout} s")
+                if result.verdict != 'scanning':
+                    self._cancel.set()
+                if self.on_progress and now >= next_progress:
+                    result.elapsed = now - result.started
+                    next_progress = now + scanner.progress_interval
+                    self.on_progress(result)
+                return not self._cancel.is_set()
+
+            for path, name in self._walk():
+                result.found += 1
+                problem = scanner.rules.check_name(name)
+                if problem:
+                    self._finish('block', problem, path)
+                if not checkpoint():
+                    break
+                batch.append(path)
+                try:
+                    batch_bytes += os.stat(path, follow_symlinks=False).st_size
+                except OSError:
+                    pass
+                if len(batch) >= scanner.batch_files or batch_bytes >= scanner.batch_bytes:
+                    # Bounded read-ahead: never more than two batches per worker queued
+                    while len(pending) >= workers * 2 and checkpoint():
+                        collect()
+                    pending.add(pool.submit(_hash_batch, batch))
+                    batch, batch_bytes = [], 0
+            if batch and checkpoint():
+                pending.add(pool.submit(_hash_batch, batch))
+            while pending and checkpoint():
+                collect()
+        finally:
+            # Stops workers still busy after a verdict, a cancel or an error
+            self._cancel.set()
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+
+class ContentScanner:
+    """Scan settings shared by every ScanJob"""
+
+    def __init__(self, blocklist, rules=None, workers=0, max_bytes_per_s=0, timeout=0,
+                 batch_files=64, batch_bytes=32 * 1024 * 1024, progress_interval=0.5):
+        self.blocklist = blocklist
+        self.rules = rules or FileTypeRules()
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_bytes_per_s = max_bytes_per_s
+        self.timeout = timeout
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        self.progress_interval = progress_interval
+
+    def scan(self, root, on_progress=None, on_done=None):
+        """Start scanning root in the background; returns the ScanJob"""
+        return ScanJob(self, root, on_progress, on_done).start()
+
+    def scan_now(self, root):
+        """Scan root and wait for the ScanResult"""
+        return self.scan(root).wait()
+
+
+def create_scanner(settings, blocklist=None):
+    """Build a ContentScanner from settings, or None when scanning is off"""
+    if not settings.get('content_scan'):
+        return None
+    from blocklist import Blocklist
+    rules = FileTypeRules(blocked_extensions=settings.get('scan_blocked_extensions', []),
+                          block_executables=settings.get('scan_block_executables', False))
+    return ContentScanner(blocklist or Blocklist('hashes'), rules,
+                          workers=settings.get('scan_workers', 0),
+                          max_bytes_per_s=settings.get('scan_max_mb_per_s', 20) * 1024 * 1024,
+                          timeout=settings.get('scan_timeout', 300))
+
+
+def main(argv):
+    import argparse
+    from blocklist import Blocklist, BLOCKLIST_DIR
+    parser = argparse.ArgumentParser(description="Scan a directory like a newly connected device")
+    parser.add_argument('root')
+    parser.add_argument('--blocklist-dir', default=BLOCKLIST_DIR, help="directory of compiled blocklists")
+    parser.add_argument('--workers', type=int, default=0, help="hashing processes (default: up to 4)")
+    parser.add_argument('--max-mb-per-s', type=float, default=0, help="read bandwidth cap (0 = none)")
+    parser.add_argument('--block-executables', action='store_true')
+    args = parser.parse_args(argv)
+
+    scanner = ContentScanner(Blocklist('hashes', args.blocklist_dir),
+                             FileTypeRules(block_executables=args.block_executables),
+                             workers=args.workers, max_bytes_per_s=int(args.max_mb_per_s * 1048576))
+    result = scanner.scan_now(args.root)
+    print(f"{result.verdict}: {result.summary()}")
+    return 0 if result.verdict == 'allow' else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Client side of the USB Security daemon's control socket
+The daemon speaks newline-delimited JSON over a Unix-domain socket:
+requests are {"id", "method", "params"}, replies {"id", "result"} or
+{"id", "error"}, and subscribed connections also receive {"event", ...}
+notifications. Nothing here imports Qt, so the tray can stay a thin client
+"""
+
+import os
+import json
+import socket
+import threading
+from datetime import datetime
+
+from device_sources import DeviceSource, DEVICE_CONNECTED, DEVICE_REMOVED
+
+# Absolute, so the daemon and every user session find it whatever their working directory
+SOCKET_PATH = os.environ.get('USB_SECURITY_SOCKET', '/run/usb-security.sock')
+
+# Longest single message either side will buffer
+MAX_MESSAGE = 4 * 1024 * 1024
+
+
+class DaemonError(Exception):
+    """Raised when the daemon is unreachable or rejects a request"""
+
+
+def encode_message(message):
+    """Serialize one protocol message as a JSON line"""
+    return (json.dumps(message, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+
+class DaemonClient:
+    """Request/response connection to the daemon"""
+
+    def __init__(self, socket_path=SOCKET_PATH, timeout=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+        self._next_id = 0
+
+    def connect(self):
+        if self._sock is not None:
+            return
+        if not hasattr(socket, 'AF_UNIX'):
+            raise DaemonError("Unix-domain sockets are not available on this platform")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonError(f"Cannot reach daemon at {self.socket_path}: {e}")
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+
+    def send(self, method, **params):
+        """Send a request without waiting; returns its id"""
+        self.connect()
+        self._next_id += 1
+        self._sock.sendall(encode_message({'id': self._next_id, 'method': method, 'params': params}))
+        return self._next_id
+
+    def read_message(self):
+        """Return the next message from the daemon, or None once it hangs up"""
+        line = self._reader.readline(MAX_MESSAGE)
+        if not line:
+            return None
+        return json.loads(line)
+
+    def call(self, method, **params):
+        """Send a request and return its result"""
+        with self._lock:
+            try:
+                request_id = self.send(method, **params)
+                while True:
+                    message = self.read_message()
+                    if message is None:
+                        raise DaemonError("Daemon closed the connection")
+                    if message.get('id') == request_id:
+                        break
+            except (OSError, ValueError) as e:
+                self.close()
+                raise DaemonError(f"Daemon request '{method}' failed: {e}")
+        if 'error' in message:
+            raise DaemonError(message['error'])
+        return message.get('result')
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+            self._reader = None
+
+
+class DaemonEventSource(DeviceSource):
+    """
+    Device events relayed from a running daemon. The daemon has already
+    fingerprinted each partition and decided 'authorized', so the tray only
+    mirrors its verdicts (remote_policy).
+    """
+
+    name = 'daemon'
+    remote_policy = True
+    RECONNECT_DELAY = 2.0
+
+    def __init__(self, callback=None, socket_path=SOCKET_PATH):
+        super().__init__(callback)
+        self.socket_path = socket_path
+        self._client = None
+
+    def client(self):
+        """A fresh request/response connection (not the event stream)"""
+        return DaemonClient(self.socket_path)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._client = DaemonClient(self.socket_path, timeout=None)
+            try:
+                self._client.call('subscribe')
+                while not self._stop_event.is_set():
+                    message = self._client.read_message()
+                    if message is None:
+                        break
+                    self.handle_message(message)
+            except (DaemonError, OSError, ValueError) as e:
+                if not self._stop_event.is_set():
+                    print(f"Daemon event stream lost: {e}")
+            finally:
+                self._client.close()
+            self._stop_event.wait(self.RECONNECT_DELAY)
+
+    def handle_message(self, message):
+        event_type = message.get('event')
+        if event_type not in (DEVICE_CONNECTED, DEVICE_REMOVED):
+            return
+        device_info = message.get('device') or {}
+        trace = device_info.get('trace')
+        # The tray's coalescer merges partitions again
+        for partition in device_info.pop('partitions', None) or [device_info]:
+            if trace:
+                # Keeps the daemon's detection time for the end-to-end latency
+                partition['trace'] = dict(trace)
+            self.emit(event_type, partition)
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        client = self._client
+        if client is not None and client._sock is not None:
+            try:
+                # Unblocks the pending read in run()
+                client._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        super().stop(timeout)
+
+    def get_connected_removable_drives(self):
+        client = self.client()
+        try:
+            return client.call('devices')
+        except DaemonError as e:
+            print(f"Could not list devices from daemon: {e}")
+            return []
+        finally:
+            client.close()
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class RemoteLogQuery:
+    """LogQuery over the daemon's log (same query()/count() interface)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def count(self):
+        return self.client.call('count_log')
+
+    def query(self, limit=50, cursor=None, start=None, end=None, event=None, device=None):
+        result = self.client.call('query_log', limit=limit, cursor=cursor,
+                                  start=_iso(start), end=_iso(end), event=event, device=device)
+        next_cursor = result.get('cursor')
+        return result.get('records', []), tuple(next_cursor) if next_cursor else None
+
+    def last(self, limit=50):
+        return self.query(limit=limit)[0]
+
+
+class RemoteSecurityLog:
+    """Stands in for SecurityLog in the tray when the daemon owns the log"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def import_legacy(self):
+        return 0
+
+    def clear(self):
+        self.client.call('clear_log')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Stable device identities for USB Security Software
+Derives a fingerprint from serial number, vendor/product id, partition UUID
+and size, caches it per device node and remembers known devices on disk so
+a re-inserted stick is recognized from its remembered descriptors
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+from background_writer import atomic_write
+
+CACHE_FILE = os.path.join('config', 'device_fingerprints.json')
+SYS_BLOCK = '/sys/block'
+DISK_BY_UUID = '/dev/disk/by-uuid'
+
+# Fields a monitor may already supply (e.g. from WMI) instead of sysfs
+DESCRIPTOR_FIELDS = ('serial', 'vendor_id', 'product_id', 'uuid', 'size')
+# A volume UUID can be copied, so a remembered device must still match these
+VERIFIED_FIELDS = ('serial', 'vendor_id', 'product_id')
+# Remembered devices (oldest dropped first)
+MAX_KNOWN = 10000
+
+
+def legacy_device_id(device_info):
+    """The original '<device>_<fstype>' id, still accepted for old whitelist entries"""
+    device = device_info.get('device') or device_info.get('drive_letter', 'unknown')
+    return f"{device}_{device_info.get('fstype', 'unknown')}"
+
+
+def is_device_whitelisted(whitelist_store, identity_cache, drive):
+    """Check a drive against the whitelist by fingerprint, then by legacy id"""
+    device_name = f"Drive {drive.get('device') or drive.get('drive_letter', 'unknown')}"
+    fingerprint = identity_cache.identify(drive)
+    if whitelist_store.is_whitelisted(fingerprint, device_name,
+                                      drive.get('vendor_id'), drive.get('product_id')):
+        return True
+    # Entries created before fingerprints existed
+    return whitelist_store.is_whitelisted(legacy_device_id(drive), device_name)
+
+
+def _read_sys(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def _node_uuid(node, by_uuid=DISK_BY_UUID):
+    """Look up a partition's filesystem UUID from udev's symlinks (no device I/O)"""
+    try:
+        names = os.listdir(by_uuid)
+    except OSError:
+        return ''
+    real_node = os.path.realpath(node)
+    for name in names:
+        if os.path.realpath(os.path.join(by_uuid, name)) == real_node:
+            return name
+    return ''
+
+
+def probe_sysfs(node, sys_block=SYS_BLOCK):
+    """Read USB descriptors and size for a /dev node from sysfs"""
+    name = os.path.basename(node)
+    descriptors = {}
+
+    # Find the sysfs entry for a disk or one of its partitions
+    sys_path = os.path.join(sys_block, name)
+    disk_path = sys_path
+    if not os.path.exists(sys_path):
+        disk = name.rstrip('0123456789')
+        if disk.endswith('p') and disk[:-1] and disk[-2].isdigit():
+            disk = disk[:-1]
+        disk_path = os.path.join(sys_block, disk)
+        sys_path = os.path.join(disk_path, name)
+
+    size = _read_sys(os.path.join(sys_path, 'size'))
+    if size.isdigit():
+        descriptors['size'] = int(size) * 512
+
+    # Walk up from the block device to the USB device that owns it
+    current = os.path.realpath(os.path.join(disk_path, 'device'))
+    while current and current != '/':
+        if os.path.exists(os.path.join(current, 'idVendor')):
+            descriptors['vendor_id'] = _read_sys(os.path.join(current, 'idVendor'))
+            descriptors['product_id'] = _read_sys(os.path.join(current, 'idProduct'))
+            serial = _read_sys(os.path.join(current, 'serial'))
+            if serial:
+                descriptors['serial'] = serial
+            # Storage sticks declare their class on the interface, not the device
+            interface_class = _read_sys(os.path.join(current, f"{os.path.basename(current)}:1.0",
+                                                     'bInterfaceClass'))
+            if interface_class:
+                descriptors['device_class'] = interface_class
+            break
+        current = os.path.dirname(current)
+
+    return descriptors
+
+
+def fingerprint_from_descriptors(descriptors):
+    """Hash the stable descriptors into a compact device fingerprint"""
+    # Size alone is far too weak to tell sticks apart
+    if not any(descriptors.get(field) for field in ('serial', 'vendor_id', 'uuid')):
+        return None
+    parts = [str(descriptors.get(field, '')) for field in DESCRIPTOR_FIELDS]
+    return 'fp-' + hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:24]
+
+
+class DeviceIdentityCache:
+    """Per-node fingerprint cache backed by a persistent store of known devices"""
+
+    def __init__(self, cache_file=CACHE_FILE, probe=probe_sysfs, uuid_lookup=_node_uuid,
+                 writer=None):
+        self.cache_file = cache_file
+        self.writer = writer
+        self.probe = probe
+        self.uuid_lookup = uuid_lookup
+        self._lock = threading.Lock()
+        self._by_node = {}     # device node -> fingerprint (live devices)
+        self._known = {}       # quick key -> {'fingerprint', descriptors...}
+        self._descriptors = {} # fingerprint -> descriptors
+        self.hits = 0
+        self.probes = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                self._known = json.load(f)
+        except (OSError, ValueError):
+            self._known = {}
+        self._trim()
+        self._descriptors = {entry['fingerprint']: entry for entry in self._known.values()
+                             if 'fingerprint' in entry}
+
+    def _trim(self):
+        # Dicts keep insertion order, so the first entries are the oldest
+        for table in (self._known, self._descriptors):
+            while len(table) > MAX_KNOWN:
+                del table[next(iter(table))]
+
+    def _save(self):
+        with self._lock:
+            data = json.dumps(self._known)
+        if self.writer:
+            self.writer.write(self.cache_file, data)
+        else:
+            atomic_write(self.cache_file, data)
+
+    @staticmethod
+    def _node(device_info):
+        return device_info.get('device') or device_info.get('drive_letter') or ''
+
+    def _quick_key(self, node, device_info):
+        """A key that can be read without touching the device: serial or partition UUID"""
+        if device_info.get('serial'):
+            return 'serial:' + str(device_info['serial'])
+        uuid = device_info.get('uuid') or (self.uuid_lookup(node) if node.startswith('/dev/') else '')
+        if uuid:
+            return 'uuid:' + uuid
+        return None
+
+    def _current_descriptors(self, node, device_info):
+        """Descriptors the monitor supplied plus sysfs (no media I/O)"""
+        descriptors = {k: device_info[k] for k in DESCRIPTOR_FIELDS if device_info.get(k)}
+        if node.startswith('/dev/'):
+            descriptors.update(self.probe(node))
+            self.probes += 1
+        return descriptors
+
+    def identify(self, device_info, fresh=False):
+        """
+        Return the device fingerprint, falling back to the legacy id. With
+        fresh (a connect event) the node's cached fingerprint is not reused,
+        since another device may have taken the node since
+        """
+        node = self._node(device_info)
+        with self._lock:
+            if fresh:
+                self._by_node.pop(node, None)
+            fingerprint = self._by_node.get(node)
+            if fingerprint:
+                self.hits += 1
+                return fingerprint
+
+        quick_key = self._quick_key(node, device_info)
+        with self._lock:
+            known = self._known.get(quick_key) if quick_key else None
+        descriptors = self._current_descriptors(node, device_info)
+        if known and all(str(known.get(field) or '') == str(descriptors.get(field) or '')
+                         for field in VERIFIED_FIELDS):
+            fingerprint = known['fingerprint']
+            self.hits += 1
+        else:
+            if quick_key and quick_key.startswith('uuid:'):
+                descriptors['uuid'] = quick_key[5:]
+            fingerprint = fingerprint_from_descriptors(descriptors) or legacy_device_id(device_info)
+            with self._lock:
+                self._descriptors[fingerprint] = dict(descriptors, fingerprint=fingerprint)
+
+            if quick_key and fingerprint.startswith('fp-'):
+                with self._lock:
+                    self._known.pop(quick_key, None)
+                    self._known[quick_key] = dict(descriptors, fingerprint=fingerprint)
+                    self._trim()
+                try:
+                    self._save()
+                except OSError as e:
+                    print(f"Could not save device fingerprint cache: {e}")
+
+        with self._lock:
+            self._by_node[node] = fingerprint
+        return fingerprint
+
+    def descriptors(self, fingerprint):
+        """Return the stored descriptors of a known fingerprint, if any"""
+        with self._lock:
+            entry = self._descriptors.get(fingerprint)
+        return dict(entry) if entry is not None else None
+
+    def forget(self, device_info):
+        """Invalidate the node cache when a device is removed"""
+        with self._lock:
+            return self._by_node.pop(self._node(device_info), None)
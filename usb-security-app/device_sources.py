@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Pluggable device event sources for USB Security Software
+Every source reports events through the same callback(event_type, device_info)
+interface as DeviceMonitor, so the rest of the application doesn't care
+where events come from
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import socket
+import select
+import threading
+from datetime import datetime
+
+from metrics import registry
+
+DEVICE_CONNECTED = 'device_connected'
+DEVICE_REMOVED = 'device_removed'
+
+SYS_BLOCK = '/sys/block'
+PROC_MOUNTS = '/proc/mounts'
+PROC_PARTITIONS = '/proc/partitions'
+
+# Linux netlink protocol number for kernel uevents
+NETLINK_KOBJECT_UEVENT = 15
+
+POLL_RATE = registry.gauge('device_polls_per_second', "Fingerprint checks per second of the polling source")
+POLL_INTERVAL = registry.gauge('device_poll_interval_seconds', "Current adaptive interval of the polling source")
+POLL_SCANS = registry.counter('device_poll_full_scans_total', "Full enumerations after a fingerprint change")
+POLL_DETECTION_LATENCY = registry.histogram('poll_detection_latency_seconds',
+                                            "Estimated device change to the poll that saw it")
+
+
+class DeviceSource:
+    """Base class for device event sources"""
+
+    name = 'base'
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start delivering events on a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_safely, name=f"{self.name}-source", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """Stop the source and wait for its thread to finish"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run_safely(self):
+        try:
+            self.run()
+        except Exception as e:
+            print(f"Device source '{self.name}' stopped: {e}")
+
+    def run(self):
+        """Produce events until stopped"""
+        raise NotImplementedError
+
+    def emit(self, event_type, device_info):
+        """Deliver an event to the callback"""
+        if self.callback:
+            self.callback(event_type, device_info)
+
+    def get_connected_removable_drives(self):
+        """Return the currently connected removable drives"""
+        return []
+
+
+# Linux block device helpers
+
+def read_mounts(path=PROC_MOUNTS):
+    """Return {device node: (mountpoint, fstype)} from the mount table"""
+    mounts = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and fields[0].startswith('/dev/'):
+                    mountpoint = fields[1].replace('\\040', ' ')
+                    mounts.setdefault(fields[0], (mountpoint, fields[2]))
+    except OSError:
+        pass
+    return mounts
+
+
+def resolve_mountpoint(device_info, mounts=None):
+    """
+    Fill in the mountpoint of a device that was mounted after it was
+    reported (the kernel announces a partition before anything mounts it);
+    returns the mountpoint or ''. drive_letter is left alone: it keys the
+    device table.
+    """
+    node = device_info.get('device', '')
+    if not device_info.get('mountpoint') and node.startswith('/dev/'):
+        mountpoint, fstype = (read_mounts() if mounts is None else mounts).get(node, ('', None))
+        if mountpoint:
+            device_info['mountpoint'] = mountpoint
+            device_info['fstype'] = fstype
+    return device_info.get('mountpoint', '')
+
+
+def _read_sys(path, default=''):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def is_removable_disk(disk, sys_block=SYS_BLOCK):
+    """A disk counts as removable if flagged so or attached over USB"""
+    if _read_sys(os.path.join(sys_block, disk, 'removable')) == '1':
+        return True
+    return '/usb' in os.path.realpath(os.path.join(sys_block, disk))
+
+
+def disk_partitions(disk, sys_block=SYS_BLOCK):
+    """Return the partition names of a disk (e.g. sdb -> [sdb1, sdb2])"""
+    try:
+        names = os.listdir(os.path.join(sys_block, disk))
+    except OSError:
+        return []
+    return sorted(n for n in names if n.startswith(disk) and
+                  os.path.exists(os.path.join(sys_block, disk, n, 'partition')))
+
+
+def build_device_info(name, disk, mounts, sys_block=SYS_BLOCK):
+    """Describe a block device in the same shape as DeviceMonitor drives"""
+    node = f"/dev/{name}"
+    mountpoint, fstype = mounts.get(node, ('', 'unknown'))
+    sys_path = os.path.join(sys_block, disk) if name == disk else os.path.join(sys_block, disk, name)
+    try:
+        size = int(_read_sys(os.path.join(sys_path, 'size'), '0')) * 512
+    except ValueError:
+        size = 0
+    return {
+        'device': node,
+        'disk': f"/dev/{disk}",
+        'drive_letter': mountpoint or node,
+        'mountpoint': mountpoint,
+        'fstype': fstype,
+        'size': size,
+        'detection_time': datetime.now().isoformat()
+    }
+
+
+def list_removable_partitions(sys_block=SYS_BLOCK, mounts=None):
+    """Return {device node: device_info} for removable partitions (or bare disks)"""
+    if mounts is None:
+        mounts = read_mounts()
+    devices = {}
+    try:
+        disks = os.listdir(sys_block)
+    except OSError:
+        return devices
+
+    for disk in disks:
+        if not is_removable_disk(disk, sys_block):
+            continue
+        # Skip empty card readers
+        if _read_sys(os.path.join(sys_block, disk, 'size'), '0') == '0':
+            continue
+        for name in disk_partitions(disk, sys_block) or [disk]:
+            info = build_device_info(name, disk, mounts, sys_block)
+            devices[info['device']] = info
+    return devices
+
+
+class NetlinkUeventSource(DeviceSource):
+    """Event-driven Linux source reading kernel uevents; no polling at all"""
+
+    name = 'netlink'
+
+    def __init__(self, callback=None, sys_block=SYS_BLOCK):
+        super().__init__(callback)
+        self.sys_block = sys_block
+        # Shared by the uevent thread and callers of get_connected_removable_drives
+        self._lock = threading.Lock()
+        self._known = {}
+        self._wake_write = None
+
+    @staticmethod
+    def is_supported():
+        return sys.platform.startswith('linux') and hasattr(socket, 'AF_NETLINK')
+
+    @staticmethod
+    def parse_uevent(data):
+        """Decode a raw uevent datagram into a dict of its KEY=VALUE fields"""
+        fields = {}
+        for part in data.split(b'\0'):
+            key, sep, value = part.partition(b'=')
+            if sep:
+                fields[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+        return fields
+
+    def handle_uevent(self, fields):
+        """Translate one parsed uevent into connect/remove callbacks"""
+        if fields.get('SUBSYSTEM') != 'block':
+            return
+        name = fields.get('DEVNAME', '').replace('/dev/', '')
+        action = fields.get('ACTION')
+        if not name:
+            return
+
+        if action == 'add':
+            devtype = fields.get('DEVTYPE')
+            disk = name if devtype == 'disk' else os.path.basename(
+                os.path.dirname(fields.get('DEVPATH', '')))
+            if not disk or not is_removable_disk(disk, self.sys_block):
+                return
+            # A whole disk is only reported if it has no partition table
+            if devtype == 'disk' and disk_partitions(disk, self.sys_block):
+                return
+            info = build_device_info(name, disk, read_mounts(), self.sys_block)
+            with self._lock:
+                self._known[info['device']] = info
+            self.emit(DEVICE_CONNECTED, info)
+        elif action == 'change':
+            with self._lock:
+                info = self._known.get(f"/dev/{name}")
+                if info is not None:
+                    resolve_mountpoint(info)
+        elif action == 'remove':
+            with self._lock:
+                info = self._known.pop(f"/dev/{name}", None)
+            if info is not None:
+                self.emit(DEVICE_REMOVED, info)
+
+    def get_connected_removable_drives(self):
+        with self._lock:
+            before = set(self._known)
+        mounts = read_mounts()
+        scanned = list_removable_partitions(self.sys_block, mounts)
+        with self._lock:
+            # Merge rather than replace: an 'add' handled while we scanned
+            # must survive, and known devices keep the info (and so the
+            # device-table key) they were announced with
+            for node in before - scanned.keys():
+                self._known.pop(node, None)
+            for node, info in scanned.items():
+                known = self._known.setdefault(node, info)
+                if known is not info:
+                    resolve_mountpoint(known, mounts)
+            return list(self._known.values())
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        # Wake the blocking select() through the self-pipe
+        if self._wake_write is not None:
+            try:
+                os.write(self._wake_write, b'x')
+            except OSError:
+                pass
+        super().stop(timeout)
+
+    def run(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        wake_read, self._wake_write = os.pipe()
+        try:
+            # Multicast group 1 carries the kernel's own uevents
+            sock.bind((0, 1))
+            self.get_connected_removable_drives()
+            while not self._stop_event.is_set():
+                # No timeout: the thread sleeps until the kernel or stop() wakes it
+                readable, _, _ = select.select([sock, wake_read], [], [])
+                if sock in readable:
+                    self.handle_uevent(self.parse_uevent(sock.recv(65536)))
+        finally:
+            sock.close()
+            os.close(wake_read)
+            os.close(self._wake_write)
+            self._wake_write = None
+
+
+class AdaptivePollScheduler:
+    """
+    Poll interval that drops to the minimum right after activity and backs
+    off geometrically while nothing changes
+    """
+
+    def __init__(self, min_interval=0.25, max_interval=5.0, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.interval = self.min_interval
+
+    def record(self, changed):
+        """Update the interval after a poll and return the next one"""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+
+def block_fingerprint(paths=(PROC_PARTITIONS, PROC_MOUNTS)):
+    """Cheap hash of the kernel partition and mount tables"""
+    checksum = 0
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                checksum = zlib.crc32(f.read(), checksum)
+        except OSError:
+            pass
+    return checksum
+
+
+class MountPollSource(DeviceSource):
+    """
+    Portable Linux fallback that diffs /sys/block and /proc/mounts.
+    Each poll only hashes /proc/partitions and /proc/mounts; the full
+    enumeration runs when that fingerprint changes.
+    """
+
+    name = 'poll'
+
+    def __init__(self, callback=None, interval=None, min_interval=0.25, max_interval=5.0,
+                 backoff=1.5, sys_block=SYS_BLOCK, fingerprint=block_fingerprint):
+        super().__init__(callback)
+        if interval is not None:
+            # Fixed-rate polling
+            min_interval = max_interval = interval
+        self.scheduler = AdaptivePollScheduler(min_interval, max_interval, backoff)
+        self.sys_block = sys_block
+        self.fingerprint = fingerprint
+        self._known = {}
+        self._last_fingerprint = None
+        self._started = time.monotonic()
+        self._last_poll = self._started
+        self._polls = 0
+        self._scans = 0
+        self._detections = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def get_connected_removable_drives(self):
+        return list(self._known.values())
+
+    def poll(self):
+        """Check the fingerprint and emit differences if it changed; returns True on change"""
+        now = time.monotonic()
+        since_last = now - self._last_poll
+        self._last_poll = now
+        self._polls += 1
+        POLL_RATE.set(round(self._polls / max(now - self._started, 1e-9), 3))
+        POLL_INTERVAL.set(self.scheduler.interval)
+
+        fingerprint = self.fingerprint()
+        if fingerprint == self._last_fingerprint:
+            return False
+        self._last_fingerprint = fingerprint
+
+        self._scans += 1
+        POLL_SCANS.inc()
+        previous = self._known
+        current = list_removable_partitions(self.sys_block)
+        removed = previous.keys() - current.keys()
+        added = current.keys() - previous.keys()
+        self._known = current
+
+        for node in removed:
+            self.emit(DEVICE_REMOVED, previous[node])
+        for node in added:
+            self.emit(DEVICE_CONNECTED, current[node])
+
+        if removed or added:
+            # The change happened somewhere in the last interval; count
+            # half of it as the expected latency and all of it as the worst case
+            self._detections += 1
+            self._latency_total += since_last / 2
+            POLL_DETECTION_LATENCY.observe(since_last / 2)
+            self._latency_max = max(self._latency_max, since_last)
+        return bool(removed or added)
+
+    def stats(self):
+        """Polling and detection-latency metrics for tuning the intervals"""
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            'polls': self._polls,
+            'full_scans': self._scans,
+            'polls_per_second': self._polls / elapsed,
+            'current_interval': self.scheduler.interval,
+            'detections': self._detections,
+            'detection_latency_avg': (self._latency_total / self._detections
+                                      if self._detections else 0.0),
+            'detection_latency_max': self._latency_max
+        }
+
+    def run(self):
+        self._last_fingerprint = self.fingerprint()
+        self._known = list_removable_partitions(self.sys_block)
+        self._last_poll = time.monotonic()
+        while not self._stop_event.wait(self.scheduler.interval):
+            self.scheduler.record(self.poll())
+
+
+class ReplaySource(DeviceSource):
+    """
+    Deterministic source that replays recorded or synthetic events.
+    Each event is {'delay': seconds since the previous event,
+    'event': 'device_connected' | 'device_removed', 'device': {...}}.
+    speed scales the replay rate: 2 replays twice as fast, 0 skips all delays.
+    """
+
+    name = 'replay'
+
+    def __init__(self, events, callback=None, speed=1.0):
+        super().__init__(callback)
+        self.events = list(events)
+        self.speed = speed
+        self.finished = threading.Event()
+        self._connected = {}
+
+    @classmethod
+    def from_file(cls, path, callback=None, speed=1.0):
+        """Load events from a JSON list or JSON Lines file"""
+        with open(path, 'r') as f:
+            text = f.read()
+        if text.lstrip().startswith('['):
+            events = json.loads(text)
+        else:
+            events = [json.loads(line) for line in text.splitlines() if line.strip()]
+        return cls(events, callback, speed)
+
+    @staticmethod
+    def synthetic_storm(count, devices=4, partitions=1, delay=0.0):
+        """Generate alternating connect/remove events over a set of devices"""
+        events = []
+        connected = set()
+        for i in range(count):
+            number = i % devices
+            partition = (i // devices) % partitions + 1
+            node = f"/dev/sd{chr(ord('b') + number % 24)}{partition}"
+            event = DEVICE_REMOVED if node in connected else DEVICE_CONNECTED
+            connected.symmetric_difference_update({node})
+            events.append({
+                'delay': delay,
+                'event': event,
+                'device': {'device': node, 'disk': node.rstrip('0123456789'),
+                           'drive_letter': node, 'fstype': 'vfat'}
+            })
+        return events
+
+    def get_connected_removable_drives(self):
+        return list(self._connected.values())
+
+    def run(self):
+        try:
+            for item in self.events:
+                delay = item.get('delay', 0) / self.speed if self.speed else 0
+                if delay > 0 and self._stop_event.wait(delay):
+                    return
+                if self._stop_event.is_set():
+                    return
+
+                event_type = item['event']
+                device_info = dict(item.get('device', {}))
+                key = device_info.get('device') or device_info.get('drive_letter')
+                if event_type == DEVICE_CONNECTED:
+                    self._connected[key] = device_info
+                else:
+                    self._connected.pop(key, None)
+                self.emit(event_type, device_info)
+        finally:
+            self.finished.set()
+
+    def wait(self, timeout=None):
+        """Block until every event has been delivered"""
+        return self.finished.wait(timeout)
+
+
+def create_device_source(spec, callback=None):
+    """
+    Build a source from a command-line style spec:
+    'auto', 'netlink', 'poll', 'poll:<seconds>', 'replay:<file>' or
+    'daemon[:<socket>]' (events relayed from usb_daemon.py).
+    'auto' returns None off Linux, meaning DeviceMonitor (WMI) is used.
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'auto':
+        if NetlinkUeventSource.is_supported():
+            return NetlinkUeventSource(callback)
+        if sys.platform.startswith('linux'):
+            return MountPollSource(callback)
+        return None
+    if kind == 'netlink':
+        return NetlinkUeventSource(callback)
+    if kind == 'poll':
+        return MountPollSource(callback, interval=float(argument) if argument else None)
+    if kind == 'replay':
+        if not argument:
+            raise ValueError("replay source needs a file: replay:<path>")
+        return ReplaySource.from_file(argument, callback)
+    if kind == 'daemon':
+        from daemon_client import DaemonEventSource, SOCKET_PATH
+        return DaemonEventSource(callback, socket_path=argument or SOCKET_PATH)
+    raise ValueError(f"Unknown device source: {spec}")
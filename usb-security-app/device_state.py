@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+In-memory table of connected removable devices for USB Security Software
+Kept up to date from connect/remove events so policy questions such as
+"is any unauthorized device still attached?" don't need a rescan
+"""
+
+import threading
+
+# Descriptors that tell two devices on the same node apart during a rescan
+IDENTITY_FIELDS = ('fingerprint', 'serial', 'uuid', 'size', 'fstype', 'label')
+
+
+def device_key(device_info):
+    """Return the key a device is tracked under ('E:\\' and 'E:' are the same drive)"""
+    value = device_info.get('device') or device_info.get('drive_letter') or device_info.get('mountpoint')
+    if not value:
+        return None
+    return str(value).rstrip('\\/').upper() or str(value)
+
+
+def same_device(old, new):
+    """False if any identity descriptor both infos carry differs"""
+    return all(old[field] == new[field] for field in IDENTITY_FIELDS
+               if old.get(field) and new.get(field))
+
+
+class DeviceTable:
+    """Connected-device table with a running count of unauthorized devices"""
+
+    def __init__(self, is_authorized, key_func=device_key, on_removed=None):
+        self.is_authorized = is_authorized
+        self.key_func = key_func
+        # Called with the info of each device a reconcile finds gone or replaced
+        self.on_removed = on_removed
+        self._lock = threading.Lock()
+        self._devices = {}  # key -> (device_info, authorized)
+        self._unauthorized = 0
+
+    def device_connected(self, device_info):
+        """Record a connected device; returns True if it is unauthorized"""
+        key = self.key_func(device_info)
+        if key is None:
+            return False
+        authorized = bool(self.is_authorized(device_info))
+
+        with self._lock:
+            previous = self._devices.get(key)
+            if previous is not None and not previous[1]:
+                self._unauthorized -= 1
+            self._devices[key] = (device_info, authorized)
+            if not authorized:
+                self._unauthorized += 1
+        return not authorized
+
+    def device_removed(self, device_info):
+        """Forget a removed device; returns the info it was tracked with"""
+        key = self.key_func(device_info)
+        with self._lock:
+            previous = self._devices.pop(key, None)
+            if previous is None:
+                return None
+            if not previous[1]:
+                self._unauthorized -= 1
+            return previous[0]
+
+    def unauthorized_count(self):
+        """Number of connected devices that are not authorized"""
+        return self._unauthorized
+
+    def connected_devices(self):
+        """Return a snapshot of the tracked device infos"""
+        with self._lock:
+            return [info for info, _ in self._devices.values()]
+
+    def __len__(self):
+        return len(self._devices)
+
+    def reconcile(self, drives):
+        """
+        Replace the table with the result of a full scan and return how many
+        entries were wrong (missed connects, missed removals and devices
+        replaced on the same node)
+        """
+        scanned = {}
+        for drive in drives:
+            key = self.key_func(drive)
+            if key is not None:
+                scanned[key] = drive
+
+        with self._lock:
+            known = self._devices
+        gone = [info for key, (info, _) in known.items()
+                if key not in scanned or not same_device(info, scanned[key])]
+        drift = len(scanned.keys() - known.keys()) + len(gone)
+        if self.on_removed:
+            for info in gone:
+                self.on_removed(info)
+
+        devices = {}
+        unauthorized = 0
+        for key, drive in scanned.items():
+            if key in known and same_device(known[key][0], drive):
+                authorized = known[key][1]
+            else:
+                authorized = bool(self.is_authorized(drive))
+            devices[key] = (drive, authorized)
+            if not authorized:
+                unauthorized += 1
+
+        with self._lock:
+            self._devices = devices
+            self._unauthorized = unauthorized
+        return drift
+
+    def reevaluate(self):
+        """Re-check every tracked device, e.g. after the whitelist changed"""
+        with self._lock:
+            devices = list(self._devices.items())
+
+        updated = {}
+        unauthorized = 0
+        for key, (info, _) in devices:
+            authorized = bool(self.is_authorized(info))
+            updated[key] = (info, authorized)
+            if not authorized:
+                unauthorized += 1
+
+        with self._lock:
+            self._devices = updated
+            self._unauthorized = unauthorized
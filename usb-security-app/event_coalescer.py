@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Event coalescing stage for USB Security Software
+Sits between the device monitor threads and the GUI: bursts of events for
+one physical device are debounced and merged before they are delivered
+"""
+
+import re
+import time
+import threading
+
+DEVICE_CONNECTED = 'device_connected'
+DEVICE_REMOVED = 'device_removed'
+
+_PARTITION_SUFFIX = re.compile(r'(?<=[a-z])\d+$|(?<=\d)p\d+$')
+
+
+def physical_device_key(device_info):
+    """Group partitions of one stick together (/dev/sdb1, /dev/sdb2 -> /dev/sdb)"""
+    if device_info.get('disk'):
+        return device_info['disk']
+    node = device_info.get('device') or device_info.get('drive_letter') or ''
+    if node.startswith('/dev/'):
+        return _PARTITION_SUFFIX.sub('', node)
+    # Windows drive letters carry no partition relationship
+    return node.rstrip('\\/').upper()
+
+
+class _Pending:
+    __slots__ = ('first_seen', 'events', 'partitions')
+
+    def __init__(self, now):
+        self.first_seen = now
+        self.events = {}        # partition node -> event types in arrival order
+        self.partitions = {}    # partition node -> latest device_info
+
+
+class EventCoalescer:
+    """
+    Debounces device events per physical device.
+    Each partition's events are resolved on their own (within the window a
+    connect followed by a remove cancels out), then the partitions of one
+    device that ended up connected merge into a single event (their infos
+    are listed under 'partitions'), as do those that ended up removed.
+    The result is delivered as one batch.
+    """
+
+    def __init__(self, deliver, window=0.15, max_pending=1024, key_func=physical_device_key):
+        self.deliver = deliver
+        self.window = window
+        self.max_pending = max_pending
+        self.key_func = key_func
+
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._running = True
+        self._stats = {'submitted': 0, 'delivered': 0, 'cancelled': 0,
+                       'merged': 0, 'batches': 0, 'forced_flushes': 0,
+                       'latency_total': 0.0, 'latency_max': 0.0}
+
+        self._thread = threading.Thread(target=self._run, name="event-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, event_type, device_info):
+        """Queue an event; safe to call from any thread"""
+        key = self.key_func(device_info)
+        partition = device_info.get('device') or device_info.get('drive_letter') or key
+        now = time.monotonic()
+
+        with self._condition:
+            self._stats['submitted'] += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = _Pending(now)
+                self._condition.notify()
+            pending.events.setdefault(partition, []).append(event_type)
+            pending.partitions[partition] = device_info
+
+            if len(self._pending) > self.max_pending:
+                # Bounded queue: deliver everything now rather than grow
+                self._stats['forced_flushes'] += 1
+                batch = self._take(now, force=True)
+            else:
+                batch = None
+
+        if batch:
+            self._deliver(batch)
+
+    def _resolve(self, events):
+        """Collapse one partition's event sequence into the event to deliver, if any"""
+        first, last = events[0], events[-1]
+        if first == DEVICE_CONNECTED and last == DEVICE_REMOVED:
+            # Appeared and vanished inside the window
+            return None
+        return last
+
+    def _take(self, now, force=False):
+        """Remove and resolve every pending device whose window has expired"""
+        batch = []
+        for key in list(self._pending):
+            pending = self._pending[key]
+            if not force and now - pending.first_seen < self.window:
+                continue
+            del self._pending[key]
+
+            resolved = {DEVICE_REMOVED: [], DEVICE_CONNECTED: []}
+            for partition, events in pending.events.items():
+                event_type = self._resolve(events)
+                if event_type is None:
+                    self._stats['cancelled'] += len(events)
+                else:
+                    resolved[event_type].append(pending.partitions[partition])
+                    self._stats['merged'] += len(events) - 1
+
+            # Removals first, so a device that swapped partitions ends up connected
+            for event_type, partitions in resolved.items():
+                if not partitions:
+                    continue
+                device_info = dict(partitions[0])
+                if len(partitions) > 1:
+                    device_info['partitions'] = partitions
+                    self._stats['merged'] += len(partitions) - 1
+                latency = now - pending.first_seen
+                self._stats['latency_total'] += latency
+                self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+                batch.append((event_type, device_info))
+        return batch
+
+    def _deliver(self, batch):
+        with self._condition:
+            self._stats['delivered'] += len(batch)
+            self._stats['batches'] += 1
+        try:
+            self.deliver(batch)
+        except Exception as e:
+            print(f"Error delivering device events: {e}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                now = time.monotonic()
+                oldest = min(p.first_seen for p in self._pending.values())
+                remaining = oldest + self.window - now
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                batch = self._take(now)
+
+            if batch:
+                self._deliver(batch)
+
+    def flush(self):
+        """Deliver everything pending immediately"""
+        with self._condition:
+            batch = self._take(time.monotonic(), force=True)
+        if batch:
+            self._deliver(batch)
+
+    def stats(self):
+        """Counters plus average and worst-case time spent in the window"""
+        with self._condition:
+            stats = dict(self._stats)
+        delivered = stats['delivered']
+        stats['latency_avg'] = stats['latency_total'] / delivered if delivered else 0.0
+        return stats
+
+    def stop(self):
+        """Flush pending events and stop the delivery thread"""
+        self.flush()
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join(2.0)
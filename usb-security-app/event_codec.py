@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Compact columnar encoding of security events
+Events are held as three typed arrays (epoch-ns timestamps, integer event
+codes, device references) plus interned tables of event names and device
+descriptions, so a device plugged in a thousand times is stored once. The
+.evc file format is those arrays and tables written back to back, which
+loads with a few frombytes() calls instead of parsing JSON per event
+Usage: python event_codec.py convert <security_log.json | log dir> <out.evc>
+       python event_codec.py export <in.evc> <out.csv | out.json>
+"""
+
+import os
+import sys
+import csv
+import json
+import zlib
+import struct
+from array import array
+from datetime import datetime
+
+MAGIC = b'USBEVC01'
+# magic, event count, event table bytes, device table bytes (compressed)
+HEADER = struct.Struct('<8sIII')
+
+EVC_SUFFIX = '.evc'
+
+# Codes fixed across files so readers can filter without the name table
+KNOWN_EVENTS = ('DEVICE_CONNECTED', 'DEVICE_REMOVED')
+
+# Leading CSV columns; other device fields follow in sorted order
+CSV_DEVICE_FIELDS = ('drive_letter', 'device', 'fstype', 'id', 'name', 'fingerprint', 'authorized')
+
+
+def timestamp_ns(value):
+    """ISO timestamp (as written by SecurityLog) to epoch nanoseconds; 0 if unparseable"""
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return 0
+    # Whole seconds through the float API, microseconds exactly
+    return int(moment.replace(microsecond=0).timestamp()) * 1000000000 + moment.microsecond * 1000
+
+
+def iso_timestamp(nanoseconds):
+    """Inverse of timestamp_ns (local time, microsecond precision)"""
+    if not nanoseconds:
+        return None
+    seconds, remainder = divmod(nanoseconds, 1000000000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=remainder // 1000).isoformat()
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column(typecode, data):
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class EventRecord:
+    """One event viewed from an EventTable"""
+
+    __slots__ = ('timestamp_ns', 'event', 'device')
+
+    def __init__(self, timestamp_ns, event, device):
+        self.timestamp_ns = timestamp_ns
+        self.event = event
+        self.device = device
+
+    def to_record(self):
+        """The dict shape SecurityLog writes"""
+        return {'timestamp': iso_timestamp(self.timestamp_ns), 'event': self.event,
+                'device': self.device}
+
+
+class EventTable:
+    """Events in columnar form with interned event names and devices"""
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.events = array('H')
+        self.devices = array('I')
+        self.event_names = list(KNOWN_EVENTS)
+        self.device_table = []
+        self._event_codes = {name: code for code, name in enumerate(self.event_names)}
+        self._device_refs = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, position):
+        return EventRecord(self.timestamps[position], self.event_names[self.events[position]],
+                           self.device_table[self.devices[position]])
+
+    def __iter__(self):
+        names, table = self.event_names, self.device_table
+        for ts, code, ref in zip(self.timestamps, self.events, self.devices):
+            yield EventRecord(ts, names[code], table[ref])
+
+    def event_code(self, name):
+        code = self._event_codes.get(name)
+        if code is None:
+            code = self._event_codes[name] = len(self.event_names)
+            self.event_names.append(name)
+        return code
+
+    def device_ref(self, device):
+        key = json.dumps(device, sort_keys=True, separators=(',', ':'), default=str)
+        ref = self._device_refs.get(key)
+        if ref is None:
+            ref = self._device_refs[key] = len(self.device_table)
+            # Store the normalized copy so every event shares one object
+            self.device_table.append(json.loads(key))
+        return ref
+
+    def append(self, timestamp_ns, event, device):
+        self.timestamps.append(timestamp_ns)
+        self.events.append(self.event_code(str(event)))
+        self.devices.append(self.device_ref(device))
+
+    def append_record(self, record):
+        """Add a record in SecurityLog's dict shape"""
+        self.append(timestamp_ns(record.get('timestamp')), record.get('event', ''),
+                    record.get('device'))
+
+    def records(self):
+        """Yield events as SecurityLog-style dicts, oldest first"""
+        for event in self:
+            yield event.to_record()
+
+    # Building
+
+    @classmethod
+    def from_records(cls, records):
+        table = cls()
+        for record in records:
+            if isinstance(record, dict):
+                table.append_record(record)
+        return table
+
+    @classmethod
+    def from_legacy_file(cls, path):
+        """Convert the old single-array config/security_log.json"""
+        with open(path, 'r') as f:
+            return cls.from_records(json.load(f))
+
+    @classmethod
+    def from_security_log(cls, security_log):
+        """Convert every event of a segmented SecurityLog"""
+        return cls.from_records(security_log.iter_events())
+
+    # The .evc file format
+
+    def to_bytes(self):
+        event_table = json.dumps(self.event_names, separators=(',', ':')).encode('utf-8')
+        device_table = zlib.compress(
+            json.dumps(self.device_table, separators=(',', ':'), default=str).encode('utf-8'))
+        return b''.join((
+            HEADER.pack(MAGIC, len(self), len(event_table), len(device_table)),
+            event_table,
+            device_table,
+            _little_endian(self.timestamps),
+            _little_endian(self.events),
+            _little_endian(self.devices),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size:
+            raise ValueError("Truncated event file")
+        magic, count, event_bytes, device_bytes = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not an event file")
+        expected = HEADER.size + event_bytes + device_bytes + count * (8 + 2 + 4)
+        if len(data) != expected:
+            raise ValueError(f"Event file is {len(data)} bytes, expected {expected}")
+
+        table = cls()
+        position = HEADER.size
+        table.event_names = json.loads(data[position:position + event_bytes])
+        position += event_bytes
+        table.device_table = json.loads(zlib.decompress(data[position:position + device_bytes]))
+        position += device_bytes
+        for name, typecode, width in (('timestamps', 'q', 8), ('events', 'H', 2), ('devices', 'I', 4)):
+            setattr(table, name, _column(typecode, data[position:position + count * width]))
+            position += count * width
+
+        table._event_codes = {name: code for code, name in enumerate(table.event_names)}
+        table._device_refs = {json.dumps(device, sort_keys=True, separators=(',', ':')): ref
+                              for ref, device in enumerate(table.device_table)}
+        return table
+
+    def write(self, path):
+        from background_writer import atomic_write
+        atomic_write(path, self.to_bytes())
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    # Export for auditors
+
+    def export_json(self, f):
+        """Write a JSON array in the legacy security_log.json shape"""
+        f.write('[')
+        for position, record in enumerate(self.records()):
+            if position:
+                f.write(',\n')
+            f.write(json.dumps(record, default=str))
+        f.write(']\n')
+
+    def export_csv(self, f):
+        """Write one CSV row per event with the device fields as columns"""
+        extra = sorted({key for device in self.device_table if isinstance(device, dict)
+                        for key in device} - set(CSV_DEVICE_FIELDS) - {'partitions', 'trace'})
+        fields = list(CSV_DEVICE_FIELDS) + extra
+        writer = csv.writer(f)
+        writer.writerow(['timestamp', 'event'] + fields)
+
+        # Each interned device is formatted once, not once per event
+        cells = [[_cell(device.get(field)) if isinstance(device, dict) else '' for field in fields]
+                 for device in self.device_table]
+        names = self.event_names
+        for ts, code, ref in zip(self.timestamps, self.events, self.devices):
+            writer.writerow([iso_timestamp(ts) or '', names[code]] + cells[ref])
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'), default=str)
+    return value
+
+
+def load_events(path):
+    """Read events from an .evc file, a legacy JSON array or a SecurityLog directory"""
+    if os.path.isdir(path):
+        # Read-only: the directory may belong to a running instance
+        from security_log import read_log_dir
+        return EventTable.from_records(read_log_dir(path))
+    if path.endswith(EVC_SUFFIX):
+        return EventTable.read(path)
+    return EventTable.from_legacy_file(path)
+
+
+def main(argv):
+    if len(argv) != 3 or argv[0] not in ('convert', 'export'):
+        print(__doc__.strip().split('\n')[-2].strip())
+        print(__doc__.strip().split('\n')[-1].strip())
+        return 2
+    command, source, target = argv
+    try:
+        table = load_events(source)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read events from {source}: {e}")
+        return 1
+
+    if command == 'convert':
+        table.write(target)
+    elif target.endswith('.csv'):
+        with open(target, 'w', newline='', encoding='utf-8') as f:
+            table.export_csv(f)
+    else:
+        with open(target, 'w', encoding='utf-8') as f:
+            table.export_json(f)
+    print(f"{len(table):,} events ({len(table.device_table):,} distinct devices) written to {target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
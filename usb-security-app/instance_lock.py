@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Single-instance lock for USB Security Software
+The running instance holds a per-user abstract Unix socket (Linux) or a
+locked file plus a loopback socket on an ephemeral port (elsewhere, or
+when another user has squatted the abstract name). A second launch connects to it, forwards its command line ("show logs",
+"reload whitelist", ...) and exits without loading Qt
+"""
+
+import os
+import sys
+import json
+import socket
+import struct
+import threading
+
+LOCK_NAME = 'usb-security'
+
+
+def user_state_dir():
+    """Per-user absolute directory: launches from any working directory share it"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+        return os.path.join(base, 'USBSecurity')
+    base = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, LOCK_NAME)
+
+
+LOCK_FILE = os.path.join(user_state_dir(), 'instance.lock')
+ADDRESS_FILE = os.path.join(user_state_dir(), 'instance.address')
+
+# A live instance answers well within this; a hung one must not block logins
+FORWARD_TIMEOUT = 1.0
+
+
+def peer_uid(sock):
+    """Return the uid of the process on the other end of a Unix socket, if known"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+
+def uses_abstract_socket():
+    return sys.platform.startswith('linux')
+
+
+def abstract_address(name=LOCK_NAME):
+    """Per-user name in the Linux abstract socket namespace (freed by the kernel on exit)"""
+    return '\0' + f"{name}-{os.getuid()}"
+
+
+def _read_address(address_file):
+    """Return (host, port, token) written by the running instance"""
+    with open(address_file, 'r') as f:
+        host, port, token = f.read().split()
+    return host, int(port), token
+
+
+def _connect_abstract(name, timeout):
+    """Connect to whoever holds the abstract name; returns (socket, holder uid)"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(abstract_address(name))
+        return sock, peer_uid(sock)
+    except OSError:
+        sock.close()
+        raise
+
+
+def _connect(name, address_file, timeout):
+    """Connect to the running instance; returns (socket, token)"""
+    if uses_abstract_socket():
+        sock, holder = _connect_abstract(name, timeout)
+        if holder == os.getuid():
+            return sock, None
+        # The abstract namespace has no permissions: another user may have
+        # taken the name, in which case our instance listens on loopback
+        sock.close()
+    host, port, token = _read_address(address_file)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock, token
+
+
+def forward_to_running_instance(argv, name=LOCK_NAME, address_file=ADDRESS_FILE,
+                                timeout=FORWARD_TIMEOUT):
+    """Send argv to the running instance; returns False if there is none"""
+    try:
+        sock, token = _connect(name, address_file, timeout)
+    except (OSError, ValueError):
+        return False
+    try:
+        message = {'argv': list(argv), 'token': token}
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        reply = sock.makefile('rb').readline(4096)
+        return bool(reply) and json.loads(reply).get('ok', False)
+    except (OSError, ValueError):
+        return False
+    finally:
+        sock.close()
+
+
+class InstanceLock:
+    """Held by the primary instance; receives the argv of later launches"""
+
+    def __init__(self, name=LOCK_NAME, lock_file=LOCK_FILE, address_file=ADDRESS_FILE):
+        self.name = name
+        self.lock_file = lock_file
+        self.address_file = address_file
+        self.token = None
+        self._listener = None
+        self._lock_handle = None
+        self._thread = None
+        self._closed = False
+
+    def acquire(self):
+        """Become the primary instance; returns False if another one holds the lock"""
+        if uses_abstract_socket():
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                listener.bind(abstract_address(self.name))
+                listener.listen(4)
+                self._listener = listener
+                return True
+            except OSError:
+                listener.close()
+            holder = self._abstract_holder()
+            if holder is None or holder == os.getuid():
+                return False
+            print(f"Instance name {self.name} is squatted by uid {holder}; "
+                  f"using {self.lock_file} instead")
+        if not self._lock_file():
+            return False
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        # Loopback is reachable by every local user, so forwarders must
+        # prove they can read our per-user directory. (Imported here to
+        # keep the forwarding path of a second launch lean.)
+        import secrets
+        from background_writer import atomic_write
+        self.token = secrets.token_hex(16)
+        host, port = listener.getsockname()
+        atomic_write(self.address_file, f"{host} {port} {self.token}\n")
+        listener.listen(4)
+        self._listener = listener
+        return True
+
+    def _abstract_holder(self):
+        """Uid of the process holding our abstract name, or None if unknown"""
+        try:
+            sock, holder = _connect_abstract(self.name, FORWARD_TIMEOUT)
+        except OSError:
+            return None
+        sock.close()
+        return holder
+
+    def _lock_file(self):
+        directory = os.path.dirname(self.lock_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handle = open(self.lock_file, 'a+')
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_handle = handle
+        return True
+
+    def serve(self, callback):
+        """Call callback(argv) for every forwarded launch, on a background thread"""
+        self._thread = threading.Thread(target=self._serve, args=(callback,),
+                                        name="instance-lock", daemon=True)
+        self._thread.start()
+
+    def _serve(self, callback):
+        while not self._closed:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            try:
+                self._handle(conn, callback)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring forwarded launch: {e}")
+            finally:
+                conn.close()
+
+    def _handle(self, conn, callback):
+        conn.settimeout(FORWARD_TIMEOUT)
+        if conn.family == socket.AF_UNIX and peer_uid(conn) not in (None, os.getuid()):
+            raise ValueError("launch from another user")
+        line = conn.makefile('rb').readline(65536)
+        if not line:
+            # A second launch checking who holds the name
+            return
+        message = json.loads(line)
+        if message.get('token') != self.token:
+            raise ValueError("bad token")
+        callback([str(arg) for arg in message.get('argv', [])])
+        conn.sendall(b'{"ok": true}\n')
+
+    def release(self):
+        """Give up the lock (also happens implicitly when the process exits)"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._listener:
+            try:
+                # Wakes the accept() in _serve
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            # A thread still inside accept() keeps the address bound
+            if self._thread and self._thread is not threading.current_thread():
+                self._thread.join(FORWARD_TIMEOUT)
+            self._listener.close()
+        if self._lock_handle:
+            try:
+                os.remove(self.address_file)
+            except OSError:
+                pass
+            self._lock_handle.close()
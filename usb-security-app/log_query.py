@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Indexed queries over the security event log
+Uses the per-segment sidecar indexes written by SecurityLog so that
+"last N", time-range, event and device queries read only what they return
+"""
+
+import os
+import json
+from datetime import datetime
+
+from security_log import INDEX_ENTRY, key_hash, device_key, timestamp_us
+
+# Number of index entries read from disk at a time while scanning backwards
+SCAN_BLOCK = 512
+
+
+def _to_us(value):
+    """Convert a datetime, ISO string or epoch seconds to epoch microseconds"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000000)
+    if isinstance(value, str):
+        return timestamp_us(value)
+    return int(value * 1000000)
+
+
+class LogQuery:
+    """Newest-first, cursor-paged queries over a SecurityLog"""
+
+    def __init__(self, security_log):
+        self.log = security_log
+
+    def _index_count(self, number):
+        try:
+            return os.path.getsize(self.log.index_path(number)) // INDEX_ENTRY.size
+        except OSError:
+            return 0
+
+    def count(self):
+        """Return the total number of indexed events"""
+        self.log.sync_readers()
+        return sum(self._index_count(n) for n in self.log.list_segments())
+
+    def _read_entry(self, index_file, position):
+        index_file.seek(position * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))
+
+    def _bisect_end(self, index_file, upper, end_us):
+        """Return the first position in [0, upper) whose timestamp is after end_us"""
+        low, high = 0, upper
+        while low < high:
+            middle = (low + high) // 2
+            if self._read_entry(index_file, middle)[1] > end_us:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def query(self, limit=50, cursor=None, start=None, end=None, event=None, device=None):
+        """
+        Return (records, next_cursor), newest first.
+        Pass next_cursor back in to fetch the following page; it is None once
+        the log is exhausted. Time bounds assume events are appended in order.
+        """
+        start_us = _to_us(start)
+        end_us = _to_us(end)
+        event_hash = key_hash(event) if event else None
+        device_hash = key_hash(device) if device else None
+
+        self.log.sync_readers()
+        active = self.log.active_segment
+        segments = self.log.list_segments()
+        if cursor is not None:
+            segments = [n for n in segments if n <= cursor[0]]
+
+        records = []
+        for number in reversed(segments):
+            if number != active:
+                self.log.ensure_index(number)
+
+            upper = self._index_count(number)
+            if cursor is not None and number == cursor[0]:
+                upper = min(upper, cursor[1])
+            if upper <= 0:
+                continue
+
+            with open(self.log.index_path(number), 'rb') as index_file, \
+                    open(self.log.segment_path(number), 'rb') as segment_file:
+                if end_us is not None:
+                    upper = self._bisect_end(index_file, upper, end_us)
+
+                while upper > 0:
+                    lower = max(0, upper - SCAN_BLOCK)
+                    index_file.seek(lower * INDEX_ENTRY.size)
+                    block = index_file.read((upper - lower) * INDEX_ENTRY.size)
+                    entries = list(INDEX_ENTRY.iter_unpack(block))
+
+                    for position in range(upper - 1, lower - 1, -1):
+                        offset, ts, entry_event, entry_device = entries[position - lower]
+                        if start_us is not None and ts and ts < start_us:
+                            return records, None
+                        if event_hash is not None and entry_event != event_hash:
+                            continue
+                        if device_hash is not None and entry_device != device_hash:
+                            continue
+
+                        segment_file.seek(offset)
+                        try:
+                            record = json.loads(segment_file.readline())
+                        except ValueError:
+                            continue
+                        # Guard against hash collisions
+                        if event is not None and record.get('event') != event:
+                            continue
+                        if device is not None and device_key(record.get('device')) != device:
+                            continue
+
+                        records.append(record)
+                        if len(records) >= limit:
+                            return records, (number, position)
+                    upper = lower
+
+        return records, None
+
+    def last(self, limit=50):
+        """Return the `limit` most recent events"""
+        return self.query(limit=limit)[0]
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+Fleet log shipping for USB Security Software
+Tails the segmented security log from a persisted cursor, groups new
+events into compressed batches in an on-disk spool and delivers the spool
+to a central collector over HTTP or syslog. A batch leaves the spool only
+once the collector has accepted it, so delivery is at-least-once; every
+event carries a stable id the collector can deduplicate on
+"""
+
+import os
+import json
+import gzip
+import time
+import uuid
+import random
+import socket
+import hashlib
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from metrics import registry
+
+SPOOL_DIR_NAME = 'ship_spool'
+CURSOR_FILE = 'cursor.json'
+BATCH_PREFIX = 'batch-'
+REJECTED_DIR = 'rejected'
+
+# Spool file suffix and Content-Encoding of each compression
+COMPRESSIONS = {'gzip': ('.gz', 'gzip'), 'zstd': ('.zst', 'zstd'), 'none': ('.ndjson', 'identity')}
+
+SHIPPED = registry.counter('shipped_events_total', "Security events accepted by the log collector")
+SHIP_FAILURES = registry.counter('ship_failures_total', "Failed deliveries to the log collector")
+SPOOL_BYTES = registry.gauge('ship_spool_bytes', "Compressed batches waiting for the log collector")
+
+
+class DeliveryError(Exception):
+    """The collector could not be reached or did not accept a batch; retried"""
+
+
+class BatchRejected(DeliveryError):
+    """The collector refused a batch outright; retrying cannot help"""
+
+
+def event_id(host, line):
+    """Stable id of one log line, the same however often it is shipped"""
+    return hashlib.blake2b(host.encode('utf-8') + b'\0' + line, digest_size=12).hexdigest()
+
+
+def envelope(host, line):
+    """Wrap a raw JSONL log line for the collector without re-encoding it"""
+    return (b'{"id":"' + event_id(host, line).encode('ascii') + b'","host":'
+            + json.dumps(host).encode('utf-8') + b',"record":' + line.rstrip(b'\r\n') + b'}\n')
+
+
+def compress(data, compression):
+    if compression == 'gzip':
+        # mtime=0 keeps a re-spooled batch byte-identical
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def resolve_compression(name):
+    """Fall back to gzip when zstd is asked for but not installed"""
+    if name == 'zstd':
+        try:
+            import zstandard   # noqa: F401
+        except ImportError:
+            print("zstandard is not installed; shipping logs with gzip")
+            return 'gzip'
+    return name if name in COMPRESSIONS else 'gzip'
+
+
+class SpooledBatch:
+    """One compressed batch file in the spool"""
+
+    def __init__(self, path):
+        self.path = path
+        name = os.path.basename(path)
+        stem, suffix = os.path.splitext(name)
+        self.compression = next((c for c, (s, _) in COMPRESSIONS.items() if s == suffix), 'none')
+        self.batch_id = stem.rsplit('-', 1)[-1]
+        self.size = os.path.getsize(path)
+
+    @property
+    def encoding(self):
+        return COMPRESSIONS[self.compression][1]
+
+    def payload(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def lines(self):
+        """The envelope lines, decompressed"""
+        return decompress(self.payload(), self.compression).splitlines()
+
+
+# Transports
+
+class HttpTransport:
+    """POSTs each batch as compressed NDJSON; any 2xx response is an acknowledgement"""
+
+    def __init__(self, url, timeout=10.0, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+
+    def send(self, batch):
+        import urllib.request
+        import urllib.error
+        headers = dict(self.headers)
+        headers.update({
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': batch.encoding,
+            # Lets the collector drop a batch it already has as a whole
+            'Idempotency-Key': batch.batch_id,
+        })
+        request = urllib.request.Request(self.url, data=batch.payload(), headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if e.code in (400, 413, 415, 422):
+                raise BatchRejected(f"collector refused batch: HTTP {e.code}")
+            raise DeliveryError(f"HTTP {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            raise DeliveryError(str(getattr(e, 'reason', e)))
+
+
+class SyslogTransport:
+    """
+    Sends each event as one RFC 5424 message; TCP uses octet-counted
+    framing (RFC 6587). UDP gives no acknowledgement, so with it delivery
+    is best effort once the datagrams leave the host
+    """
+
+    FACILITY_AUTH = 4
+    SEVERITY_NOTICE = 5
+    APP_NAME = 'usb-security'
+
+    def __init__(self, host, port=514, protocol='udp', timeout=10.0):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.timeout = timeout
+        self.hostname = socket.gethostname() or '-'
+
+    def format(self, line):
+        try:
+            entry = json.loads(line)
+            message_id = entry.get('record', {}).get('event') or '-'
+            structured = f'[usbsec@32473 id="{entry["id"]}"]'
+        except (ValueError, KeyError, AttributeError):
+            message_id, structured = '-', '-'
+        timestamp = datetime.now().astimezone().isoformat()
+        priority = self.FACILITY_AUTH * 8 + self.SEVERITY_NOTICE
+        header = (f"<{priority}>1 {timestamp} {self.hostname} {self.APP_NAME} {os.getpid()} "
+                  f"{str(message_id)[:32]} {structured} ")
+        return header.encode('utf-8') + b'\xef\xbb\xbf' + line
+
+    def send(self, batch):
+        messages = [self.format(line) for line in batch.lines() if line]
+        try:
+            if self.protocol == 'tcp':
+                with socket.create_connection((self.host, self.port), self.timeout) as sock:
+                    sock.sendall(b''.join(str(len(m)).encode('ascii') + b' ' + m for m in messages))
+            else:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                    for message in messages:
+                        sock.sendto(message, (self.host, self.port))
+        except OSError as e:
+            raise DeliveryError(str(e))
+
+
+def create_transport(url):
+    """
+    Collector URL to transport: http(s)://host/path, syslog://host[:514]
+    (UDP) or syslog+tcp://host[:601]
+    """
+    parts = urlsplit(url)
+    if parts.scheme in ('http', 'https'):
+        return HttpTransport(url)
+    if parts.scheme in ('syslog', 'syslog+udp'):
+        return SyslogTransport(parts.hostname, parts.port or 514, 'udp')
+    if parts.scheme == 'syslog+tcp':
+        return SyslogTransport(parts.hostname, parts.port or 601, 'tcp')
+    raise ValueError(f"Unsupported log collector URL: {url}")
+
+
+# The shipper
+
+class LogShipper:
+    """
+    Moves new security log events into the spool and the spool to the
+    collector, on one background thread that sleeps until the log is
+    written to, a batch is due or a retry is scheduled. Memory is bounded
+    by one batch; when the spool is full, events simply wait in the local
+    log (backpressure) until the collector catches up.
+    """
+
+    def __init__(self, security_log, transport, spool_dir=None, compression='gzip',
+                 batch_size=500, batch_bytes=1024 * 1024, batch_interval=5.0,
+                 max_spool_bytes=64 * 1024 * 1024, poll_interval=60.0,
+                 retry_min=1.0, retry_max=300.0, host=None):
+        self.log = security_log
+        self.transport = transport
+        self.spool_dir = spool_dir or os.path.join(os.path.dirname(security_log.log_dir), SPOOL_DIR_NAME)
+        self.compression = resolve_compression(compression)
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.batch_interval = batch_interval
+        self.max_spool_bytes = max_spool_bytes
+        # Catches writes by other processes sharing the log directory
+        self.poll_interval = poll_interval
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.host = host or socket.gethostname()
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Committed cursor (in the spool) and how far the open batch has read
+        self.cursor = self._load_cursor()
+        self._read_position = None
+        self._batch = []
+        self._batch_size_bytes = 0
+        self._batch_started = None
+
+        self._retry_delay = 0.0
+        self._next_attempt = 0.0
+        self._spool_full = False
+        # Set by spool_pending(): don't read the log again until it was cleared
+        self._resume_generation = 0
+        self.shipped = 0
+        self.failures = 0
+
+    # Cursor
+
+    @property
+    def cursor_path(self):
+        return os.path.join(self.spool_dir, CURSOR_FILE)
+
+    def _load_cursor(self):
+        try:
+            with open(self.cursor_path, 'r') as f:
+                data = json.load(f)
+            return (int(data['segment']), int(data['offset']), data.get('inode'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_cursor(self, cursor):
+        from background_writer import atomic_write
+        segment, offset, inode = cursor
+        atomic_write(self.cursor_path, json.dumps({'segment': segment, 'offset': offset, 'inode': inode}))
+        self.cursor = cursor
+
+    def _inode(self, number):
+        try:
+            return os.stat(self.log.segment_path(number)).st_ino
+        except OSError:
+            return None
+
+    def _start_position(self):
+        """Where reading resumes: the cursor, or the oldest event for a new spool"""
+        segments = self.log.list_segments()
+        if not segments:
+            return None
+        cursor = self._read_position or self.cursor
+        if cursor is None:
+            return (segments[0], 0, self._inode(segments[0]))
+
+        segment, offset, inode = cursor
+        if segment > segments[-1]:
+            # The log was cleared and numbering restarted
+            return (segments[0], 0, self._inode(segments[0]))
+        if segment not in segments:
+            later = [n for n in segments if n > segment]
+            print(f"Log shipping: segment {segment} was removed before it was shipped")
+            return (later[0], 0, self._inode(later[0]))
+        current = self._inode(segment)
+        if inode is not None and current != inode:
+            return (segments[0], 0, self._inode(segments[0]))
+        try:
+            if offset > os.path.getsize(self.log.segment_path(segment)):
+                return (segments[0], 0, self._inode(segments[0]))
+        except OSError:
+            pass
+        return (segment, offset, current)
+
+    # Spool
+
+    def spooled(self):
+        """Batches waiting for delivery, oldest first"""
+        try:
+            names = sorted(n for n in os.listdir(self.spool_dir) if n.startswith(BATCH_PREFIX))
+        except OSError:
+            return []
+        batches = []
+        for name in names:
+            try:
+                batches.append(SpooledBatch(os.path.join(self.spool_dir, name)))
+            except OSError:
+                continue
+        return batches
+
+    def spool_bytes(self):
+        return sum(batch.size for batch in self.spooled())
+
+    def _next_sequence(self):
+        batches = self.spooled()
+        if not batches:
+            return 1
+        try:
+            return int(os.path.basename(batches[-1].path)[len(BATCH_PREFIX):].split('-')[0]) + 1
+        except ValueError:
+            return len(batches) + 1
+
+    def _seal(self):
+        """Write the open batch to the spool, then commit the cursor past it"""
+        if not self._batch:
+            return
+        from background_writer import atomic_write
+        suffix = COMPRESSIONS[self.compression][0]
+        name = f"{BATCH_PREFIX}{self._next_sequence():012d}-{uuid.uuid4().hex}{suffix}"
+        atomic_write(os.path.join(self.spool_dir, name), compress(b''.join(self._batch), self.compression))
+        # A crash between these two writes re-spools the batch; ids dedupe it
+        self._save_cursor(self._read_position)
+        self._batch = []
+        self._batch_size_bytes = 0
+        self._batch_started = None
+        SPOOL_BYTES.set(self.spool_bytes())
+
+    def collect(self, force=False):
+        """
+        Read new log lines into the open batch and seal it when it is full,
+        old enough or `force` is set. Returns the number of lines read.
+        """
+        with self._lock:
+            return self._collect_locked(force)
+
+    def _collect_locked(self, force):
+        if self.log.generation < self._resume_generation:
+            return 0
+        if not force and self.max_spool_bytes and self.spool_bytes() >= self.max_spool_bytes:
+            if not self._spool_full:
+                print("Log shipping spool is full; events wait in the local log")
+                self._spool_full = True
+            return 0
+        self._spool_full = False
+
+        read = 0
+        position = self._start_position()
+        while position is not None:
+            segment, offset, inode = position
+            try:
+                with open(self.log.segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break   # still being written
+                        offset += len(line)
+                        if line.strip():
+                            self._batch.append(envelope(self.host, line))
+                            self._batch_size_bytes += len(self._batch[-1])
+                            if self._batch_started is None:
+                                self._batch_started = time.monotonic()
+                            read += 1
+                        self._read_position = (segment, offset, inode)
+                        if len(self._batch) >= self.batch_size or self._batch_size_bytes >= self.batch_bytes:
+                            self._seal()
+                            if not force and self.max_spool_bytes and \
+                                    self.spool_bytes() >= self.max_spool_bytes:
+                                return read
+            except OSError:
+                pass
+            self._read_position = (segment, offset, inode)
+
+            later = [n for n in self.log.list_segments() if n > segment]
+            if not later:
+                break
+            position = (later[0], 0, self._inode(later[0]))
+            self._read_position = position
+
+        if self._batch and (force or time.monotonic() - self._batch_started >= self.batch_interval):
+            self._seal()
+        elif not self._batch and self._read_position and self._read_position != self.cursor:
+            # Only blank or torn lines were read; nothing to spool but move on
+            self._save_cursor(self._read_position)
+        return read
+
+    def spool_pending(self):
+        """Spool every unshipped event now (SecurityLog.clear() calls this first)"""
+        with self._lock:
+            self._collect_locked(force=True)
+            # Numbering restarts once the log is cleared
+            self._read_position = None
+            self._save_cursor((1, 0, None))
+            self._resume_generation = self.log.generation + 1
+
+    # Delivery
+
+    def deliver(self):
+        """Send spooled batches oldest first until one fails; returns batches sent"""
+        sent = 0
+        for batch in self.spooled():
+            if self._stop_event.is_set():
+                break
+            try:
+                self.transport.send(batch)
+            except BatchRejected as e:
+                print(f"Log shipping: {e}; moved {os.path.basename(batch.path)} to {REJECTED_DIR}/")
+                rejected = os.path.join(self.spool_dir, REJECTED_DIR)
+                os.makedirs(rejected, exist_ok=True)
+                os.replace(batch.path, os.path.join(rejected, os.path.basename(batch.path)))
+                continue
+            except DeliveryError as e:
+                self.failures += 1
+                SHIP_FAILURES.inc()
+                self._retry_delay = min(self.retry_max, max(self.retry_min, self._retry_delay * 2))
+                # Jitter keeps a fleet from retrying in lockstep after an outage
+                self._next_attempt = time.monotonic() + self._retry_delay * random.uniform(0.5, 1.0)
+                print(f"Log shipping failed ({e}); retrying in {self._retry_delay:.0f}s")
+                break
+
+            count = sum(1 for line in batch.lines() if line)
+            os.remove(batch.path)
+            self.shipped += count
+            SHIPPED.inc(count)
+            self._retry_delay = 0.0
+            self._next_attempt = 0.0
+            sent += 1
+        SPOOL_BYTES.set(self.spool_bytes())
+        return sent
+
+    # Thread
+
+    def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.log.write_listeners.append(self.wake)
+        self.log.clear_hooks.append(self.spool_pending)
+        SPOOL_BYTES.set(self.spool_bytes())
+        self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _timeout(self):
+        now = time.monotonic()
+        deadlines = [now + self.poll_interval]
+        if self._batch_started is not None:
+            deadlines.append(self._batch_started + self.batch_interval)
+        if self._next_attempt:
+            deadlines.append(self._next_attempt)
+        return max(0.0, min(deadlines) - now)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self._timeout())
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.collect()
+                if time.monotonic() >= self._next_attempt:
+                    self.deliver()
+            except Exception as e:
+                print(f"Log shipping error: {e}")
+
+    def stop(self):
+        """Spool what has been read so nothing waits in memory, then stop"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        for hooks, hook in ((self.log.write_listeners, self.wake), (self.log.clear_hooks, self.spool_pending)):
+            if hook in hooks:
+                hooks.remove(hook)
+        try:
+            with self._lock:
+                if self._batch:
+                    self._seal()
+        except OSError as e:
+            print(f"Log shipping: could not spool the open batch: {e}")
+
+    def stats(self):
+        return {'shipped': self.shipped, 'failures': self.failures,
+                'spooled_batches': len(self.spooled()), 'spool_bytes': self.spool_bytes(),
+                'cursor': self.cursor}
+
+
+def create_shipper(security_log, settings):
+    """LogShipper for the collector configured in settings, or None when shipping is off"""
+    url = settings.get('log_collector')
+    if not url:
+        return None
+    try:
+        transport = create_transport(url)
+    except ValueError as e:
+        print(f"Log shipping disabled: {e}")
+        return None
+    return LogShipper(security_log, transport, compression=settings.get('log_compression', 'gzip'))
@@ -1,81 +1,364 @@
 import sys
 import os
 import json
+import bisect
 import threading
 import time
 from datetime import datetime
+
+# Reference point for the startup timings in USBSecurityApp.startup_times
+_PROCESS_START = time.perf_counter()
+
+if __name__ == "__main__":
+    # In a frozen build, content-scan workers start through this executable
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
+    # A second launch hands its arguments to the running instance and
+    # exits before paying for the Qt import
+    from instance_lock import forward_to_running_instance
+    if forward_to_running_instance(sys.argv[1:]):
+        print("USB Security is already running; request forwarded.")
+        sys.exit(0)
+
 from PyQt5.QtWidgets import (QApplication, QSystemTrayIcon, QMenu, QAction, 
                             QMessageBox, QDialog, QVBoxLayout, QHBoxLayout,
-                            QLabel, QPushButton, QListWidget, QTextEdit,
-                            QCheckBox, QSpinBox, QGroupBox, QFormLayout)
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject
+                            QLabel, QPushButton, QListView,
+                            QLineEdit, QCheckBox, QSpinBox, QGroupBox, QFormLayout,
+                            QFileDialog)
+from PyQt5.QtCore import (Qt, QTimer, pyqtSignal, QObject,
+                          QAbstractListModel, QModelIndex)
 from PyQt5.QtGui import QIcon, QPixmap, QPainter, QColor
 
-from device_monitor import DeviceMonitor
-from security_overlay import SecurityOverlay, BlinkingOverlay
+# device_monitor (WMI/psutil) and security_overlay are imported on first use
+from security_log import SecurityLog
+from log_query import LogQuery
+from whitelist_store import WhitelistStore, WhitelistSearch
+from device_state import DeviceTable, device_key
+from device_sources import resolve_mountpoint
+from event_coalescer import EventCoalescer
+from device_identity import DeviceIdentityCache
+from policy_engine import PolicyStore, is_device_authorized
+from config_service import ConfigService, diff_settings
+from background_writer import BackgroundWriter
+from log_shipper import create_shipper
+from content_scanner import create_scanner
+from blocklist import Blocklist
+from whitelist_manifest import ManagedWhitelist, ManifestError
+from metrics import (MetricsExporter, stamp, record_lock, LOCK_SLA, EVENTS, ALERTS,
+                     DETECTION_LATENCY, SIGNAL_QUEUE_DELAY)
 
 class USBSecurityApp(QObject):
     device_detected = pyqtSignal(str, dict)
     device_removed = pyqtSignal(str, dict)
+    device_batch = pyqtSignal(list)
+    command_received = pyqtSignal(list)
+    policy_changed = pyqtSignal()
+    config_changed = pyqtSignal(list)
+    manifest_prepared = pyqtSignal(object)
+    scan_progress = pyqtSignal(str, object)
+    scan_finished = pyqtSignal(str, object)
+    
+    RECONCILE_INTERVAL_MS = 30000
+    # How long start_scan waits for an automounter to mount a new volume
+    MOUNT_RETRY_MS = 1000
+    MOUNT_RETRIES = 10
+    ICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'shield_icon.png')
     
-    def __init__(self):
+    def __init__(self, device_source=None):
         super().__init__()
         self.app = QApplication(sys.argv)
         self.app.setQuitOnLastWindowClosed(False)
+        self.startup_times = {}
         
-        # Initialize components
-        self.device_monitor = DeviceMonitor(callback=self.handle_device_event)
+        # An optional DeviceSource replaces the monitor's own detection;
+        # a daemon source also takes over policy and logging
+        self.device_source = device_source
+        self.remote_policy = getattr(device_source, 'remote_policy', False)
+        self.device_monitor = None
         self.security_overlay = None
+        self.overlay_pool = None
+        self.log_shipper = None
+        self.managed_whitelist = ManagedWhitelist()
+        self.content_scanner = None
+        self.hash_blocklist = Blocklist('hashes')
+        self.serial_blocklist = Blocklist('serials')
+        self.scans = {}          # device key -> (ScanJob, fingerprint)
+        self.scan_cleared = {}   # fingerprint -> device key, for devices that scanned clean
+        self.dialogs = {}
+        self.first_paint_probe = None
         self.overlay_active = False
-        self.settings = self.load_settings()
+        self.started = False
+        self.settings = {}
+        self.startup_benchmark = False
+        self.pending_command = []
         
-        # Create system tray
+        # Show the tray straight away; everything else starts once the
+        # event loop is running
         self.create_tray_icon()
+        self.mark_startup('tray_visible')
         
         # Connect signals
+        self.device_batch.connect(self.on_device_batch)
         self.device_detected.connect(self.on_device_detected)
         self.device_removed.connect(self.on_device_removed)
+        self.command_received.connect(self.on_forwarded_launch)
+        self.policy_changed.connect(self.on_policy_changed)
+        self.config_changed.connect(self.on_config_changed)
+        self.manifest_prepared.connect(self.on_manifest_prepared)
+        self.scan_progress.connect(self.on_scan_progress)
+        self.scan_finished.connect(self.on_scan_finished)
+        
+        QTimer.singleShot(0, self.start_services)
+    
+    def mark_startup(self, stage):
+        """Record seconds since process start for a startup stage (first time only)"""
+        self.startup_times.setdefault(stage, time.perf_counter() - _PROCESS_START)
+    
+    def start_services(self):
+        """Load settings, open the log and start device monitoring"""
+        self.config_writer = BackgroundWriter()
+        # Validated settings; edits to config/settings.json apply live
+        self.config_service = ConfigService(writer=self.config_writer)
+        self.settings = self.config_service.settings
+        self.managed_whitelist.integrity_only = self.settings.get('manifest_integrity_only', False)
+        
+        # Debounce bursts from monitor threads before they reach the GUI thread
+        self.event_coalescer = EventCoalescer(
+            self.queue_device_batch,
+            window=self.settings.get('debounce_window_ms', 150) / 1000.0
+        )
+        
+        if self.remote_policy:
+            # Thin client: the daemon owns detection, whitelist and log
+            from daemon_client import RemoteSecurityLog, RemoteLogQuery
+            self.security_log = RemoteSecurityLog(self.device_source.client())
+            self.log_query = RemoteLogQuery(self.security_log.client)
+            self.whitelist_store = WhitelistStore()
+        else:
+            # Append-only event log; absorb anything written in the old format
+            self.security_log = SecurityLog()
+            self.security_log.import_legacy()
+            self.log_query = LogQuery(self.security_log)
+            
+            if not self.device_source:
+                from device_monitor import DeviceMonitor
+                self.device_monitor = DeviceMonitor(callback=self.handle_device_event)
+            self.whitelist_store = WhitelistStore()
+            self.rebuild_whitelist()
+            # Entries provisioned by the last applied manifest (verified off-thread)
+            self.import_manifest()
+            # Rules in config/policy.json take precedence over the whitelist
+            self.policy_store = PolicyStore(on_change=self.policy_changed.emit)
+            self.policy_store.start()
+        if self.device_source:
+            self.device_source.callback = self.handle_device_event
+        self.device_identity = DeviceIdentityCache(writer=self.config_writer)
+        self.device_table = DeviceTable(self.is_drive_authorized, on_removed=self.forget_device)
         
         # Start monitoring
-        self.device_monitor.start_monitoring()
-        
-    def load_settings(self):
-        """Load application settings"""
-        settings_path = os.path.join('config', 'settings.json')
-        default_settings = {
-            'lockout_duration': 15,  # minutes
-            'enable_blinking': True,
-            'enable_notifications': True,
-            'auto_start': True,
-            'whitelist': []
+        if self.device_source:
+            self.device_source.start()
+        else:
+            self.device_monitor.start_monitoring()
+        self.started = True
+        self.status_action.setText("USB Security: Active")
+        self.mark_startup('monitor_started')
+        
+        # Seed the device table, then periodically correct any drift
+        self.reconcile_devices()
+        self.reconcile_timer = QTimer()
+        self.reconcile_timer.timeout.connect(self.reconcile_devices)
+        self.reconcile_timer.start(self.RECONCILE_INTERVAL_MS)
+        self.config_service.start(self.config_changed.emit)
+        self.start_metrics()
+        self.start_log_shipping()
+        self.start_content_scanning()
+        
+        # Show startup notification
+        if self.settings.get('enable_notifications', True):
+            self.tray_icon.showMessage(
+                "USB Security Active",
+                "USB/HDD protection is now monitoring your system.",
+                QSystemTrayIcon.Information,
+                3000
+            )
+        
+        if self.pending_command:
+            self.run_command(self.pending_command)
+    
+    def start_metrics(self):
+        """Export hot-path metrics to config/metrics.prom (and HTTP if configured)"""
+        self.metrics_exporter = MetricsExporter(port=self.settings.get('metrics_port', 0))
+        self.metrics_exporter.start()
+    
+    def start_log_shipping(self):
+        """Ship the security log to settings['log_collector'] (the daemon ships for thin clients)"""
+        if not self.remote_policy:
+            self.log_shipper = create_shipper(self.security_log, self.settings)
+        if self.log_shipper:
+            self.log_shipper.start()
+    
+    def start_content_scanning(self):
+        """Scan untrusted devices if settings['content_scan'] is on (the daemon decides for thin clients)"""
+        if not self.remote_policy:
+            self.content_scanner = create_scanner(self.settings, self.hash_blocklist)
+    
+    def on_forwarded_launch(self, argv):
+        """Handle the command line of a second launch (GUI thread)"""
+        try:
+            command = parse_arguments(argv).command
+        except SystemExit:
+            return   # argparse already printed the usage error
+        if command:
+            self.run_command(command)
+        elif self.settings.get('enable_notifications', True):
+            self.tray_icon.showMessage(
+                "USB Security",
+                "USB Security is already running.",
+                QSystemTrayIcon.Information,
+                3000
+            )
+    
+    def run_command(self, words):
+        """Run a command such as ['show', 'logs'] or ['reload', 'whitelist']"""
+        commands = {
+            'show logs': self.show_logs,
+            'show settings': self.show_settings,
+            'show whitelist': self.show_whitelist,
+            'reload whitelist': self.reload_whitelist,
+            'test overlay': self.test_overlay,
+            'exit': self.exit_application,
         }
+        name = ' '.join(words).lower()
+        if name not in commands:
+            print(f"Unknown command: {name} (available: {', '.join(commands)})")
+            return
+        if not self.started and name != 'exit':
+            # Arrived while still starting up; start_services runs it
+            self.pending_command = words
+            return
+        commands[name]()
+    
+    def reload_whitelist(self):
+        """Re-read the whitelist and re-check connected devices"""
+        if self.remote_policy:
+            self.security_log.client.call('reload_whitelist')
+            self.reconcile_devices()
+        else:
+            self.config_service.reload()
+            self.settings = self.config_service.settings
+            self.rebuild_whitelist()
+            self.device_table.reevaluate()
+        self.update_lockout()
+    
+    def local_whitelist(self):
+        """Entries kept by DeviceMonitor (none when a device source replaces it)"""
+        return list(self.device_monitor.whitelist) if self.device_monitor else []
+    
+    def rebuild_whitelist(self):
+        """Index DeviceMonitor's whitelist together with the one in settings.json"""
+        self.whitelist_store.clear()
+        self.whitelist_store.import_entries(self.local_whitelist())
+        self.whitelist_store.import_entries(self.settings.get('whitelist', []))
+        self.managed_whitelist.restore(self.whitelist_store)
+    
+    def import_manifest(self, path=None):
+        """
+        Verify and diff a whitelist manifest (default: the active one) on a
+        worker thread; on_manifest_prepared applies it on the GUI thread
+        """
+        if path is None and not os.path.exists(self.managed_whitelist.path):
+            return
+        base = self.managed_whitelist.digest
         
-        if os.path.exists(settings_path):
+        def prepare():
             try:
-                with open(settings_path, 'r') as f:
-                    settings = json.load(f)
-                    # Merge with defaults
-                    for key, value in default_settings.items():
-                        if key not in settings:
-                            settings[key] = value
-                    return settings
-            except:
-                pass
-                
-        return default_settings
+                manifest, diff = self.managed_whitelist.prepare(path)
+                self.manifest_prepared.emit((path, base, manifest, diff, None))
+            except (OSError, ManifestError) as e:
+                self.manifest_prepared.emit((path, base, None, None, e))
+        
+        threading.Thread(target=prepare, name="manifest-import", daemon=True).start()
     
-    def save_settings(self):
-        """Save application settings"""
-        settings_path = os.path.join('config', 'settings.json')
-        os.makedirs('config', exist_ok=True)
+    def on_manifest_prepared(self, result):
+        """Apply a verified manifest diff in one step (GUI thread)"""
+        path, base, manifest, diff, error = result
+        if error is not None:
+            message = f"Manifest not applied: {error}"
+        elif base != self.managed_whitelist.digest:
+            # Another manifest was applied meanwhile; diff against it instead
+            self.import_manifest(path)
+            return
+        else:
+            local = self.local_whitelist() + list(self.settings.get('whitelist', []))
+            self.managed_whitelist.apply(self.whitelist_store, manifest, diff, local, self.config_writer)
+            if diff:
+                self.device_table.reevaluate()
+                self.update_lockout()
+            message = (f"Whitelist manifest version {manifest.version} ({manifest.label}): "
+                       f"{len(manifest):,} entries, {diff.summary()}")
+        print(message)
         
-        with open(settings_path, 'w') as f:
-            json.dump(self.settings, f, indent=2)
+        dialog = self.dialogs.get('whitelist')
+        if path is not None and dialog is not None and dialog.isVisible():
+            dialog.show_status(message)
+        elif path is not None or error is not None:
+            self.tray_icon.showMessage("Device Whitelist", message,
+                                       QSystemTrayIcon.Warning if error else QSystemTrayIcon.Information,
+                                       3000)
+    
+    def on_config_changed(self, changes):
+        """Apply settings changed while running (GUI thread)"""
+        self.settings = self.config_service.settings
+        keys = {change.key for change in changes}
+        
+        if 'manifest_integrity_only' in keys:
+            # Takes effect with the next manifest import
+            self.managed_whitelist.integrity_only = self.settings['manifest_integrity_only']
+        if 'whitelist' in keys and not self.remote_policy:
+            self.rebuild_whitelist()
+            self.device_table.reevaluate()
+            self.update_lockout()
+        if 'metrics_port' in keys:
+            self.metrics_exporter.stop()
+            self.start_metrics()
+        if any(key == 'content_scan' or key.startswith('scan_') for key in keys):
+            # Scans already running finish with the old settings
+            self.start_content_scanning()
+        if keys & {'log_collector', 'log_compression'}:
+            if self.log_shipper:
+                self.log_shipper.stop()
+                self.log_shipper = None
+            self.start_log_shipping()
+        if 'debounce_window_ms' in keys:
+            self.event_coalescer.window = self.settings['debounce_window_ms'] / 1000.0
+        if 'lockout_duration' in keys and hasattr(self.security_overlay, 'set_duration'):
+            self.security_overlay.set_duration(self.settings['lockout_duration'])
+        # Everything else (notifications, blinking, renderer) is read when used
+        print(f"Settings updated: {', '.join(sorted(keys))}")
+    
+    def on_policy_changed(self):
+        """Re-check connected devices after config/policy.json was reloaded"""
+        self.device_table.reevaluate()
+        self.update_lockout()
+    
+    def update_lockout(self):
+        """Lock or unlock to match the device table after a rule change"""
+        count = self.device_table.unauthorized_count()
+        if self.overlay_active and count == 0:
+            self.on_unauthorized_devices_cleared()
+        elif count and not self.overlay_active:
+            # A device that was allowed is now blocked
+            self.show_security_overlay({})
+        
+    def save_settings(self):
+        """Save application settings (written atomically on the writer thread)"""
+        self.config_service.save(self.settings)
     
     def create_tray_icon(self):
         """Create system tray icon and menu"""
-        # Create a simple icon programmatically
-        icon = self.create_app_icon()
+        icon = self.load_app_icon()
         
         self.tray_icon = QSystemTrayIcon(icon, self.app)
         
@@ -83,7 +366,7 @@ class USBSecurityApp(QObject):
         menu = QMenu()
         
         # Status action
-        self.status_action = QAction("USB Security: Active", self.app)
+        self.status_action = QAction("USB Security: Starting...", self.app)
         self.status_action.setEnabled(False)
         menu.addAction(self.status_action)
         
@@ -120,15 +403,14 @@ class USBSecurityApp(QObject):
         
         self.tray_icon.setContextMenu(menu)
         self.tray_icon.show()
-        
-        # Show startup notification
-        if self.settings.get('enable_notifications', True):
-            self.tray_icon.showMessage(
-                "USB Security Active",
-                "USB/HDD protection is now monitoring your system.",
-                QSystemTrayIcon.Information,
-                3000
-            )
+    
+    def load_app_icon(self):
+        """Load the prebuilt tray icon from assets/, painting one if it is missing"""
+        if os.path.exists(self.ICON_PATH):
+            pixmap = QPixmap(self.ICON_PATH)
+            if not pixmap.isNull():
+                return QIcon(pixmap)
+        return self.create_app_icon()
     
     def create_app_icon(self):
         """Create application icon programmatically"""
@@ -163,15 +445,80 @@ class USBSecurityApp(QObject):
         return QIcon(pixmap)
     
     def handle_device_event(self, event_type, device_info):
-        """Handle device events from monitor"""
-        if event_type == 'device_connected':
-            self.device_detected.emit(event_type, device_info)
-        elif event_type == 'device_removed':
-            self.device_removed.emit(event_type, device_info)
+        """Handle device events from monitor (called on monitor threads)"""
+        stamp(device_info, 'detected')
+        EVENTS.inc(1, event_type)
+        self.event_coalescer.submit(event_type, device_info)
+    
+    def queue_device_batch(self, events):
+        """Hand a coalesced batch to the GUI thread (coalescer thread)"""
+        for _, device_info in events:
+            stamp(device_info, 'queued')
+        self.device_batch.emit(events)
+    
+    def on_device_batch(self, events):
+        """Dispatch a coalesced batch of device events on the GUI thread"""
+        now = time.monotonic()
+        for event_type, device_info in events:
+            trace = device_info.get('trace', {})
+            if 'queued' in trace:
+                SIGNAL_QUEUE_DELAY.observe(now - trace['queued'])
+            if 'detected' in trace:
+                DETECTION_LATENCY.observe(now - trace['detected'])
+            stamp(device_info, 'dispatched', now)
+            if event_type == 'device_connected':
+                self.device_detected.emit(event_type, device_info)
+            elif event_type == 'device_removed':
+                self.device_removed.emit(event_type, device_info)
+    
+    def is_drive_authorized(self, drive):
+        """Check a drive or device event against the whitelist"""
+        if self.remote_policy and 'authorized' in drive:
+            # Already decided by the daemon
+            return drive['authorized']
+        if self.remote_policy:
+            return False
+        return is_device_authorized(self.policy_store, self.whitelist_store,
+                                    self.device_identity, drive, self.scan_cleared,
+                                    self.serial_blocklist)
+    
+    def reconcile_devices(self):
+        """Rebuild the device table from a full scan to correct missed events"""
+        changed = False
+        if self.serial_blocklist.refresh() and not self.remote_policy:
+            # A new known-bad feed can lock out devices that are already connected
+            self.device_table.reevaluate()
+            changed = True
+        # A missed connect must lock the screen, a missed removal unlock it
+        if self.device_table.reconcile(self.get_connected_removable_drives()) or changed:
+            self.update_lockout()
+    
+    def get_connected_removable_drives(self):
+        """List removable drives from whichever component detects devices"""
+        if self.device_source:
+            return self.device_source.get_connected_removable_drives()
+        return self.device_monitor.get_connected_removable_drives()
     
     def on_device_detected(self, event_type, device_info):
         """Handle unauthorized device detection"""
-        if not self.overlay_active:
+        stamp(device_info, 'handled')
+        self.mark_startup('first_detection')
+        if self.startup_benchmark:
+            self.report_startup_benchmark()
+        self.serial_blocklist.refresh()
+        
+        unauthorized = False
+        for partition in device_info.get('partitions', [device_info]):
+            # The node may have been reused (a removal merged away or missed):
+            # nothing cached for it may carry over to this device
+            self.forget_device(partition)
+            if 'fingerprint' not in partition:
+                partition['fingerprint'] = self.device_identity.identify(partition, fresh=True)
+            if self.device_table.device_connected(partition):
+                unauthorized = True
+                self.start_scan(partition)
+        
+        if unauthorized and not self.overlay_active:
             self.show_security_overlay(device_info)
             
             if self.settings.get('enable_notifications', True):
@@ -184,28 +531,107 @@ class USBSecurityApp(QObject):
     
     def on_device_removed(self, event_type, device_info):
         """Handle device removal"""
-        if self.overlay_active and self.security_overlay:
-            # Check if any unauthorized devices are still connected
-            connected_drives = self.device_monitor.get_connected_removable_drives()
-            unauthorized_count = 0
-            
-            for drive in connected_drives:
-                device_id = f"{drive['device']}_{drive.get('fstype', 'unknown')}"
-                device_name = f"Drive {drive['device']}"
-                if not self.device_monitor.is_device_whitelisted(device_id, device_name):
-                    unauthorized_count += 1
-            
-            # If no unauthorized devices remain, close overlay
-            if unauthorized_count == 0:
-                self.close_security_overlay()
-                
-                if self.settings.get('enable_notifications', True):
-                    self.tray_icon.showMessage(
-                        "Security Restored",
-                        "All unauthorized devices removed. System restored to normal.",
-                        QSystemTrayIcon.Information,
-                        3000
-                    )
+        for partition in device_info.get('partitions', [device_info]):
+            self.device_table.device_removed(partition)
+            self.forget_device(partition)
+        
+        # If no unauthorized devices remain, close overlay
+        if self.overlay_active and self.device_table.unauthorized_count() == 0:
+            self.on_unauthorized_devices_cleared()
+    
+    def start_scan(self, partition, mount_wait=MOUNT_RETRIES):
+        """Scan an untrusted volume; a clean result authorizes it until it is removed"""
+        key = device_key(partition)
+        if not self.content_scanner or key in self.scans:
+            return
+        root = resolve_mountpoint(partition) or partition.get('drive_letter')
+        if not root:
+            return
+        if len(root) == 2 and root[1] == ':':
+            root += os.sep   # 'E:' alone means the current directory on E:
+        if not os.path.isdir(root):
+            # The kernel reports a partition before the desktop mounts it
+            if mount_wait > 0 and partition.get('device', '').startswith('/dev/'):
+                QTimer.singleShot(self.MOUNT_RETRY_MS, lambda: self.retry_scan(partition, mount_wait - 1))
+            return
+        
+        job = self.content_scanner.scan(root,
+                                        on_progress=lambda result: self.scan_progress.emit(key, result),
+                                        on_done=lambda result: self.scan_finished.emit(key, result))
+        self.scans[key] = (job, partition['fingerprint'])
+        self.status_action.setText(f"USB Security: Scanning {key}")
+    
+    def retry_scan(self, partition, mount_wait):
+        """Start a scan that was waiting for the volume to be mounted"""
+        key = device_key(partition)
+        if any(device_key(info) == key for info in self.device_table.connected_devices()):
+            self.start_scan(partition, mount_wait)
+    
+    def forget_device(self, partition):
+        """Drop the cached identity and scan state of a partition that is gone"""
+        self.device_identity.forget(partition)
+        self.forget_scan(device_key(partition))
+    
+    def forget_scan(self, key):
+        """Cancel a removed device's scan and drop its clean result"""
+        scan = self.scans.pop(key, None)
+        if scan is not None:
+            scan[0].cancel()
+        for fingerprint in [f for f, cleared_key in self.scan_cleared.items() if cleared_key == key]:
+            del self.scan_cleared[fingerprint]
+        self.restore_status()
+    
+    def restore_status(self):
+        """Show the lock state in the tray menu once no scan is running"""
+        if not self.scans:
+            self.status_action.setText("USB Security: LOCKED" if self.overlay_active
+                                       else "USB Security: Active")
+    
+    def on_scan_progress(self, key, result):
+        if key in self.scans and self.scans[key][0].result is result:
+            self.status_action.setText(f"USB Security: Scanning {key} ({result.files:,} files, "
+                                       f"{result.mb_per_s:.1f} MB/s)")
+    
+    def on_scan_finished(self, key, result):
+        """Act on a scan verdict (GUI thread)"""
+        scan = self.scans.get(key)
+        if scan is None or scan[0].result is not result:
+            return   # cancelled when the device was removed
+        fingerprint = scan[1]
+        del self.scans[key]
+        
+        self.security_log.append(f"CONTENT_SCAN_{result.verdict.upper()}",
+                                 {'device': key, 'fingerprint': fingerprint, 'scan': result.to_dict()})
+        print(f"Content scan of {key}: {result.verdict} ({result.summary()})")
+        if result.verdict == 'allow':
+            self.scan_cleared[fingerprint] = key
+            self.device_table.reevaluate()
+            self.update_lockout()
+            title, message = "Device Scanned", f"No threats found on {key}: {result.summary()}"
+        else:
+            title = "Device Blocked" if result.verdict == 'block' else "Device Scan Incomplete"
+            message = f"{key} stays locked: {result.reason or result.verdict}"
+        self.restore_status()
+        
+        if self.settings.get('enable_notifications', True):
+            self.tray_icon.showMessage(title, message,
+                                       QSystemTrayIcon.Information if result.verdict == 'allow'
+                                       else QSystemTrayIcon.Critical, 5000)
+    
+    def on_unauthorized_devices_cleared(self):
+        """Close the overlay once every unauthorized device is gone"""
+        if not self.security_overlay:
+            return
+        
+        self.close_security_overlay()
+        
+        if self.settings.get('enable_notifications', True):
+            self.tray_icon.showMessage(
+                "Security Restored",
+                "All unauthorized devices removed. System restored to normal.",
+                QSystemTrayIcon.Information,
+                3000
+            )
     
     def show_security_overlay(self, device_info):
         """Show the security overlay"""
@@ -215,17 +641,49 @@ class USBSecurityApp(QObject):
         self.overlay_active = True
         duration = self.settings.get('lockout_duration', 15)
         
-        if self.settings.get('enable_blinking', True):
-            self.security_overlay = BlinkingOverlay(duration_minutes=duration)
+        blinking = self.settings.get('enable_blinking', True)
+        if self.settings.get('overlay_renderer', 'prerendered') == 'prerendered':
+            # One window per screen, sharing frames and a single timer; the
+            # windows are kept between alerts and re-armed
+            if self.overlay_pool is None:
+                from overlay_rendering import OverlayManager
+                self.overlay_pool = OverlayManager(duration_minutes=duration, blinking=blinking)
+                self.overlay_pool.overlay_closed.connect(self.on_overlay_closed)
+            else:
+                self.overlay_pool.rearm(duration, blinking)
+            self.security_overlay = self.overlay_pool
         else:
-            self.security_overlay = SecurityOverlay(duration_minutes=duration)
+            from security_overlay import SecurityOverlay, BlinkingOverlay
+            if blinking:
+                self.security_overlay = BlinkingOverlay(duration_minutes=duration)
+            else:
+                self.security_overlay = SecurityOverlay(duration_minutes=duration)
+            self.security_overlay.overlay_closed.connect(self.on_overlay_closed)
+        stamp(device_info, 'overlay_built')
         
-        self.security_overlay.overlay_closed.connect(self.on_overlay_closed)
         self.security_overlay.show()
+        stamp(device_info, 'overlay_shown')
+        ALERTS.inc()
+        self.watch_first_paint(device_info['trace'])
         
         # Update tray status
         self.status_action.setText("USB Security: LOCKED")
     
+    def watch_first_paint(self, trace):
+        """Finish the detection trace when the overlay first reaches the screen"""
+        from overlay_rendering import FirstPaintProbe
+        overlays = getattr(self.security_overlay, 'overlays', None)
+        widgets = list(overlays.values()) if overlays is not None else [self.security_overlay]
+        
+        def painted(when):
+            trace['first_paint'] = when
+            latency = record_lock(trace)
+            if latency is not None and latency > LOCK_SLA:
+                print(f"Lockout took {latency * 1000:.0f} ms from detection "
+                      f"(target {LOCK_SLA * 1000:.0f} ms)")
+        
+        self.first_paint_probe = FirstPaintProbe(widgets, painted)
+    
     def close_security_overlay(self):
         """Close the security overlay"""
         if self.security_overlay:
@@ -233,8 +691,12 @@ class USBSecurityApp(QObject):
     
     def on_overlay_closed(self):
         """Handle overlay closure"""
+        if self.security_overlay is not None and self.security_overlay is not self.overlay_pool:
+            # Classic overlays are single-use
+            self.security_overlay.deleteLater()
         self.overlay_active = False
         self.security_overlay = None
+        self.first_paint_probe = None
         self.status_action.setText("USB Security: Active")
     
     def test_overlay(self):
@@ -245,28 +707,99 @@ class USBSecurityApp(QObject):
         }
         self.show_security_overlay(test_device_info)
     
+    def report_startup_benchmark(self):
+        """Print startup timings as JSON and quit (for benchmark.py)"""
+        print(json.dumps({stage: round(seconds * 1000, 1)
+                          for stage, seconds in self.startup_times.items()}), flush=True)
+        QTimer.singleShot(0, self.exit_application)
+    
     def show_settings(self):
         """Show settings dialog"""
-        dialog = SettingsDialog(self.settings, self)
+        if not self.started:
+            return
+        dialog = self.reuse_dialog('settings', SettingsDialog, self.settings)
+        if dialog is None:
+            return
         if dialog.exec_() == QDialog.Accepted:
+            changes = diff_settings(self.settings, dialog.get_settings())
             self.settings = dialog.get_settings()
             self.save_settings()
+            if changes:
+                self.on_config_changed(changes)
+    
+    def reuse_dialog(self, name, create, *args):
+        """
+        Return the dialog kept under name, re-armed with args (created with
+        them on first use), or None if it is already open
+        """
+        dialog = self.dialogs.get(name)
+        if dialog is None:
+            dialog = self.dialogs[name] = create(*args)
+        elif dialog.isVisible():
+            dialog.raise_()
+            dialog.activateWindow()
+            return None
+        else:
+            dialog.rearm(*args)
+        return dialog
     
     def show_logs(self):
         """Show security logs"""
-        dialog = LogsDialog(self)
-        dialog.exec_()
+        if not self.started:
+            return
+        dialog = self.reuse_dialog(
+            'logs', lambda: LogsDialog(self.security_log, log_query=self.log_query))
+        if dialog is not None:
+            dialog.exec_()
     
     def show_whitelist(self):
         """Show device whitelist management"""
-        dialog = WhitelistDialog(self.device_monitor, self)
+        if not self.started:
+            return
+        if self.remote_policy:
+            QMessageBox.information(None, "Device Whitelist",
+                                    "The whitelist is managed by the USB Security daemon.")
+            return
+        dialog = self.reuse_dialog(
+            'whitelist',
+            lambda: WhitelistDialog(self.device_monitor or SettingsWhitelist(self),
+                                    self.whitelist_store, self.device_identity,
+                                    import_manifest=self.import_manifest,
+                                    managed_whitelist=self.managed_whitelist))
+        if dialog is None:
+            return
         dialog.exec_()
+        self.device_table.reevaluate()
     
     def exit_application(self):
         """Exit the application"""
-        self.device_monitor.stop_monitoring()
+        if self.started:
+            self.reconcile_timer.stop()
+            if self.device_source:
+                self.device_source.stop()
+            else:
+                self.device_monitor.stop_monitoring()
+            self.event_coalescer.stop()
+            for job, _ in self.scans.values():
+                job.cancel()
+            self.config_service.stop()
+            self.metrics_exporter.stop()
+            if self.log_shipper:
+                self.log_shipper.stop()
+            if not self.remote_policy:
+                self.policy_store.stop()
+            # Flush queued log and config writes before exiting
+            self.security_log.close()
+            self.config_writer.close()
         if self.security_overlay:
             self.security_overlay.close()
+        # Deterministic teardown of the pooled windows
+        if self.overlay_pool:
+            self.overlay_pool.dispose()
+        for dialog in self.dialogs.values():
+            dialog.close()
+            dialog.deleteLater()
+        self.dialogs = {}
         self.tray_icon.hide()
         self.app.quit()
     
@@ -277,8 +810,16 @@ class USBSecurityApp(QObject):
 class SettingsDialog(QDialog):
     def __init__(self, settings, parent=None):
         super().__init__(parent)
-        self.settings = settings.copy()
         self.init_ui()
+        self.rearm(settings)
+    
+    def rearm(self, settings):
+        """Show current settings again (the dialog is reused)"""
+        self.settings = settings.copy()
+        self.duration_spin.setValue(self.settings.get('lockout_duration', 15))
+        self.blinking_check.setChecked(self.settings.get('enable_blinking', True))
+        self.notifications_check.setChecked(self.settings.get('enable_notifications', True))
+        self.autostart_check.setChecked(self.settings.get('auto_start', True))
     
     def init_ui(self):
         self.setWindowTitle("USB Security Settings")
@@ -293,23 +834,19 @@ class SettingsDialog(QDialog):
         # Lockout duration
         self.duration_spin = QSpinBox()
         self.duration_spin.setRange(1, 60)
-        self.duration_spin.setValue(self.settings.get('lockout_duration', 15))
         self.duration_spin.setSuffix(" minutes")
         general_layout.addRow("Lockout Duration:", self.duration_spin)
         
         # Enable blinking
         self.blinking_check = QCheckBox()
-        self.blinking_check.setChecked(self.settings.get('enable_blinking', True))
         general_layout.addRow("Enable Blinking Effect:", self.blinking_check)
         
         # Enable notifications
         self.notifications_check = QCheckBox()
-        self.notifications_check.setChecked(self.settings.get('enable_notifications', True))
         general_layout.addRow("Enable Notifications:", self.notifications_check)
         
         # Auto start
         self.autostart_check = QCheckBox()
-        self.autostart_check.setChecked(self.settings.get('auto_start', True))
         general_layout.addRow("Start with Windows:", self.autostart_check)
         
         general_group.setLayout(general_layout)
@@ -331,19 +868,205 @@ class SettingsDialog(QDialog):
         self.setLayout(layout)
     
     def get_settings(self):
-        return {
+        # Keep settings the dialog doesn't show (debounce, renderer, whitelist...)
+        settings = dict(self.settings)
+        settings.update({
             'lockout_duration': self.duration_spin.value(),
             'enable_blinking': self.blinking_check.isChecked(),
             'enable_notifications': self.notifications_check.isChecked(),
-            'auto_start': self.autostart_check.isChecked(),
-            'whitelist': self.settings.get('whitelist', [])
-        }
+            'auto_start': self.autostart_check.isChecked()
+        })
+        return settings
+
+class LogListModel(QAbstractListModel):
+    """List model that pages log entries in from the index as the view scrolls"""
+    
+    def __init__(self, log_query, page_size=100, parent=None):
+        super().__init__(parent)
+        self.log_query = log_query
+        self.page_size = page_size
+        self.filters = {}
+        self.records = []
+        self.cursor = None
+        self.exhausted = False
+    
+    def reset(self, **filters):
+        """Drop loaded pages and start over with new filters"""
+        self.beginResetModel()
+        self.filters = filters
+        self.records = []
+        self.cursor = None
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+    
+    def clear(self):
+        """Release loaded pages (while the dialog is closed)"""
+        self.beginResetModel()
+        self.records = []
+        self.cursor = None
+        self.exhausted = True
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.records)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        
+        log = self.records[index.row()]
+        device = log.get('device') or {}
+        return (f"[{log.get('timestamp', 'Unknown')}] {log.get('event', 'Unknown')}\n"
+                f"  Device: {device.get('drive_letter', 'Unknown')}\n"
+                f"  Type: {device.get('fstype', 'Unknown')}")
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        
+        records, self.cursor = self.log_query.query(limit=self.page_size, cursor=self.cursor,
+                                                    **self.filters)
+        if self.cursor is None:
+            self.exhausted = True
+        if records:
+            first = len(self.records)
+            self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+            self.records.extend(records)
+            self.endInsertRows()
+
+class WhitelistListModel(QAbstractListModel):
+    """
+    List model over the whitelist's prefix index: rows matching the search
+    prefix are paged in as the view scrolls, and store edits insert or
+    remove single rows instead of reloading the list
+    """
+    
+    index_built = pyqtSignal(object)
+    state_changed = pyqtSignal()
+    
+    def __init__(self, whitelist_store, page_size=200, parent=None):
+        super().__init__(parent)
+        self.whitelist_store = whitelist_store
+        self.search = whitelist_store.search_index or WhitelistSearch(whitelist_store)
+        self.search.listeners.append(self.on_index_changed)
+        self.page_size = page_size
+        self.prefix = ''
+        self.rows = []      # (phase, term, key) in listing order
+        self.cursor = None
+        self.exhausted = True
+        self.active = False
+        self.index_built.connect(self.on_index_built)
+    
+    def set_prefix(self, prefix):
+        """Show the entries whose id or name starts with prefix"""
+        self.prefix = prefix
+        self.active = True
+        self.beginResetModel()
+        self.rows = []
+        self.cursor = None
+        self.exhausted = not self.search.ready
+        self.endResetModel()
+        if self.search.ready:
+            self.fetchMore(QModelIndex())
+        else:
+            self.build_index()
+        self.state_changed.emit()
+    
+    def clear(self):
+        """Release loaded rows (while the dialog is closed)"""
+        self.active = False
+        self.beginResetModel()
+        self.rows = []
+        self.cursor = None
+        self.exhausted = True
+        self.endResetModel()
+    
+    def build_index(self):
+        """Sort the index on a worker thread; the snapshot is taken here"""
+        if self.search.ready or self.search.building:
+            return
+        snapshot = self.search.snapshot()
+        threading.Thread(target=lambda: self.index_built.emit(self.search.build(snapshot)),
+                         name="whitelist-index", daemon=True).start()
+    
+    def on_index_built(self, built):
+        # Listeners (this model included) reload when it is installed
+        self.search.install(built)
+    
+    def on_index_changed(self, added, key, entry):
+        if added is None:
+            # Rebuilt or invalidated (e.g. a large manifest was applied)
+            if self.active:
+                self.set_prefix(self.prefix)
+            return
+        if not self.active:
+            return
+        row = self.search.result_row(self.prefix, key, entry)
+        if row is None:
+            return
+        position = bisect.bisect_left(self.rows, row)
+        if added:
+            # Rows past the loaded pages arrive with a later fetchMore
+            if position < len(self.rows) or self.exhausted:
+                self.beginInsertRows(QModelIndex(), position, position)
+                self.rows.insert(position, row)
+                self.endInsertRows()
+        elif position < len(self.rows) and self.rows[position] == row:
+            self.beginRemoveRows(QModelIndex(), position, position)
+            del self.rows[position]
+            self.endRemoveRows()
+        self.state_changed.emit()
+    
+    def key_at(self, row):
+        return self.rows[row][2]
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        
+        key = self.rows[index.row()][2]
+        entry = self.whitelist_store.get(key) or {}
+        return f"{entry.get('name') or 'Unknown'} ({entry.get('id') or key})"
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        
+        rows, self.cursor = self.search.search(self.prefix, self.cursor, self.page_size)
+        if self.cursor is None:
+            self.exhausted = True
+        if rows:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
 
 class LogsDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, security_log, parent=None, log_query=None):
         super().__init__(parent)
+        self.security_log = security_log
+        self.log_query = log_query or LogQuery(security_log)
         self.init_ui()
         self.load_logs()
+        self.finished.connect(self.log_model.clear)
+    
+    def rearm(self):
+        """Reload for another showing (the dialog is reused)"""
+        self.load_logs()
     
     def init_ui(self):
         self.setWindowTitle("Security Logs")
@@ -351,9 +1074,30 @@ class LogsDialog(QDialog):
         
         layout = QVBoxLayout()
         
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
-        layout.addWidget(self.log_text)
+        # Filters
+        filter_layout = QHBoxLayout()
+        
+        self.event_filter = QLineEdit()
+        self.event_filter.setPlaceholderText("Event type (e.g. DEVICE_CONNECTED)")
+        self.event_filter.returnPressed.connect(self.load_logs)
+        
+        self.device_filter = QLineEdit()
+        self.device_filter.setPlaceholderText("Device")
+        self.device_filter.returnPressed.connect(self.load_logs)
+        
+        filter_layout.addWidget(self.event_filter)
+        filter_layout.addWidget(self.device_filter)
+        layout.addLayout(filter_layout)
+        
+        # Entries are fetched page by page as the list scrolls
+        self.log_model = LogListModel(self.log_query, parent=self)
+        self.log_view = QListView()
+        self.log_view.setModel(self.log_model)
+        self.log_view.setUniformItemSizes(True)
+        layout.addWidget(self.log_view)
+        
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
         
         # Buttons
         button_layout = QHBoxLayout()
@@ -375,41 +1119,65 @@ class LogsDialog(QDialog):
         self.setLayout(layout)
     
     def load_logs(self):
-        log_file = os.path.join('config', 'security_log.json')
-        if os.path.exists(log_file):
-            try:
-                with open(log_file, 'r') as f:
-                    logs = json.load(f)
-                
-                log_text = ""
-                for log in reversed(logs[-50:]):  # Show last 50 entries
-                    timestamp = log.get('timestamp', 'Unknown')
-                    event = log.get('event', 'Unknown')
-                    device = log.get('device', {})
-                    
-                    log_text += f"[{timestamp}] {event}\n"
-                    log_text += f"  Device: {device.get('drive_letter', 'Unknown')}\n"
-                    log_text += f"  Type: {device.get('fstype', 'Unknown')}\n"
-                    log_text += "-" * 50 + "\n"
-                
-                self.log_text.setPlainText(log_text)
-            except:
-                self.log_text.setPlainText("Error loading logs.")
+        try:
+            self.security_log.import_legacy()
+            self.log_model.reset(event=self.event_filter.text().strip() or None,
+                                 device=self.device_filter.text().strip() or None)
+        except Exception:
+            self.status_label.setText("Error loading logs.")
+            return
+        
+        if self.log_model.rowCount() == 0:
+            self.status_label.setText("No logs found.")
         else:
-            self.log_text.setPlainText("No logs found.")
+            self.status_label.setText(f"{self.log_query.count()} entries")
     
     def clear_logs(self):
-        log_file = os.path.join('config', 'security_log.json')
-        if os.path.exists(log_file):
-            os.remove(log_file)
-        self.log_text.setPlainText("Logs cleared.")
+        self.security_log.clear()
+        self.log_model.reset()
+        self.status_label.setText("Logs cleared.")
+
+class SettingsWhitelist:
+    """
+    Stands in for DeviceMonitor in the whitelist dialog when a device source
+    replaces it: entries are kept in settings.json
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    @property
+    def whitelist(self):
+        return self.app.settings.setdefault('whitelist', [])
+    
+    def add_to_whitelist(self, device_id, device_name):
+        self.whitelist.append({'id': device_id, 'name': device_name,
+                               'added_date': datetime.now().isoformat()})
+        self.save_whitelist()
+    
+    def save_whitelist(self):
+        self.app.save_settings()
+    
+    def get_connected_removable_drives(self):
+        return self.app.get_connected_removable_drives()
 
 class WhitelistDialog(QDialog):
-    def __init__(self, device_monitor, parent=None):
+    def __init__(self, device_monitor, whitelist_store, device_identity, parent=None,
+                 import_manifest=None, managed_whitelist=None):
         super().__init__(parent)
         self.device_monitor = device_monitor
+        self.whitelist_store = whitelist_store
+        self.device_identity = device_identity
+        self.import_manifest = import_manifest
+        self.managed_whitelist = managed_whitelist
         self.init_ui()
         self.load_whitelist()
+        self.finished.connect(self.whitelist_model.clear)
+    
+    def rearm(self):
+        """Reload for another showing (the dialog is reused)"""
+        self.status_label.setText("")
+        self.load_whitelist()
     
     def init_ui(self):
         self.setWindowTitle("Device Whitelist Management")
@@ -421,9 +1189,25 @@ class WhitelistDialog(QDialog):
         info_label = QLabel("Whitelisted devices will not trigger security alerts.")
         layout.addWidget(info_label)
         
-        # Whitelist display
-        self.whitelist_widget = QListWidget()
-        layout.addWidget(self.whitelist_widget)
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search by device id or name")
+        self.search_edit.textChanged.connect(self.load_whitelist)
+        layout.addWidget(self.search_edit)
+        
+        # Entries are fetched page by page from the prefix index as the list scrolls
+        self.whitelist_model = WhitelistListModel(self.whitelist_store, parent=self)
+        self.whitelist_model.state_changed.connect(self.update_count)
+        self.whitelist_view = QListView()
+        self.whitelist_view.setModel(self.whitelist_model)
+        self.whitelist_view.setUniformItemSizes(True)
+        layout.addWidget(self.whitelist_view)
+        
+        self.count_label = QLabel("")
+        layout.addWidget(self.count_label)
+        
+        self.status_label = QLabel("")
+        self.status_label.setWordWrap(True)
+        layout.addWidget(self.status_label)
         
         # Buttons
         button_layout = QHBoxLayout()
@@ -431,6 +1215,10 @@ class WhitelistDialog(QDialog):
         add_button = QPushButton("Add Current Devices")
         add_button.clicked.connect(self.add_current_devices)
         
+        import_button = QPushButton("Import Manifest...")
+        import_button.clicked.connect(self.choose_manifest)
+        import_button.setEnabled(self.import_manifest is not None)
+        
         remove_button = QPushButton("Remove Selected")
         remove_button.clicked.connect(self.remove_selected)
         
@@ -438,6 +1226,7 @@ class WhitelistDialog(QDialog):
         close_button.clicked.connect(self.accept)
         
         button_layout.addWidget(add_button)
+        button_layout.addWidget(import_button)
         button_layout.addWidget(remove_button)
         button_layout.addWidget(close_button)
         
@@ -445,52 +1234,109 @@ class WhitelistDialog(QDialog):
         self.setLayout(layout)
     
     def load_whitelist(self):
-        self.whitelist_widget.clear()
-        for device in self.device_monitor.whitelist:
-            item_text = f"{device.get('name', 'Unknown')} ({device.get('id', 'Unknown')})"
-            self.whitelist_widget.addItem(item_text)
+        self.whitelist_model.set_prefix(self.search_edit.text())
+    
+    def update_count(self):
+        model = self.whitelist_model
+        if not model.search.ready:
+            self.count_label.setText(f"Indexing {len(self.whitelist_store):,} entries...")
+        elif model.prefix.strip():
+            more = "+" if not model.exhausted else ""
+            self.count_label.setText(f"{model.rowCount():,}{more} of {len(self.whitelist_store):,} entries match")
+        else:
+            self.count_label.setText(f"{len(self.whitelist_store):,} entries")
+    
+    def choose_manifest(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import Whitelist Manifest", "",
+                                              "Whitelist manifests (*.manifest);;All files (*)")
+        if path:
+            self.status_label.setText("Verifying manifest...")
+            self.import_manifest(path)
+    
+    def show_status(self, message):
+        """Report a manifest import (the list follows the store by itself)"""
+        self.status_label.setText(message)
+        self.update_count()
     
     def add_current_devices(self):
         drives = self.device_monitor.get_connected_removable_drives()
         for drive in drives:
-            device_id = f"{drive['device']}_{drive.get('fstype', 'unknown')}"
+            device_id = self.device_identity.identify(drive)
             device_name = f"Drive {drive['device']}"
             
-            if not self.device_monitor.is_device_whitelisted(device_id, device_name):
+            if not self.whitelist_store.is_whitelisted(device_id, device_name):
                 self.device_monitor.add_to_whitelist(device_id, device_name)
+                self.whitelist_store.add(device_id, device_name)
         
-        self.load_whitelist()
         QMessageBox.information(self, "Success", f"Added {len(drives)} devices to whitelist.")
     
     def remove_selected(self):
-        current_row = self.whitelist_widget.currentRow()
-        if current_row >= 0:
-            del self.device_monitor.whitelist[current_row]
+        index = self.whitelist_view.currentIndex()
+        if not index.isValid():
+            return
+        key = self.whitelist_model.key_at(index.row())
+        
+        local = [entry for entry in self.device_monitor.whitelist
+                 if WhitelistStore.entry_key(entry) == key]
+        managed = self.managed_whitelist is not None and key in self.managed_whitelist.entries
+        if managed:
+            version = self.managed_whitelist.version
+            if not local:
+                self.status_label.setText(f"This device is provisioned by whitelist manifest "
+                                          f"version {version}; remove it from the manifest.")
+                return
+            self.status_label.setText(f"Local entry removed; the device stays trusted by "
+                                      f"whitelist manifest version {version}.")
+        else:
+            self.whitelist_store.remove(key)
+        
+        if local:
+            self.device_monitor.whitelist[:] = [entry for entry in self.device_monitor.whitelist
+                                                if WhitelistStore.entry_key(entry) != key]
             self.device_monitor.save_whitelist()
-            self.load_whitelist()
+
+def parse_arguments(argv):
+    """Parse our own options, leaving anything else for Qt"""
+    import argparse
+    parser = argparse.ArgumentParser(description="USB Security Software")
+    parser.add_argument('--source', default=None,
+                        help="device event source: auto, netlink, poll[:seconds], "
+                             "replay:<file> or daemon[:<socket>] (default: built-in DeviceMonitor)")
+    parser.add_argument('--startup-benchmark', action='store_true',
+                        help="print startup timings after the first detection and exit")
+    parser.add_argument('command', nargs='*',
+                        help="command for the running instance, e.g. 'show logs', "
+                             "'reload whitelist', 'exit'")
+    return parser.parse_known_args(argv)[0]
 
 def main():
-    # Ensure single instance
-    import socket
-    try:
-        # Try to bind to a port to ensure single instance
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind(('localhost', 12345))
-    except socket.error:
+    args = parse_arguments(sys.argv[1:])
+    
+    # Ensure single instance (the fast hand-off above covers the common
+    # case; this also settles two launches racing each other)
+    from instance_lock import InstanceLock, forward_to_running_instance
+    instance_lock = InstanceLock()
+    if not instance_lock.acquire():
+        if forward_to_running_instance(sys.argv[1:]):
+            return 0
         print("USB Security is already running!")
         return 1
     
     try:
-        app = USBSecurityApp()
+        device_source = None
+        if args.source:
+            from device_sources import create_device_source
+            device_source = create_device_source(args.source)
+        app = USBSecurityApp(device_source=device_source)
+        app.startup_benchmark = args.startup_benchmark
+        app.pending_command = args.command
+        instance_lock.serve(app.command_received.emit)
         return app.run()
     except Exception as e:
         print(f"Error starting application: {e}")
         return 1
     finally:
-        try:
-            sock.close()
-        except:
-            pass
+        instance_lock.release()
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Hot-path metrics for USB Security Software
+Each device event carries a 'trace' of time.monotonic() stamps, one per
+stage from detection to the first paint of the lockout overlay. The
+monotonic clock is system-wide, so a trace started in the daemon can be
+finished by a tray process. Counters and latency histograms are exported
+as Prometheus text, to a file (for the node_exporter textfile collector)
+and optionally from a localhost HTTP endpoint
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+METRICS_FILE = os.path.join('config', 'metrics.prom')
+PREFIX = 'usb_security'
+
+# "Locked within 500 ms of insertion"
+LOCK_SLA = 0.5
+
+# Stage names, in hot-path order
+STAGES = ('detected', 'queued', 'dispatched', 'handled',
+          'overlay_built', 'overlay_shown', 'first_paint')
+
+
+def stamp(device_info, stage, now=None):
+    """Record when device_info reached a stage (the first time only); returns the stamp"""
+    trace = device_info.get('trace')
+    if not isinstance(trace, dict):
+        trace = device_info['trace'] = {}
+    if stage not in trace:
+        trace[stage] = time.monotonic() if now is None else now
+    return trace[stage]
+
+
+def stage_offsets(trace):
+    """Seconds from detection to each later stage of a trace"""
+    start = trace.get('detected')
+    if start is None:
+        return {}
+    return {stage: trace[stage] - start for stage in STAGES if stage in trace}
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(tuple(str(v) for v in label_values), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in values]
+
+
+class Histogram:
+    """
+    Latency distribution: exact count and sum over all observations, and
+    quantiles over the most recent `keep` of them
+    """
+
+    kind = 'summary'
+    QUANTILES = (0.5, 0.99)
+
+    def __init__(self, name, help_text, keep=2048):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=keep)
+        self.count = 0
+        self.total = 0.0
+        self.last = None
+
+    def observe(self, seconds):
+        with self._lock:
+            self._recent.append(seconds)
+            self.last = seconds
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, fraction):
+        """Nearest-rank percentile of the recent window, or None if empty"""
+        with self._lock:
+            values = sorted(self._recent)
+        if not values:
+            return None
+        rank = max(1, int(fraction * len(values) + 0.999999))
+        return values[min(rank, len(values)) - 1]
+
+    def samples(self):
+        samples = []
+        for fraction in self.QUANTILES:
+            value = self.percentile(fraction)
+            if value is not None:
+                samples.append((self.name, _format_labels((), (), [('quantile', fraction)]), value))
+        with self._lock:
+            samples.append((self.name + '_sum', '', self.total))
+            samples.append((self.name + '_count', '', self.count))
+        return samples
+
+
+class Gauge:
+    """Current value, set directly or read from a callback at export time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), read=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.read = read
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[tuple(str(v) for v in label_values)] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        if self.read is not None:
+            return [(self.name, '', self.read())]
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labels, key), value) for key, value in values]
+
+
+class MetricsRegistry:
+    """Named metrics of one process, rendered together"""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}" if self.prefix else metric.name
+        with self._lock:
+            # Declaring the same metric twice returns the existing one
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, keep=2048):
+        return self._register(Histogram(name, help_text, keep))
+
+    def gauge(self, name, help_text, labels=(), read=None):
+        return self._register(Gauge(name, help_text, labels, read))
+
+    def get(self, name):
+        return self._metrics.get(f"{self.prefix}_{name}" if self.prefix else name)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Error reading metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# The process-wide registry and the hot-path metrics every component shares
+registry = MetricsRegistry()
+
+EVENTS = registry.counter('device_events_total', "Device events received from the source", ('event',))
+ALERTS = registry.counter('alerts_total', "Lockouts raised for unauthorized devices")
+LOG_WRITES = registry.counter('log_writes_total', "Records written to the security log")
+SLA_BREACHES = registry.counter('lock_sla_breaches_total',
+                                f"Lockouts whose first paint came later than {LOCK_SLA} s after detection")
+DETECTION_LATENCY = registry.histogram('detection_latency_seconds',
+                                       "Detection to dispatch on the handling thread (includes debouncing)")
+SIGNAL_QUEUE_DELAY = registry.histogram('signal_queue_delay_seconds',
+                                        "Coalescer delivery to the GUI-thread slot")
+FIRST_PAINT = registry.histogram('overlay_first_paint_seconds', "Overlay show() to its first paint")
+LOCK_LATENCY = registry.histogram('lock_latency_seconds', "Detection to the first paint of the overlay")
+LAST_ALERT = registry.gauge('last_alert_stage_seconds',
+                            "Seconds from detection to each stage of the most recent lockout", ('stage',))
+
+
+def record_lock(trace):
+    """Close a trace at the overlay's first paint and update the lock metrics"""
+    offsets = stage_offsets(trace)
+    if 'overlay_shown' in trace and 'first_paint' in trace:
+        FIRST_PAINT.observe(trace['first_paint'] - trace['overlay_shown'])
+    LAST_ALERT.clear()
+    for stage, seconds in offsets.items():
+        LAST_ALERT.set(seconds, stage)
+    latency = offsets.get('first_paint')
+    if latency is not None:
+        LOCK_LATENCY.observe(latency)
+        if latency > LOCK_SLA:
+            SLA_BREACHES.inc()
+    return latency
+
+
+class MetricsExporter:
+    """
+    Writes the registry to a .prom file every `interval` seconds (when
+    anything is new) and, with a port, serves it at http://127.0.0.1:port/metrics
+    """
+
+    def __init__(self, metrics=None, path=METRICS_FILE, interval=10.0, port=0):
+        self.registry = metrics or registry
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.server = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_written = None
+
+    def start(self):
+        if self.port:
+            self.serve_http(self.port)
+        if self.path:
+            self._thread = threading.Thread(target=self._run, name="metrics-export", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """Write the stats file now if it would change"""
+        text = self.registry.render()
+        if text == self._last_written:
+            return
+        from background_writer import atomic_write
+        try:
+            atomic_write(self.path, text)
+            self._last_written = text
+        except OSError as e:
+            print(f"Could not write metrics to {self.path}: {e}")
+
+    def serve_http(self, port):
+        """Serve the registry on localhost only; returns the bound port"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {port}: {e}")
+            return None
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        """Stop exporting; the file gets one final write"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(2.0)
+            self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
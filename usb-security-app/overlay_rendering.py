@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Pre-rendered security overlay for USB Security Software
+The static parts of the alert (logo, text, both blink states) are painted
+once per screen size into cached pixmaps; afterwards a timer tick only
+repaints the small region that actually changed
+"""
+
+import os
+import time
+from collections import deque
+
+from PyQt5.QtWidgets import QWidget, QApplication
+from PyQt5.QtCore import Qt, QObject, QEvent, QTimer, QRect, QPoint, pyqtSignal
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont, QPolygon
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'virus_logo.png')
+
+WHITE = QColor(255, 255, 255)
+RED = QColor(220, 0, 0)
+DARK = QColor(40, 40, 40)
+
+
+class PaintProfiler:
+    """Collects paint time per frame and process CPU use while an overlay is up"""
+
+    def __init__(self, keep=1000):
+        self.paint_times = deque(maxlen=keep)
+        self.frames = 0
+        self._wall_start = None
+        self._cpu_start = None
+
+    def start(self):
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def record(self, seconds):
+        self.frames += 1
+        self.paint_times.append(seconds)
+
+    def report(self):
+        """Return frame count, paint times (ms) and CPU percentage since start()"""
+        times = sorted(self.paint_times)
+        wall = time.perf_counter() - self._wall_start if self._wall_start else 0.0
+        cpu = time.process_time() - self._cpu_start if self._cpu_start else 0.0
+        return {
+            'frames': self.frames,
+            'paint_avg_ms': sum(times) / len(times) * 1000 if times else 0.0,
+            'paint_p99_ms': times[int(len(times) * 0.99) - 1] * 1000 if times else 0.0,
+            'paint_max_ms': times[-1] * 1000 if times else 0.0,
+            'wall_seconds': wall,
+            'cpu_percent': cpu / wall * 100 if wall else 0.0
+        }
+
+
+class FirstPaintProbe(QObject):
+    """
+    Calls callback(time.monotonic()) when the first of `widgets` receives a
+    paint event, i.e. when the lockout actually reaches the screen
+    """
+
+    def __init__(self, widgets, callback):
+        super().__init__()
+        self.callback = callback
+        self.widgets = list(widgets)
+        for widget in self.widgets:
+            widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and self.callback:
+            callback, self.callback = self.callback, None
+            for widget in self.widgets:
+                try:
+                    widget.removeEventFilter(self)
+                except RuntimeError:
+                    pass   # already deleted
+            callback(time.monotonic())
+        return False
+
+
+class FrameCache:
+    """Pixmaps of the static overlay content, keyed by size and blink state"""
+
+    def __init__(self, title="SECURITY ALERT",
+                 message="Unauthorized storage device detected!\nPossible virus threat.\n"
+                         "Remove the device to restore access."):
+        self.title = title
+        self.message = message
+        self._frames = {}
+        self._logo = None
+
+    def logo(self):
+        """The warning logo, loaded from assets/ or drawn if missing"""
+        if self._logo is None:
+            pixmap = QPixmap(LOGO_PATH) if os.path.exists(LOGO_PATH) else QPixmap()
+            if pixmap.isNull():
+                pixmap = QPixmap(200, 200)
+                pixmap.fill(Qt.transparent)
+                painter = QPainter(pixmap)
+                painter.setRenderHint(QPainter.Antialiasing)
+                painter.setBrush(RED)
+                painter.setPen(RED.darker(130))
+                painter.drawPolygon(QPolygon([QPoint(100, 20), QPoint(180, 160), QPoint(20, 160)]))
+                painter.setBrush(WHITE)
+                painter.setPen(WHITE)
+                painter.drawRect(90, 50, 20, 70)
+                painter.drawEllipse(85, 130, 30, 30)
+                painter.end()
+            self._logo = pixmap
+        return self._logo
+
+    @staticmethod
+    def layout(width, height):
+        """Return the logo, title, message and countdown rectangles for a screen size"""
+        logo_size = min(200, height // 4)
+        top = height // 6
+        logo = QRect((width - logo_size) // 2, top, logo_size, logo_size)
+        title = QRect(0, logo.bottom() + 30, width, 90)
+        message = QRect(0, title.bottom() + 20, width, 140)
+        countdown = QRect(width // 4, message.bottom() + 30, width // 2, 80)
+        return logo, title, message, countdown
+
+    def frame(self, width, height, blink_on, device_pixel_ratio=1.0):
+        """Return (rendering once) the full-screen static frame"""
+        key = (width, height, bool(blink_on), device_pixel_ratio)
+        pixmap = self._frames.get(key)
+        if pixmap is not None:
+            return pixmap
+
+        pixmap = QPixmap(int(width * device_pixel_ratio), int(height * device_pixel_ratio))
+        pixmap.setDevicePixelRatio(device_pixel_ratio)
+        pixmap.fill(WHITE)
+
+        logo_rect, title_rect, message_rect, _ = self.layout(width, height)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(logo_rect, self.logo())
+
+        if blink_on:
+            painter.setPen(RED)
+            painter.setFont(QFont('Arial', 48, QFont.Bold))
+            painter.drawText(title_rect, Qt.AlignCenter, self.title)
+
+        painter.setPen(DARK)
+        painter.setFont(QFont('Arial', 20))
+        painter.drawText(message_rect, Qt.AlignCenter, self.message)
+        painter.end()
+
+        self._frames[key] = pixmap
+        return pixmap
+
+    def clear(self):
+        self._frames.clear()
+
+
+# One cache for every overlay window in the process
+shared_frame_cache = FrameCache()
+
+
+class RenderedOverlay(QWidget):
+    """
+    Full-screen lockout window drawn from cached frames.
+    Same interface as SecurityOverlay: duration_minutes, overlay_closed.
+    """
+
+    overlay_closed = pyqtSignal()
+
+    BLINK_INTERVAL_MS = 500
+
+    def __init__(self, duration_minutes=15, blinking=True, frame_cache=None, profile=False,
+                 target_screen=None, external_timer=False):
+        super().__init__()
+        self.duration_minutes = duration_minutes
+        self.blinking = blinking
+        self.frame_cache = frame_cache or shared_frame_cache
+        self.profiler = PaintProfiler() if profile else None
+        self.target_screen = target_screen
+        self.external_timer = external_timer   # ticks come from an OverlayManager
+        self.blink_on = True
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + duration_minutes * 60
+        self._last_countdown_text = None
+
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.setAttribute(Qt.WA_NoSystemBackground)
+        self.setCursor(Qt.BlankCursor)
+
+        # A single timer drives both the blink and the countdown
+        self.tick_timer = QTimer(self)
+        self.tick_timer.timeout.connect(self.tick)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.profiler:
+            self.profiler.start()
+        if not self.external_timer:
+            self.tick_timer.start(self.BLINK_INTERVAL_MS if self.blinking else 1000)
+
+    def show(self):
+        screen = self.target_screen or QApplication.primaryScreen()
+        if screen is not None:
+            self.setGeometry(screen.geometry())
+        self.showFullScreen()
+
+    def hideEvent(self, event):
+        # Nothing visible to update while hidden or minimized
+        self.tick_timer.stop()
+        super().hideEvent(event)
+
+    def rearm(self, end_time=None, blink_on=True, blinking=None):
+        """Reset for another lockout (pooled windows are reused, not rebuilt)"""
+        self.start_time = time.monotonic()
+        self.end_time = end_time if end_time is not None else self.start_time + self.duration_minutes * 60
+        self.blink_on = blink_on
+        if blinking is not None:
+            self.blinking = blinking
+        self._last_countdown_text = None
+
+    def set_duration(self, duration_minutes):
+        """Change the lockout length; the countdown keeps its start time"""
+        self.duration_minutes = duration_minutes
+        self.end_time = self.start_time + duration_minutes * 60
+
+    def remaining_seconds(self):
+        return max(0, int(self.end_time - time.monotonic() + 0.999))
+
+    def countdown_text(self):
+        minutes, seconds = divmod(self.remaining_seconds(), 60)
+        return f"Time remaining: {minutes:02d}:{seconds:02d}"
+
+    def tick(self):
+        """Advance blink/countdown state and repaint only what changed"""
+        if self.remaining_seconds() == 0:
+            self.close()
+            return
+
+        _, title_rect, _, countdown_rect = self.frame_cache.layout(self.width(), self.height())
+        if self.blinking:
+            self.blink_on = not self.blink_on
+            self.update(title_rect)
+
+        text = self.countdown_text()
+        if text != self._last_countdown_text:
+            self.update(countdown_rect)
+
+    def paintEvent(self, event):
+        started = time.perf_counter()
+        painter = QPainter(self)
+
+        frame = self.frame_cache.frame(self.width(), self.height(), self.blink_on,
+                                       self.devicePixelRatioF())
+        ratio = frame.devicePixelRatio()
+        # Copy only the dirty rectangles, not their bounding box
+        for rect in event.region().rects():
+            painter.drawPixmap(rect, frame, QRect(rect.topLeft() * ratio, rect.size() * ratio))
+
+        _, _, _, countdown_rect = self.frame_cache.layout(self.width(), self.height())
+        if event.region().intersects(countdown_rect):
+            self._last_countdown_text = self.countdown_text()
+            painter.setPen(RED)
+            painter.setFont(QFont('Arial', 28, QFont.Bold))
+            painter.drawText(countdown_rect, Qt.AlignCenter, self._last_countdown_text)
+        painter.end()
+
+        if self.profiler:
+            self.profiler.record(time.perf_counter() - started)
+
+    def keyPressEvent(self, event):
+        # Emergency exit combinations
+        modifiers = event.modifiers()
+        if (event.key() == Qt.Key_Escape and modifiers & Qt.ControlModifier and
+                modifiers & Qt.ShiftModifier) or \
+                (event.key() == Qt.Key_F4 and modifiers & Qt.AltModifier):
+            self.close()
+            return
+        event.ignore()
+
+    def mousePressEvent(self, event):
+        event.accept()
+
+    def closeEvent(self, event):
+        self.tick_timer.stop()
+        self.overlay_closed.emit()
+        super().closeEvent(event)
+
+
+class OverlayManager(QObject):
+    """
+    Locks every screen with one RenderedOverlay per QScreen.
+    The windows share one FrameCache and are driven by a single timer;
+    screens plugged in or removed during a lockout are covered or released.
+    Closing only hides the windows: rearm() and show() reuse them for the
+    next lockout, and dispose() deletes them.
+    Same interface as SecurityOverlay: show(), close(), overlay_closed.
+    """
+
+    overlay_closed = pyqtSignal()
+
+    def __init__(self, duration_minutes=15, blinking=True, frame_cache=None, profile=False):
+        super().__init__()
+        self.duration_minutes = duration_minutes
+        self.blinking = blinking
+        self.frame_cache = frame_cache or shared_frame_cache
+        self.profile = profile
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + duration_minutes * 60
+        self.blink_on = True
+        self.overlays = {}   # QScreen -> RenderedOverlay
+        self._closed = False
+        self._watching_screens = False
+
+        self.tick_timer = QTimer(self)
+        self.tick_timer.timeout.connect(self.tick)
+
+    def rearm(self, duration_minutes=None, blinking=None):
+        """Start a fresh countdown so a closed manager can be shown again"""
+        if duration_minutes is not None:
+            self.duration_minutes = duration_minutes
+        if blinking is not None:
+            self.blinking = blinking
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + self.duration_minutes * 60
+        self.blink_on = True
+        self._closed = False
+
+    def show(self):
+        app = QApplication.instance()
+        if not self._watching_screens:
+            app.screenAdded.connect(self.add_screen)
+            app.screenRemoved.connect(self.remove_screen)
+            self._watching_screens = True
+        screens = app.screens()
+        # Pooled windows of screens unplugged while no lockout was running
+        for screen in [s for s in self.overlays if s not in screens]:
+            self.remove_screen(screen)
+        for screen in screens:
+            self.add_screen(screen)
+        self.tick_timer.start(RenderedOverlay.BLINK_INTERVAL_MS if self.blinking else 1000)
+
+    def set_duration(self, duration_minutes):
+        """Change the lockout length on every screen"""
+        self.duration_minutes = duration_minutes
+        self.end_time = self.start_time + duration_minutes * 60
+        for overlay in self.overlays.values():
+            overlay.end_time = self.end_time
+
+    def isVisible(self):
+        return any(overlay.isVisible() for overlay in self.overlays.values())
+
+    def add_screen(self, screen):
+        """Cover a (possibly newly connected) screen"""
+        if self._closed:
+            return
+        overlay = self.overlays.get(screen)
+        if overlay is None:
+            overlay = RenderedOverlay(
+                duration_minutes=self.duration_minutes,
+                blinking=self.blinking,
+                frame_cache=self.frame_cache,
+                profile=self.profile,
+                target_screen=screen,
+                external_timer=True
+            )
+            overlay.overlay_closed.connect(self.close)
+            screen.geometryChanged.connect(overlay.setGeometry)
+            self.overlays[screen] = overlay
+        elif overlay.isVisible():
+            return
+        # Join the running lockout instead of starting a fresh countdown
+        overlay.rearm(self.end_time, self.blink_on, self.blinking)
+        overlay.show()
+
+    def remove_screen(self, screen):
+        """Drop the window of a disconnected screen without ending the lockout"""
+        overlay = self.overlays.pop(screen, None)
+        if overlay is not None:
+            self._dispose(screen, overlay)
+
+    def _dispose(self, screen, overlay):
+        overlay.overlay_closed.disconnect(self.close)
+        try:
+            screen.geometryChanged.disconnect(overlay.setGeometry)
+        except (TypeError, RuntimeError):
+            pass   # screen already destroyed
+        overlay.close()
+        overlay.deleteLater()
+
+    def tick(self):
+        """One wakeup per interval for all screens"""
+        if self.end_time - time.monotonic() <= 0:
+            self.close()
+            return
+        if self.blinking:
+            self.blink_on = not self.blink_on
+        for overlay in self.overlays.values():
+            overlay.tick()
+
+    def profile_reports(self):
+        """PaintProfiler report per screen name (profile=True only)"""
+        return {screen.name(): overlay.profiler.report()
+                for screen, overlay in self.overlays.items() if overlay.profiler}
+
+    def close(self):
+        """End the lockout on every screen (emergency exit on any window ends it too)"""
+        if self._closed:
+            return
+        self._closed = True
+        self.tick_timer.stop()
+
+        if self._watching_screens:
+            app = QApplication.instance()
+            app.screenAdded.disconnect(self.add_screen)
+            app.screenRemoved.disconnect(self.remove_screen)
+            self._watching_screens = False
+
+        # Hidden, not deleted: the next lockout re-arms them
+        for overlay in self.overlays.values():
+            overlay.hide()
+        self.overlay_closed.emit()
+
+    def dispose(self):
+        """Close the lockout and delete every pooled window"""
+        self.close()
+        overlays, self.overlays = self.overlays, {}
+        for screen, overlay in overlays.items():
+            self._dispose(screen, overlay)
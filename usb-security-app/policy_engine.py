@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Rule-based device policy for USB Security Software
+Rules are read from config/policy.json and compiled into one index per
+field: a hash map for exact fields and sorted interval segments for range
+fields, each mapping a value to a bitmask of the rules it satisfies. A
+decision ANDs one mask per field and takes the lowest set bit, so its cost
+barely depends on how many rules there are
+"""
+
+import os
+import json
+import bisect
+import getpass
+from datetime import datetime
+
+from device_identity import is_device_whitelisted
+from config_service import ConfigWatcher
+
+POLICY_FILE = os.path.join('config', 'policy.json')
+
+ACTIONS = ('allow', 'block')
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Interface class names accepted for device_class (USB-IF codes)
+USB_CLASSES = {'audio': 0x01, 'cdc': 0x02, 'hid': 0x03, 'image': 0x06, 'printer': 0x07,
+               'mass_storage': 0x08, 'hub': 0x09, 'video': 0x0e, 'wireless': 0xe0,
+               'vendor_specific': 0xff}
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+
+class PolicyError(ValueError):
+    """Raised for a policy file that cannot be compiled"""
+
+
+# Value parsing shared by rules and devices
+
+def parse_hex(value):
+    return int(str(value).lower().replace('0x', ''), 16)
+
+
+def parse_size(value):
+    """'64GB', '1.5 TB' or a plain byte count"""
+    text = str(value).strip().upper().replace(' ', '')
+    number = text.rstrip('KMGTB')
+    unit = text[len(number):]
+    if unit not in SIZE_UNITS:
+        raise PolicyError(f"Unknown size unit in {value!r}")
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def parse_minute(value):
+    """'HH:MM' as minutes since midnight"""
+    hours, _, minutes = str(value).partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def parse_device_class(value):
+    name = str(value).lower()
+    if name in USB_CLASSES:
+        return USB_CLASSES[name]
+    return parse_hex(name)
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _ranges(value, parse, wraps=False):
+    """Parse 'low-high' / single values into closed integer intervals"""
+    intervals = []
+    for item in _as_list(value):
+        if isinstance(item, (list, tuple)):
+            low, high = item
+        elif '-' in str(item):
+            low, _, high = str(item).partition('-')
+        else:
+            low = high = item
+        low, high = parse(low), parse(high)
+        if low > high:
+            if not wraps:
+                raise PolicyError(f"Empty range {item!r}")
+            # e.g. 22:00-06:00 runs past midnight
+            intervals.append((low, 24 * 60 - 1))
+            intervals.append((0, high))
+        else:
+            intervals.append((low, high))
+    return intervals
+
+
+# Field indexes
+
+class ExactIndex:
+    """value -> bitmask of the rules listing that value"""
+
+    def __init__(self, name, normalize):
+        self.name = name
+        self.normalize = normalize
+        self.masks = {}
+        self.unconstrained = 0
+
+    def add(self, bit, values):
+        if values is None:
+            self.unconstrained |= bit
+            return
+        for value in _as_list(values):
+            key = self.normalize(value)
+            self.masks[key] = self.masks.get(key, 0) | bit
+
+    def finish(self):
+        for key in self.masks:
+            self.masks[key] |= self.unconstrained
+
+    def lookup(self, value):
+        if value is None:
+            return self.unconstrained
+        return self.masks.get(value, self.unconstrained)
+
+
+class IntervalIndex:
+    """
+    Sorted segment boundaries with the bitmask of rules covering each
+    segment, built with one sweep over the interval endpoints
+    """
+
+    def __init__(self, name, parse, wraps=False):
+        self.name = name
+        self.parse = parse
+        self.wraps = wraps
+        self.unconstrained = 0
+        self._intervals = []
+        self.starts = []
+        self.masks = []
+
+    def add(self, bit, value):
+        if value is None:
+            self.unconstrained |= bit
+            return
+        for low, high in _ranges(value, self.parse, self.wraps):
+            self._intervals.append((low, high, bit))
+
+    def finish(self):
+        changes = {}
+        for low, high, bit in self._intervals:
+            changes.setdefault(low, [0, 0])[0] |= bit
+            changes.setdefault(high + 1, [0, 0])[1] |= bit
+
+        # Per-rule open counts let overlapping intervals of one rule nest
+        open_counts = {}
+        mask = 0
+        self.starts = []
+        self.masks = []
+        for point in sorted(changes):
+            starting, ending = changes[point]
+            for bit in _bits(ending):
+                open_counts[bit] -= 1
+                if not open_counts[bit]:
+                    mask &= ~bit
+            for bit in _bits(starting):
+                open_counts[bit] = open_counts.get(bit, 0) + 1
+                mask |= bit
+            self.starts.append(point)
+            self.masks.append(mask | self.unconstrained)
+        self._intervals = []
+
+    def lookup(self, value):
+        if value is None:
+            return self.unconstrained
+        position = bisect.bisect_right(self.starts, value) - 1
+        if position < 0:
+            return self.unconstrained
+        return self.masks[position]
+
+
+def _bits(mask):
+    """Yield the single-bit masks set in mask"""
+    while mask:
+        low = mask & -mask
+        yield low
+        mask ^= low
+
+
+def _normalize_day(value):
+    day = str(value).lower()[:3]
+    if day not in DAYS:
+        raise PolicyError(f"Unknown day {value!r}")
+    return day
+
+
+FIELDS = (
+    # (rule key, device value key, index factory)
+    ('device_id', 'device_id', lambda: ExactIndex('device_id', lambda v: str(v).strip().upper())),
+    ('fstype', 'fstype', lambda: ExactIndex('fstype', lambda v: str(v).lower())),
+    ('device_class', 'device_class', lambda: ExactIndex('device_class', parse_device_class)),
+    ('users', 'user', lambda: ExactIndex('users', str)),
+    ('days', 'day', lambda: ExactIndex('days', _normalize_day)),
+    ('vendor_id', 'vendor_id', lambda: IntervalIndex('vendor_id', parse_hex)),
+    ('product_id', 'product_id', lambda: IntervalIndex('product_id', parse_hex)),
+    ('capacity', 'size', lambda: IntervalIndex('capacity', parse_size)),
+    ('hours', 'minute', lambda: IntervalIndex('hours', parse_minute, wraps=True)),
+)
+RULE_KEYS = {'name', 'action'} | {field[0] for field in FIELDS}
+
+
+def device_values(device_info, descriptors=None, now=None, user=None):
+    """Normalize the fields a policy can test from a device event"""
+    merged = dict(descriptors or {})
+    merged.update({k: v for k, v in device_info.items() if v not in (None, '')})
+    now = now or datetime.now()
+
+    def converted(key, parse):
+        try:
+            return parse(merged[key]) if merged.get(key) not in (None, '') else None
+        except (ValueError, PolicyError):
+            return None
+
+    return {
+        'device_id': str(merged.get('fingerprint') or merged.get('device_id') or '').upper() or None,
+        'fstype': str(merged['fstype']).lower() if merged.get('fstype') else None,
+        'device_class': converted('device_class', parse_device_class),
+        'user': user,
+        'day': DAYS[now.weekday()],
+        'vendor_id': converted('vendor_id', parse_hex),
+        'product_id': converted('product_id', parse_hex),
+        'size': converted('size', int),
+        'minute': now.hour * 60 + now.minute,
+    }
+
+
+class CompiledPolicy:
+    """An immutable, indexed form of a list of rules; first matching rule wins"""
+
+    def __init__(self, rules):
+        self.rules = []
+        self._matchers = None
+        indexes = {key: factory() for key, _, factory in FIELDS}
+        for position, rule in enumerate(rules):
+            if not isinstance(rule, dict):
+                raise PolicyError(f"Rule {position + 1} is not an object")
+            unknown = set(rule) - RULE_KEYS
+            if unknown:
+                raise PolicyError(f"Rule {position + 1}: unknown field(s) {', '.join(sorted(unknown))}")
+            if rule.get('action') not in ACTIONS:
+                raise PolicyError(f"Rule {position + 1}: action must be one of {', '.join(ACTIONS)}")
+            bit = 1 << position
+            try:
+                for key, _, _ in FIELDS:
+                    indexes[key].add(bit, rule.get(key))
+            except (ValueError, TypeError) as e:
+                raise PolicyError(f"Rule {position + 1}: {e}")
+            self.rules.append(rule)
+
+        # Only fields some rule constrains take part in decisions
+        self.all_rules = (1 << len(self.rules)) - 1
+        self.indexes = []
+        for key, value_key, _ in FIELDS:
+            index = indexes[key]
+            index.finish()
+            if index.unconstrained != self.all_rules:
+                self.indexes.append((value_key, index))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, values):
+        """Return the first rule matching the normalized device values, or None"""
+        mask = self.all_rules
+        for value_key, index in self.indexes:
+            mask &= index.lookup(values[value_key])
+            if not mask:
+                return None
+        if not mask:
+            return None
+        return self.rules[(mask & -mask).bit_length() - 1]
+
+    def scan(self, values):
+        """Reference rule-by-rule evaluation (for tests and benchmarks)"""
+        if self._matchers is None:
+            self._matchers = []
+            for rule in self.rules:
+                checks = []
+                for key, value_key, factory in FIELDS:
+                    if rule.get(key) is not None:
+                        index = factory()
+                        index.add(1, rule[key])
+                        index.finish()
+                        checks.append((value_key, index))
+                self._matchers.append(checks)
+
+        for rule, checks in zip(self.rules, self._matchers):
+            if all(values[value_key] is not None and index.lookup(values[value_key])
+                   for value_key, index in checks):
+                return rule
+        return None
+
+
+def load_policy(path=POLICY_FILE):
+    """Read and compile a policy file; a missing file is an empty policy"""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return CompiledPolicy([])
+    except (OSError, ValueError) as e:
+        raise PolicyError(f"Cannot read {path}: {e}")
+    if isinstance(data, list):
+        data = {'rules': data}
+    return CompiledPolicy(data.get('rules', []))
+
+
+class PolicyStore:
+    """
+    The active compiled policy, recompiled on the config watcher thread
+    when the file changes. A file that fails to compile keeps the previous
+    policy.
+    """
+
+    def __init__(self, path=POLICY_FILE, interval=2.0, on_change=None):
+        self.path = path
+        self.interval = interval
+        self.on_change = on_change
+        self.user = _current_user()
+        self._signature = self._stat()
+        try:
+            self.policy = load_policy(path)
+        except PolicyError as e:
+            print(f"Policy not loaded: {e}")
+            self.policy = CompiledPolicy([])
+        self.watcher = ConfigWatcher(os.path.dirname(path) or '.', [os.path.basename(path)],
+                                     lambda name: self.reload_if_changed(), interval)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def start(self):
+        self.watcher.start()
+
+    def stop(self):
+        self.watcher.stop()
+
+    def reload_if_changed(self):
+        """Recompile if the file changed; returns True when a new policy is active"""
+        signature = self._stat()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            policy = load_policy(self.path)
+        except PolicyError as e:
+            print(f"Policy change ignored: {e}")
+            return False
+        # Swapping the reference is atomic; readers see old or new, never half
+        self.policy = policy
+        print(f"Policy reloaded: {len(policy)} rule(s)")
+        if self.on_change:
+            self.on_change()
+        return True
+
+    def decide(self, device_info, descriptors=None, now=None):
+        """Return 'allow', 'block' or None (no rule applies)"""
+        policy = self.policy
+        if not len(policy):
+            return None
+        rule = policy.match(device_values(device_info, descriptors, now, self.user))
+        return rule['action'] if rule else None
+
+
+def is_device_authorized(policy_store, whitelist_store, identity_cache, drive, scanned=(),
+                         blocklist=None):
+    """
+    A serial on the known-bad `blocklist` is refused outright. Explicit policy
+    rules decide next; otherwise the whitelist does, or a clean content scan
+    (`scanned` holds the fingerprints cleared by one)
+    """
+    fingerprint = identity_cache.identify(drive)
+    descriptors = identity_cache.descriptors(fingerprint)
+    if blocklist is not None:
+        serial = drive.get('serial') or (descriptors or {}).get('serial')
+        if serial and serial in blocklist:
+            return False
+    decision = policy_store.decide(dict(drive, fingerprint=fingerprint), descriptors)
+    if decision is not None:
+        return decision == 'allow'
+    return is_device_whitelisted(whitelist_store, identity_cache, drive) or fingerprint in scanned
+
+
+def _current_user():
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):
+        return None
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Append-only security event log for USB Security Software
+Events are written as JSON Lines into fixed-size segment files so that
+each event costs one small append instead of rewriting the whole log
+"""
+
+import os
+import json
+import queue
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from metrics import LOG_WRITES
+
+LOG_DIR = os.path.join('config', 'logs')
+LEGACY_LOG_FILE = os.path.join('config', 'security_log.json')
+
+SEGMENT_PREFIX = 'security-'
+SEGMENT_SUFFIX = '.jsonl'
+INDEX_SUFFIX = '.idx'
+
+# Sidecar index entry: byte offset, timestamp (epoch microseconds),
+# event type hash, device key hash
+INDEX_ENTRY = struct.Struct('<QqII')
+
+
+def key_hash(value):
+    """Return the 32-bit hash used for event and device index keys"""
+    return zlib.crc32(str(value).encode('utf-8'))
+
+
+def device_key(device_info):
+    """Return the value a device is filtered by in log queries"""
+    if not isinstance(device_info, dict):
+        return ''
+    for field in ('id', 'device_id', 'drive_letter', 'device'):
+        if device_info.get(field):
+            return str(device_info[field])
+    return ''
+
+
+def timestamp_us(value):
+    """Convert an ISO timestamp to epoch microseconds (0 if unparseable)"""
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def list_segments(log_dir):
+    """Return the segment numbers in a log directory, oldest first"""
+    numbers = []
+    for name in os.listdir(log_dir):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            try:
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                continue
+    return sorted(numbers)
+
+
+def read_segment(path):
+    """Return the decoded records of one segment file, skipping torn lines"""
+    records = []
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Partial line left by a crash mid-write
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def read_log_dir(log_dir):
+    """
+    Yield the events of a log directory, oldest first, without opening it
+    for writing (no writer thread, tail repair or retention)
+    """
+    for number in list_segments(log_dir):
+        path = os.path.join(log_dir, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+        for record in read_segment(path):
+            yield record
+
+
+def index_entry(offset, record):
+    """Build the packed index entry for a record stored at `offset`"""
+    return INDEX_ENTRY.pack(offset,
+                            timestamp_us(record.get('timestamp')),
+                            key_hash(record.get('event', '')),
+                            key_hash(device_key(record.get('device'))))
+
+
+class SecurityLog:
+    """
+    Segmented JSON Lines event log with group commit and retention.
+    append() only queues the record; a writer thread writes whatever has
+    queued up as one group and fsyncs once per group, so callers (device
+    threads, the GUI thread) never wait on disk I/O.
+    """
+
+    def __init__(self, log_dir=LOG_DIR, segment_size=1024 * 1024,
+                 retention_days=180, max_total_bytes=512 * 1024 * 1024,
+                 fsync_batch=256, max_queue=10000, maintenance_interval=3600):
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        self.retention_days = retention_days
+        self.max_total_bytes = max_total_bytes
+        self.fsync_batch = fsync_batch
+        self.maintenance_interval = maintenance_interval
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_queue)
+        self._closed = False
+        self._pending = 0
+        self._active_file = None
+        self._index_file = None
+        self._active_number = 0
+        self._active_size = 0
+        # Called on the writer thread after each group is on disk
+        self.write_listeners = []
+        # Called by clear() (with writes held off) before anything is deleted
+        self.clear_hooks = []
+        # Incremented by every clear()
+        self.generation = 0
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        segments = self.list_segments()
+        self._open_segment(segments[-1] if segments else 1)
+
+        self._thread = threading.Thread(target=self._writer_loop, name="security-log-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def active_segment(self):
+        """Number of the segment currently being appended to"""
+        return self._active_number
+
+    # Segment handling
+
+    def segment_path(self, number):
+        """Return the file path of a segment number"""
+        return os.path.join(self.log_dir, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+    def index_path(self, number):
+        """Return the sidecar index path of a segment number"""
+        return os.path.join(self.log_dir, f"{SEGMENT_PREFIX}{number:06d}{INDEX_SUFFIX}")
+
+    def list_segments(self):
+        """Return the existing segment numbers, oldest first"""
+        return list_segments(self.log_dir)
+
+    def _open_segment(self, number):
+        path = self.segment_path(number)
+        self._repair_tail(path)
+        self._active_file = open(path, 'ab')
+        self._active_number = number
+        self._active_size = self._active_file.tell()
+        self.ensure_index(number)
+        self._index_file = open(self.index_path(number), 'ab')
+
+    def _repair_tail(self, path):
+        """Cut off a partial last line left by a crash so appends stay aligned"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+
+            position = size
+            while position > 0:
+                step = min(4096, position)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step)
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    f.truncate(position + newline + 1)
+                    return
+            f.truncate(0)
+
+    def ensure_index(self, number):
+        """Build or repair the sidecar index so it matches its segment"""
+        segment = self.segment_path(number)
+        index = self.index_path(number)
+        try:
+            segment_size = os.path.getsize(segment)
+        except OSError:
+            return
+
+        if os.path.exists(index):
+            index_size = os.path.getsize(index)
+            usable = index_size - index_size % INDEX_ENTRY.size
+            if usable == 0 and segment_size == 0:
+                return
+            if usable:
+                with open(index, 'rb') as f:
+                    f.seek(usable - INDEX_ENTRY.size)
+                    last_offset = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))[0]
+                with open(segment, 'rb') as f:
+                    f.seek(last_offset)
+                    line = f.readline()
+                if line.endswith(b'\n') and last_offset + len(line) == segment_size:
+                    if usable != index_size:
+                        with open(index, 'rb+') as f:
+                            f.truncate(usable)
+                    return
+
+        # Missing or stale: rebuild from the segment itself
+        entries = []
+        with open(segment, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    entries.append(index_entry(offset, json.loads(line)))
+                except ValueError:
+                    pass
+                offset += len(line)
+        temp_path = index + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(b''.join(entries))
+        os.replace(temp_path, index)
+
+    def _roll_segment(self):
+        self._sync_locked()
+        self._active_file.close()
+        self._index_file.close()
+        self._open_segment(self._active_number + 1)
+
+    def _sync_locked(self):
+        if self._pending and self._active_file:
+            self._active_file.flush()
+            os.fsync(self._active_file.fileno())
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+            self._pending = 0
+
+    # Writing
+
+    def append(self, event_type, device_info):
+        """Append an event to the log"""
+        record = {
+            'timestamp': datetime.now().isoformat(),
+            'event': event_type,
+            'device': device_info
+        }
+        self.append_record(record)
+        return record
+
+    def append_record(self, record):
+        """Queue an already-built log record for the writer thread"""
+        if self._closed:
+            raise ValueError("Security log is closed")
+        line = (json.dumps(record, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+        # Blocks only if the writer has fallen max_queue records behind
+        self._queue.put((line, record))
+
+    def _write_locked(self, line, record):
+        if self._active_size and self._active_size + len(line) > self.segment_size:
+            self._roll_segment()
+        self._active_file.write(line)
+        self._index_file.write(index_entry(self._active_size, record))
+        self._active_size += len(line)
+        self._pending += 1
+
+    def _write_group(self, first):
+        """Write `first` plus whatever else is queued, then fsync once"""
+        group = [first]
+        while len(group) < self.fsync_batch:
+            try:
+                group.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            with self._lock:
+                for item in group:
+                    if item is not None:
+                        self._write_locked(*item)
+                self._sync_locked()
+            LOG_WRITES.inc(sum(1 for item in group if item is not None))
+            for listener in self.write_listeners:
+                listener()
+        except Exception as e:
+            print(f"Security log write error: {e}")
+        finally:
+            for _ in group:
+                self._queue.task_done()
+        return any(item is None for item in group)
+
+    def flush(self):
+        """Wait until every queued event has been written and fsynced"""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def import_legacy(self, legacy_file=LEGACY_LOG_FILE):
+        """Move entries from the old single-array JSON log into the segments"""
+        if not os.path.exists(legacy_file):
+            return 0
+
+        try:
+            with open(legacy_file, 'r') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if not isinstance(records, list):
+            print(f"Legacy log {legacy_file} not imported: expected a JSON list of events")
+            return 0
+
+        records = [record for record in records if isinstance(record, dict)]
+        for record in records:
+            self.append_record(record)
+        self.flush()
+        os.remove(legacy_file)
+        return len(records)
+
+    # Reading
+
+    def _read_segment(self, number):
+        """Return the decoded records of one segment, skipping torn lines"""
+        return read_segment(self.segment_path(number))
+
+    def sync_readers(self):
+        """Make queued appends visible to readers of the segment files"""
+        self.flush()
+
+    def iter_events(self):
+        """Yield all events, oldest first"""
+        self.sync_readers()
+        for number in self.list_segments():
+            for record in self._read_segment(number):
+                yield record
+
+    def read_recent(self, limit=50):
+        """Return up to `limit` most recent events, newest first"""
+        self.sync_readers()
+
+        events = []
+        for number in reversed(self.list_segments()):
+            records = self._read_segment(number)
+            events.extend(reversed(records[-(limit - len(events)):]))
+            if len(events) >= limit:
+                break
+        return events
+
+    # Maintenance
+
+    def compact(self):
+        """Drop sealed segments past the retention age or size budget"""
+        cutoff = time.time() - self.retention_days * 86400
+
+        with self._lock:
+            active = self._active_number
+        sealed = [n for n in self.list_segments() if n != active]
+
+        sizes = {}
+        for number in sealed:
+            try:
+                sizes[number] = os.path.getsize(self.segment_path(number))
+            except OSError:
+                sizes[number] = 0
+        total = sum(sizes.values())
+
+        removed = 0
+        for number in sealed:
+            path = self.segment_path(number)
+            try:
+                expired = os.path.getmtime(path) < cutoff
+            except OSError:
+                continue
+            if expired or total > self.max_total_bytes:
+                try:
+                    os.remove(path)
+                    total -= sizes[number]
+                    removed += 1
+                except OSError:
+                    continue
+                try:
+                    os.remove(self.index_path(number))
+                except OSError:
+                    pass
+        return removed
+
+    def _writer_loop(self):
+        next_maintenance = time.monotonic()
+        while True:
+            timeout = max(0.0, next_maintenance - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            try:
+                if item is not False and self._write_group(item):
+                    return
+                if time.monotonic() >= next_maintenance:
+                    self.compact()
+                    next_maintenance = time.monotonic() + self.maintenance_interval
+            except Exception as e:
+                print(f"Security log writer error: {e}")
+
+    def clear(self):
+        """Delete all log segments and start a fresh one"""
+        self.flush()
+        with self._lock:
+            for hook in self.clear_hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"Error before clearing the security log: {e}")
+            if self._active_file:
+                self._active_file.close()
+                self._index_file.close()
+            for number in self.list_segments():
+                for path in (self.segment_path(number), self.index_path(number)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            self._pending = 0
+            self._open_segment(1)
+            self.generation += 1
+
+    def close(self):
+        """Write out queued events and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        # The sentinel is written after everything queued before it
+        self._queue.put(None)
+        self._thread.join()
+        with self._lock:
+            if self._active_file:
+                self._sync_locked()
+                self._active_file.close()
+                self._index_file.close()
+                self._active_file = None
+                self._index_file = None
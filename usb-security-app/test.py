@@ -8,6 +8,7 @@ import sys
 import os
 import json
 import time
+import threading
 from datetime import datetime
 
 def test_imports():
@@ -185,6 +186,1577 @@ def test_logging():
         print(f"✗ Logging test failed: {e}")
         return False
 
+def test_security_log():
+    """Test append-only segmented security log"""
+    print("\nTesting Security Log...")
+    
+    try:
+        import shutil
+        from security_log import SecurityLog
+        
+        log_dir = os.path.join('config', 'test_logs')
+        shutil.rmtree(log_dir, ignore_errors=True)
+        
+        # Small segments so the test exercises rolling
+        log = SecurityLog(log_dir=log_dir, segment_size=512)
+        for i in range(20):
+            log.append("TEST_EVENT", {'drive_letter': f'{i}:'})
+        log.flush()
+        print("✓ Events appended")
+        
+        if len(log.list_segments()) > 1:
+            print("✓ Log rolled into multiple segments")
+        else:
+            print("✗ Log segment rolling failed")
+            return False
+        
+        recent = log.read_recent(5)
+        if [e['device']['drive_letter'] for e in recent] == ['19:', '18:', '17:', '16:', '15:']:
+            print("✓ Recent entries read newest first")
+        else:
+            print("✗ Recent entry read failed")
+            return False
+        
+        # Simulate a crash that left half a line behind
+        with open(log.segment_path(log.list_segments()[-1]), 'ab') as f:
+            f.write(b'{"timestamp": "torn')
+        if len(list(log.iter_events())) == 20:
+            print("✓ Torn trailing line skipped")
+        else:
+            print("✗ Torn line handling failed")
+            return False
+        
+        # A legacy file that is not a list of events is reported and left alone
+        legacy_file = os.path.join(log_dir, 'legacy_security_log.json')
+        with open(legacy_file, 'w') as f:
+            json.dump({'events': [{'event': 'OLD'}]}, f)
+        if log.import_legacy(legacy_file) == 0 and os.path.exists(legacy_file) \
+                and len(list(log.iter_events())) == 20:
+            print("✓ Malformed legacy log skipped")
+        else:
+            print("✗ Malformed legacy log imported")
+            return False
+        
+        log.close()
+        shutil.rmtree(log_dir, ignore_errors=True)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Security log test failed: {e}")
+        return False
+
+def test_log_query():
+    """Test indexed, paged log queries"""
+    print("\nTesting Log Query...")
+    
+    try:
+        import shutil
+        from security_log import SecurityLog
+        from log_query import LogQuery
+        
+        log_dir = os.path.join('config', 'test_query_logs')
+        shutil.rmtree(log_dir, ignore_errors=True)
+        
+        log = SecurityLog(log_dir=log_dir, segment_size=2048)
+        for i in range(100):
+            event = "DEVICE_CONNECTED" if i % 2 == 0 else "DEVICE_REMOVED"
+            log.append(event, {'drive_letter': f'D{i % 5}:'})
+        query = LogQuery(log)
+        
+        if query.count() == 100:
+            print("✓ Index covers all events")
+        else:
+            print("✗ Index count mismatch")
+            return False
+        
+        # Page through connect events for one device
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = query.query(limit=3, cursor=cursor, event="DEVICE_CONNECTED", device="D0:")
+            seen.extend(page)
+            if cursor is None:
+                break
+        if len(seen) == 10 and all(e['event'] == "DEVICE_CONNECTED" for e in seen):
+            print("✓ Filtered cursor paging working")
+        else:
+            print("✗ Filtered cursor paging failed")
+            return False
+        
+        # A missing sidecar index is rebuilt on demand
+        os.remove(log.index_path(log.list_segments()[0]))
+        if query.count() < 100 and len(query.query(limit=1000)[0]) == 100:
+            print("✓ Missing index rebuilt")
+        else:
+            print("✗ Index rebuild failed")
+            return False
+        
+        log.close()
+        shutil.rmtree(log_dir, ignore_errors=True)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Log query test failed: {e}")
+        return False
+
+def test_whitelist_store():
+    """Test indexed whitelist matching"""
+    print("\nTesting Whitelist Store...")
+    
+    try:
+        from whitelist_store import WhitelistStore
+        
+        store = WhitelistStore([{'id': 'E:_NTFS', 'name': 'Drive E:'}])
+        store.add('USBSTOR\\DISK&VEN_CORP*', 'Corporate')
+        store.add('*_EXFAT?', 'Glob rule')
+        store.add(vendor_id='0x0781', product_id='5581', device_name='SanDisk Ultra')
+        
+        checks = [
+            (store.is_whitelisted('e:_ntfs'), True),
+            (store.is_whitelisted('F:_NTFS'), False),
+            (store.is_whitelisted('USBSTOR\\DISK&VEN_CORP&PROD_1'), True),
+            (store.is_whitelisted('G:_EXFAT1'), True),
+            (store.is_whitelisted('X', vendor_id='781', product_id='0x5581'), True),
+            (store.is_whitelisted('X', vendor_id='781', product_id='1234'), False),
+        ]
+        if all(result == expected for result, expected in checks):
+            print("✓ Exact, prefix, glob and vendor/product matching working")
+        else:
+            print("✗ Whitelist matching failed")
+            return False
+        
+        store.remove('E:_NTFS')
+        exported = store.export_entries()
+        if not store.is_whitelisted('E:_NTFS') and len(WhitelistStore(exported)) == 3:
+            print("✓ Remove and bulk export/import working")
+        else:
+            print("✗ Remove or export failed")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Whitelist store test failed: {e}")
+        return False
+
+def test_device_table():
+    """Test incremental connected-device tracking"""
+    print("\nTesting Device Table...")
+    
+    try:
+        from device_state import DeviceTable
+        
+        trusted = {'E:'}
+        table = DeviceTable(lambda info: info.get('drive_letter') in trusted)
+        table.device_connected({'drive_letter': 'E:'})
+        table.device_connected({'drive_letter': 'F:'})
+        table.device_connected({'drive_letter': 'G:'})
+        
+        if table.unauthorized_count() == 2:
+            print("✓ Unauthorized devices counted on connect")
+        else:
+            print("✗ Connect counting failed")
+            return False
+        
+        table.device_removed({'drive_letter': 'F:'})
+        table.device_removed({'drive_letter': 'F:'})  # duplicate removal
+        if table.unauthorized_count() == 1 and len(table) == 2:
+            print("✓ Removal updates count")
+        else:
+            print("✗ Removal counting failed")
+            return False
+        
+        # A scan that disagrees with the table corrects it
+        removed = []
+        table.on_removed = removed.append
+        drift = table.reconcile([{'device': 'E:\\', 'serial': 'A1'}, {'device': 'H:\\'}])
+        if drift == 2 and table.unauthorized_count() == 1 and removed == [{'drive_letter': 'G:'}]:
+            print("✓ Reconciliation corrects drift")
+        else:
+            print("✗ Reconciliation failed")
+            return False
+        
+        # A different stick on a reused drive letter is checked again, not inherited
+        drift = table.reconcile([{'device': 'E:\\', 'serial': 'B2'}, {'device': 'H:\\'}])
+        if drift == 1 and table.unauthorized_count() == 2 and removed[-1]['serial'] == 'A1':
+            print("✓ Replaced device re-checked on reconcile")
+        else:
+            print("✗ Replaced device kept the old authorization")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Device table test failed: {e}")
+        return False
+
+def test_device_sources():
+    """Test device event sources with the replay source"""
+    print("\nTesting Device Sources...")
+    
+    try:
+        from device_sources import ReplaySource, NetlinkUeventSource
+        
+        received = []
+        events = ReplaySource.synthetic_storm(10, devices=2)
+        source = ReplaySource(events, callback=lambda e, d: received.append((e, d['device'])))
+        source.start()
+        if not source.wait(5):
+            print("✗ Replay source did not finish")
+            return False
+        
+        if len(received) == 10 and received[0] == ('device_connected', '/dev/sdb1') \
+                and received[2] == ('device_removed', '/dev/sdb1'):
+            print("✓ Replay source delivered events in order")
+        else:
+            print("✗ Replay source event order wrong")
+            return False
+        
+        # Four 0.2 s gaps at speed 4 take about 0.2 s, not 3.2 s
+        fast = ReplaySource(ReplaySource.synthetic_storm(4, delay=0.2), speed=4)
+        start = time.monotonic()
+        fast.start()
+        if not fast.wait(5) or time.monotonic() - start > 1.0:
+            print(f"✗ speed=4 replayed in {time.monotonic() - start:.1f}s")
+            return False
+        print("✓ Replay speed scales the delays")
+        
+        fields = NetlinkUeventSource.parse_uevent(
+            b'add@/block/sdb/sdb1\0ACTION=add\0SUBSYSTEM=block\0DEVNAME=sdb1\0DEVTYPE=partition\0')
+        if fields.get('ACTION') == 'add' and fields.get('DEVNAME') == 'sdb1':
+            print("✓ Uevent parsing working")
+        else:
+            print("✗ Uevent parsing failed")
+            return False
+        
+        # A full scan merges into what uevents reported instead of replacing it
+        import shutil
+        import tempfile
+        from device_sources import resolve_mountpoint
+        with tempfile.TemporaryDirectory() as sys_block:
+            for disk in ('sdq', 'sdr'):
+                os.makedirs(os.path.join(sys_block, disk, f"{disk}1"))
+                for path, value in (((disk, 'removable'), '1'), ((disk, 'size'), '2048'),
+                                    ((disk, f"{disk}1", 'partition'), '1')):
+                    with open(os.path.join(sys_block, *path), 'w') as f:
+                        f.write(value)
+            emitted = []
+            netlink = NetlinkUeventSource(lambda event, info: emitted.append(info), sys_block)
+            netlink.handle_uevent({'ACTION': 'add', 'SUBSYSTEM': 'block', 'DEVNAME': 'sdq1',
+                                   'DEVTYPE': 'partition', 'DEVPATH': '/block/sdq/sdq1'})
+            both = len(netlink.get_connected_removable_drives())
+            shutil.rmtree(os.path.join(sys_block, 'sdr'))
+            drives = netlink.get_connected_removable_drives()
+            mounted = resolve_mountpoint({'device': '/dev/sdq1', 'mountpoint': ''},
+                                         {'/dev/sdq1': ('/media/stick', 'vfat')})
+            if (both == 2 and [d['device'] for d in drives] == ['/dev/sdq1']
+                    and drives[0] is emitted[0] and mounted == '/media/stick'):
+                print("✓ Netlink scan merged and mountpoint resolved")
+            else:
+                print(f"✗ Netlink scan gave {[d['device'] for d in drives]}, mountpoint {mounted!r}")
+                return False
+        
+        # Polling backs off while idle and only rescans when the fingerprint moves
+        from device_sources import MountPollSource, POLL_RATE, POLL_SCANS
+        scans_before = POLL_SCANS.value()
+        fingerprint = [1]
+        poller = MountPollSource(fingerprint=lambda: fingerprint[0], sys_block='/nonexistent')
+        poller._last_fingerprint = 1
+        for _ in range(10):
+            poller.scheduler.record(poller.poll())
+        idle_interval = poller.scheduler.interval
+        fingerprint[0] = 2
+        poller.poll()
+        if (idle_interval == poller.scheduler.max_interval and poller.stats()['full_scans'] == 1
+                and POLL_SCANS.value() == scans_before + 1 and POLL_RATE.samples()[0][2] > 0):
+            print("✓ Adaptive polling with fingerprint gating working")
+        else:
+            print("✗ Adaptive polling failed")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Device sources test failed: {e}")
+        return False
+
+def test_event_coalescer():
+    """Test debouncing and merging of device event bursts"""
+    print("\nTesting Event Coalescer...")
+    
+    try:
+        from event_coalescer import EventCoalescer
+        
+        batches = []
+        delivered = threading.Event()
+        
+        def deliver(batch):
+            batches.append(batch)
+            delivered.set()
+        
+        coalescer = EventCoalescer(deliver, window=0.05)
+        # Two partitions of one stick, plus a flaky stick that vanishes
+        coalescer.submit('device_connected', {'device': '/dev/sdb1'})
+        coalescer.submit('device_connected', {'device': '/dev/sdb2'})
+        coalescer.submit('device_connected', {'device': '/dev/sdc1'})
+        coalescer.submit('device_removed', {'device': '/dev/sdc1'})
+        
+        if not delivered.wait(2):
+            print("✗ No batch delivered")
+            return False
+        coalescer.stop()
+        
+        events = [event for batch in batches for event in batch]
+        if len(events) == 1 and len(events[0][1].get('partitions', [])) == 2:
+            print("✓ Partitions merged and connect+remove cancelled")
+        else:
+            print(f"✗ Unexpected coalesced events: {events}")
+            return False
+        
+        # Each partition resolves on its own before the device's partitions merge
+        batches.clear()
+        coalescer = EventCoalescer(deliver, window=0.05)
+        coalescer.submit('device_connected', {'device': '/dev/sdd1'})
+        coalescer.submit('device_removed', {'device': '/dev/sdd1'})
+        coalescer.submit('device_connected', {'device': '/dev/sdd2'})
+        coalescer.submit('device_removed', {'device': '/dev/sde1'})
+        coalescer.submit('device_connected', {'device': '/dev/sde2'})
+        coalescer.stop()
+        events = sorted((event, info['device'], 'partitions' in info)
+                        for batch in batches for event, info in batch)
+        if events == [('device_connected', '/dev/sdd2', False), ('device_connected', '/dev/sde2', False),
+                      ('device_removed', '/dev/sde1', False)]:
+            print("✓ Vanished partitions dropped from the merged device event")
+        else:
+            print(f"✗ Unexpected per-partition resolution: {events}")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Event coalescer test failed: {e}")
+        return False
+
+def test_device_identity():
+    """Test device fingerprinting and the persistent fingerprint cache"""
+    print("\nTesting Device Identity...")
+    
+    try:
+        from device_identity import DeviceIdentityCache
+        
+        cache_file = os.path.join('config', 'test_fingerprints.json')
+        probes = []
+        stick = {'vendor_id': '0781', 'product_id': '5581', 'serial': 'ABC123'}
+        
+        def fake_probe(node):
+            probes.append(node)
+            return dict(stick)
+        
+        def fake_uuid(node):
+            return '1234-ABCD'
+        
+        drive = {'device': '/dev/sdb1', 'fstype': 'vfat'}
+        cache = DeviceIdentityCache(cache_file, probe=fake_probe, uuid_lookup=fake_uuid)
+        fingerprint = cache.identify(drive)
+        cache.identify(drive)
+        if fingerprint.startswith('fp-') and len(probes) == 1:
+            print("✓ Fingerprint derived once and cached per node")
+        else:
+            print("✗ Fingerprint caching failed")
+            return False
+        
+        # Re-inserted on a different node, in a new process
+        cache.forget(drive)
+        cache = DeviceIdentityCache(cache_file, probe=fake_probe, uuid_lookup=fake_uuid)
+        if cache.identify({'device': '/dev/sdc1'}) == fingerprint and cache.hits == 1:
+            print("✓ Known device recognized from its remembered descriptors")
+        else:
+            print("✗ Persistent fingerprint lookup failed")
+            return False
+        
+        # Another stick in the same node, e.g. swapped inside the debounce window
+        stick['serial'] = 'XYZ789'
+        if cache.identify({'device': '/dev/sdc1'}, fresh=True) == fingerprint:
+            print("✗ Node cache reused across a device swap")
+            return False
+        # Same (copied) volume UUID on a different stick
+        cache.forget({'device': '/dev/sdc1'})
+        if cache.identify({'device': '/dev/sdd1'}) == fingerprint:
+            print("✗ Copied volume UUID inherited a known fingerprint")
+            return False
+        stick['serial'] = 'ABC123'
+        if cache.identify({'device': '/dev/sde1'}) != fingerprint:
+            print("✗ Original stick no longer recognized")
+            return False
+        print("✓ Swapped sticks and copied volume UUIDs get their own fingerprint")
+        
+        os.remove(cache_file)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Device identity test failed: {e}")
+        return False
+
+def test_background_writer():
+    """Test asynchronous atomic config writes"""
+    print("\nTesting Background Writer...")
+    
+    try:
+        from background_writer import BackgroundWriter
+        
+        path = os.path.join('config', 'test_writer.json')
+        writer = BackgroundWriter()
+        for i in range(50):
+            writer.write_json(path, {'version': i})
+        writer.close()
+        
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data == {'version': 49} and not os.path.exists(path + '.tmp'):
+            print("✓ Latest content written atomically")
+        else:
+            print("✗ Background write failed")
+            return False
+        
+        if writer.writes + writer.coalesced == 50:
+            print(f"✓ {writer.coalesced} redundant writes coalesced")
+        else:
+            print("✗ Write accounting mismatch")
+            return False
+        
+        os.remove(path)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Background writer test failed: {e}")
+        return False
+
+def test_overlay_rendering():
+    """Test the pre-rendered overlay (without showing it)"""
+    print("\nTesting Overlay Rendering...")
+    
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from overlay_rendering import RenderedOverlay, FrameCache, OverlayManager
+        
+        app = QApplication.instance()
+        if app is None:
+            app = QApplication(sys.argv)
+        
+        cache = FrameCache()
+        first = cache.frame(1920, 1080, True)
+        if cache.frame(1920, 1080, True) is first and cache.frame(1920, 1080, False) is not first:
+            print("✓ Frames rendered once per size and blink state")
+        else:
+            print("✗ Frame caching failed")
+            return False
+        
+        overlay = RenderedOverlay(duration_minutes=1, frame_cache=cache)
+        if overlay.duration_minutes == 1 and overlay.countdown_text().endswith("01:00"):
+            print("✓ Countdown working")
+        else:
+            print("✗ Countdown failed")
+            return False
+        
+        overlay.close()
+        
+        manager = OverlayManager(duration_minutes=1, frame_cache=cache)
+        closed = []
+        manager.overlay_closed.connect(lambda: closed.append(True))
+        manager.show()
+        screens = app.screens()
+        if len(manager.overlays) == len(screens) and manager.tick_timer.isActive():
+            print(f"✓ One overlay per screen ({len(screens)} screen(s)), one shared timer")
+        else:
+            print("✗ Overlay manager screen coverage failed")
+            return False
+        
+        manager.remove_screen(screens[0])
+        if closed or screens[0] in manager.overlays:
+            print("✗ Screen removal ended the lockout")
+            return False
+        manager.add_screen(screens[0])
+        manager.close()
+        if closed == [True] and not manager.isVisible() and not manager.tick_timer.isActive():
+            print("✓ Screen hotplug and close working")
+        else:
+            print("✗ Overlay manager close failed")
+            return False
+        
+        windows = set(map(id, manager.overlays.values()))
+        manager.rearm(duration_minutes=2)
+        manager.show()
+        reused = set(map(id, manager.overlays.values())) == windows
+        remaining = [o.remaining_seconds() for o in manager.overlays.values()]
+        manager.dispose()
+        if reused and remaining and min(remaining) > 60 and closed == [True, True] \
+                and not manager.overlays:
+            print("✓ Windows re-armed for the next lockout and disposed on teardown")
+        else:
+            print("✗ Overlay pooling failed")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Overlay rendering test failed: {e}")
+        return False
+
+def test_daemon():
+    """Test the headless daemon and its socket API"""
+    print("\nTesting Daemon...")
+    
+    try:
+        import shutil
+        import socket
+        if not hasattr(socket, 'AF_UNIX'):
+            print("✓ Skipped (no Unix-domain sockets)")
+            return True
+        from usb_daemon import SecurityDaemon
+        from daemon_client import DaemonClient, DaemonEventSource
+        
+        settings_path = os.path.join('config', 'test_daemon_settings.json')
+        replay_path = os.path.join('config', 'test_daemon_replay.json')
+        log_dir = os.path.join('config', 'test_daemon_logs')
+        socket_path = os.path.join('config', 'test_daemon.sock')
+        metrics_path = os.path.join('config', 'test_daemon_metrics.prom')
+        with open(settings_path, 'w') as f:
+            json.dump({'whitelist': [{'id': '/dev/sdy1_vfat', 'name': 'Trusted'}],
+                       'debounce_window_ms': 20}, f)
+        with open(replay_path, 'w') as f:
+            json.dump([{'delay': 0.3, 'event': 'device_connected',
+                        'device': {'device': '/dev/sdy1', 'fstype': 'vfat'}},
+                       {'delay': 0.05, 'event': 'device_connected',
+                        'device': {'device': '/dev/sdz1', 'fstype': 'vfat'}}], f)
+        
+        daemon = SecurityDaemon(socket_path, f'replay:{replay_path}', settings_path, log_dir,
+                                metrics_path=metrics_path)
+        daemon.start()
+        server = threading.Thread(target=daemon.serve_forever, daemon=True)
+        server.start()
+        
+        received = []
+        source = DaemonEventSource(lambda event, device: received.append(device), socket_path)
+        source.start()
+        client = DaemonClient(socket_path)
+        
+        deadline = time.time() + 3
+        while len(received) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        verdicts = {d['device']: d.get('authorized') for d in received}
+        if verdicts == {'/dev/sdy1': True, '/dev/sdz1': False}:
+            print("✓ Events relayed with the daemon's verdicts")
+        else:
+            print(f"✗ Unexpected relayed events: {received}")
+            return False
+        
+        status = client.call('status')
+        if status['unauthorized'] == 1 and status['locked'] and status['subscribers'] == 1:
+            print("✓ Status reports the lockout")
+        else:
+            print(f"✗ Unexpected status: {status}")
+            return False
+        
+        client.call('whitelist_add', id='/dev/sdz1_vfat', name='Now trusted')
+        daemon.security_log.flush()
+        records = client.call('query_log', limit=10)['records']
+        if not client.call('status')['locked'] and len(records) == 2:
+            print("✓ Whitelist change and log query over the socket")
+        else:
+            print("✗ Whitelist/log requests failed")
+            return False
+        
+        from types import SimpleNamespace
+        request = json.dumps({'id': 1, 'method': 'whitelist_remove', 'params': {'key': '/dev/sdz1_vfat'}})
+        reply, _ = daemon.handle_request(SimpleNamespace(uid=None), request)
+        if 'Not permitted' in reply.get('error', '') and not client.call('status')['locked']:
+            print("✓ Peer without credentials refused whitelist changes")
+        else:
+            print(f"✗ Unknown peer allowed a privileged request: {reply}")
+            return False
+        
+        # Another local user may follow events but not read the log or device list
+        other = os.getuid() + 1 if os.getuid() else 65534
+        replies = [daemon.handle_request(SimpleNamespace(uid=other), json.dumps({'id': 1, 'method': method}))[0]
+                   for method in ('query_log', 'devices', 'whitelist', 'status')]
+        if all('Not permitted' in r.get('error', '') for r in replies[:3]) and 'result' in replies[3]:
+            print("✓ Other users refused log, device and whitelist reads")
+        else:
+            print(f"✗ Another user could read daemon state: {replies}")
+            return False
+        
+        metrics_text = client.call('metrics')
+        if all('detected' in d.get('trace', {}) for d in received) and \
+                'usb_security_detection_latency_seconds_count' in metrics_text:
+            print("✓ Detection traces relayed and metrics served")
+        else:
+            print("✗ Missing traces or metrics")
+            return False
+        
+        client.close()
+        source.stop()
+        daemon.stop()
+        server.join(2)
+        daemon.shutdown()
+        for path in (settings_path, replay_path, metrics_path):
+            os.remove(path)
+        shutil.rmtree(log_dir)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Daemon test failed: {e}")
+        return False
+
+def test_instance_lock():
+    """Test the single-instance lock and argument forwarding"""
+    print("\nTesting Instance Lock...")
+    
+    try:
+        from instance_lock import InstanceLock, forward_to_running_instance, LOCK_FILE, ADDRESS_FILE
+        
+        # Launches from different working directories must find the same lock
+        if not (os.path.isabs(LOCK_FILE) and os.path.isabs(ADDRESS_FILE)):
+            print(f"✗ Lock path depends on the working directory: {LOCK_FILE}")
+            return False
+        
+        name = f"usb-security-test-{os.getpid()}"
+        address_file = os.path.join('config', 'test_instance.address')
+        lock_file = os.path.join('config', 'test_instance.lock')
+        first = InstanceLock(name, lock_file, address_file)
+        second = InstanceLock(name, lock_file, address_file)
+        if first.acquire() and not second.acquire():
+            print("✓ Only one instance holds the lock")
+        else:
+            print("✗ Instance lock not exclusive")
+            return False
+        
+        received = []
+        first.serve(received.append)
+        start = time.perf_counter()
+        forwarded = forward_to_running_instance(['show', 'logs'], name, address_file)
+        elapsed = (time.perf_counter() - start) * 1000
+        if forwarded and received == [['show', 'logs']]:
+            print(f"✓ Arguments forwarded in {elapsed:.1f} ms")
+        else:
+            print("✗ Argument forwarding failed")
+            return False
+        
+        first.release()
+        if not forward_to_running_instance([], name, address_file) and second.acquire():
+            print("✓ Lock released and re-acquired")
+        else:
+            print("✗ Lock release failed")
+            return False
+        second.release()
+        
+        from instance_lock import uses_abstract_socket, abstract_address
+        if uses_abstract_socket() and os.getuid() == 0:
+            # Another user grabs our abstract name before we start
+            import socket
+            address = abstract_address(name)
+            ready, release = os.pipe(), os.pipe()
+            squatter = os.fork()
+            if squatter == 0:
+                os.setuid(65534)
+                sock = socket.socket(socket.AF_UNIX)
+                sock.bind(address)
+                sock.listen(1)
+                os.write(ready[1], b'1')
+                os.read(release[0], 1)
+                os._exit(0)
+            try:
+                os.read(ready[0], 1)
+                third = InstanceLock(name, lock_file, address_file)
+                received.clear()
+                if third.acquire():
+                    third.serve(received.append)
+                    forwarded = forward_to_running_instance(['show'], name, address_file)
+                    third.release()
+                else:
+                    forwarded = False
+            finally:
+                os.write(release[1], b'1')
+                os.waitpid(squatter, 0)
+                for fd in ready + release:
+                    os.close(fd)
+            if forwarded and received == [['show']]:
+                print("✓ Squatted name falls back to the lock file")
+            else:
+                print("✗ Squatted name blocked the instance lock")
+                return False
+        
+        for path in (lock_file, address_file):
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Instance lock test failed: {e}")
+        return False
+
+def test_policy_engine():
+    """Test policy compilation, decisions and reload"""
+    print("\nTesting Policy Engine...")
+    
+    try:
+        import random
+        from policy_engine import CompiledPolicy, PolicyStore, device_values
+        
+        rules = [
+            {'name': 'No exFAT', 'action': 'block', 'fstype': 'exfat'},
+            {'name': 'SanDisk', 'action': 'allow', 'vendor_id': '0781', 'product_id': '5500-55ff'},
+            {'name': 'Small sticks in office hours', 'action': 'allow',
+             'capacity': '0-64GB', 'hours': '08:00-18:00', 'days': ['mon', 'tue', 'wed', 'thu', 'fri']},
+        ]
+        policy = CompiledPolicy(rules)
+        monday_noon = datetime(2024, 1, 1, 12, 0)
+        sunday_noon = datetime(2024, 1, 7, 12, 0)
+        cases = [
+            ({'fstype': 'exFAT', 'vendor_id': '0781', 'product_id': '5581'}, monday_noon, 'No exFAT'),
+            ({'fstype': 'vfat', 'vendor_id': '0781', 'product_id': '5581'}, sunday_noon, 'SanDisk'),
+            ({'fstype': 'vfat', 'size': 16 * 1024 ** 3}, monday_noon, 'Small sticks in office hours'),
+            ({'fstype': 'vfat', 'size': 16 * 1024 ** 3}, sunday_noon, None),
+        ]
+        for device, now, expected in cases:
+            rule = policy.match(device_values(device, now=now))
+            if (rule or {}).get('name') != expected:
+                print(f"✗ {device} matched {rule}, expected {expected}")
+                return False
+        print("✓ First matching rule wins across exact and range fields")
+        
+        # The indexes must agree with a plain rule-by-rule scan
+        random_rules = [{'action': 'allow',
+                         'vendor_id': f"{v:04x}-{v + random.randrange(64):04x}",
+                         'hours': f"{random.randrange(24)}:00-{random.randrange(24)}:00",
+                         'fstype': random.choice(['vfat', 'ntfs', 'exfat'])}
+                        for v in (random.randrange(0x1000) for _ in range(200))]
+        policy = CompiledPolicy(random_rules)
+        for _ in range(500):
+            values = device_values({'vendor_id': f"{random.randrange(0x1040):04x}",
+                                    'fstype': random.choice(['vfat', 'ntfs', 'exfat'])},
+                                   now=datetime(2024, 1, 1, random.randrange(24), 30))
+            if policy.match(values) is not policy.scan(values):
+                print(f"✗ Index and scan disagree for {values}")
+                return False
+        print("✓ Indexed decisions match a linear scan")
+        
+        path = os.path.join('config', 'test_policy.json')
+        with open(path, 'w') as f:
+            json.dump({'rules': rules[:1]}, f)
+        changes = []
+        store = PolicyStore(path, on_change=lambda: changes.append(True))
+        exfat = {'fstype': 'exfat'}
+        before = store.decide(exfat)
+        with open(path, 'w') as f:
+            json.dump({'rules': [{'action': 'allow', 'fstype': 'exfat'}]}, f)
+        os.utime(path, ns=(0, 0))
+        store.reload_if_changed()
+        if before == 'block' and store.decide(exfat) == 'allow' and changes:
+            print("✓ Policy reloaded on change")
+        else:
+            print("✗ Policy reload failed")
+            return False
+        
+        os.remove(path)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Policy engine test failed: {e}")
+        return False
+
+def test_config_service():
+    """Test settings validation and live change notification"""
+    print("\nTesting Config Service...")
+    
+    try:
+        import shutil
+        from config_service import ConfigService, validate_settings
+        
+        settings, problems = validate_settings({'lockout_duration': 'ten', 'enable_blinking': False,
+                                                'debounce_window_ms': -5})
+        if settings['lockout_duration'] == 15 and not settings['enable_blinking'] and len(problems) == 2:
+            print("✓ Invalid values rejected, valid ones applied")
+        else:
+            print(f"✗ Unexpected validation result: {settings}, {problems}")
+            return False
+        
+        config_dir = os.path.join('config', 'test_config')
+        path = os.path.join(config_dir, 'settings.json')
+        os.makedirs(config_dir, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'lockout_duration': 15}, f)
+        
+        received = []
+        changed = threading.Event()
+        service = ConfigService(path, interval=0.1)
+        service.start(lambda changes: (received.extend(changes), changed.set()))
+        
+        # Written the way management tooling pushes files: temp file + rename
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'lockout_duration': 30, 'enable_notifications': False}, f)
+        os.replace(path + '.tmp', path)
+        
+        if changed.wait(3) and {c.key: c.new for c in received} == {
+                'lockout_duration': 30, 'enable_notifications': False}:
+            print(f"✓ Change events delivered ({service.watcher.backend})")
+        else:
+            print(f"✗ Unexpected change events: {received}")
+            return False
+        
+        received.clear()
+        service.save(dict(service.settings, lockout_duration=45))
+        time.sleep(0.5)
+        service.stop()
+        if not received and service.get('lockout_duration') == 45:
+            print("✓ Own saves don't echo back as changes")
+        else:
+            print(f"✗ Save produced changes: {received}")
+            return False
+        
+        shutil.rmtree(config_dir)
+        return True
+        
+    except Exception as e:
+        print(f"✗ Config service test failed: {e}")
+        return False
+
+def test_metrics():
+    """Test hot-path traces, histograms and Prometheus export"""
+    print("\nTesting Metrics...")
+    
+    try:
+        import urllib.request
+        from metrics import MetricsRegistry, MetricsExporter, stamp, stage_offsets
+        
+        device_info = {'device': '/dev/sdb1'}
+        stamp(device_info, 'detected', 10.0)
+        stamp(device_info, 'detected', 11.0)
+        stamp(device_info, 'first_paint', 10.3)
+        offsets = {stage: round(seconds, 6) for stage, seconds in stage_offsets(device_info['trace']).items()}
+        if offsets == {'detected': 0.0, 'first_paint': 0.3}:
+            print("✓ Stage stamps keep the first time per stage")
+        else:
+            print(f"✗ Unexpected trace: {device_info['trace']}")
+            return False
+        
+        registry = MetricsRegistry(prefix='test')
+        events = registry.counter('events_total', "Events", ('event',))
+        latency = registry.histogram('latency_seconds', "Latency")
+        events.inc(1, 'device_connected')
+        events.inc(2, 'device_connected')
+        for ms in range(1, 101):
+            latency.observe(ms / 1000.0)
+        if latency.percentile(0.5) == 0.05 and latency.percentile(0.99) == 0.099:
+            print("✓ p50/p99 computed over recent samples")
+        else:
+            print(f"✗ Unexpected percentiles: {latency.percentile(0.5)}, {latency.percentile(0.99)}")
+            return False
+        
+        text = registry.render()
+        expected = ['# TYPE test_events_total counter',
+                    'test_events_total{event="device_connected"} 3',
+                    'test_latency_seconds{quantile="0.99"} 0.099',
+                    'test_latency_seconds_count 100']
+        if all(line in text.splitlines() for line in expected):
+            print("✓ Prometheus text rendered")
+        else:
+            print(f"✗ Unexpected exposition:\n{text}")
+            return False
+        
+        path = os.path.join('config', 'test_metrics.prom')
+        exporter = MetricsExporter(registry, path=path, interval=60, port=0)
+        exporter.write()
+        port = exporter.serve_http(0)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+            served = response.read().decode('utf-8')
+        exporter.stop()
+        with open(path, 'r') as f:
+            written = f.read()
+        os.remove(path)
+        if served == written == text:
+            print("✓ Stats file and HTTP endpoint export the same metrics")
+        else:
+            print("✗ Exported metrics differ")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Metrics test failed: {e}")
+        return False
+
+def test_reconcile_lockout():
+    """Test that a periodic rescan locks and unlocks for missed events"""
+    print("\nTesting Reconcile Lockout...")
+    
+    try:
+        import subprocess
+        # Needs its own QApplication, so it runs in a child process
+        script = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import benchmark
+app = benchmark._bench_app()
+drives = []
+app.device_source.get_connected_removable_drives = lambda: list(drives)
+drives.append({'device': '/dev/sdq1', 'fstype': 'vfat'})
+app.reconcile_devices()
+locked = benchmark._wait_until(app, lambda: app.overlay_active, 5)
+drives.clear()
+app.reconcile_devices()
+unlocked = benchmark._wait_until(app, lambda: not app.overlay_active, 5)
+print(locked, unlocked)
+"""
+        env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+        here = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run([sys.executable, '-c', script, here], env=env,
+                                capture_output=True, text=True, timeout=60)
+        outcome = result.stdout.strip().splitlines()[-1:]
+        if outcome == ['True True']:
+            print("✓ Missed connect locks the screen, missed removal unlocks it")
+            return True
+        print(f"✗ Reconcile did not update the lockout: {outcome or result.stderr[-300:]}")
+        return False
+        
+    except Exception as e:
+        print(f"✗ Reconcile lockout test failed: {e}")
+        return False
+
+def test_benchmark_baseline():
+    """Test regression detection against a saved benchmark baseline"""
+    print("\nTesting Benchmark Baseline...")
+    
+    try:
+        from benchmark import compare
+        
+        baseline = {'events.events_per_s': 100000, 'alert.lock_p99_ms': 160.0,
+                    'alert.first_paint_p99_ms': 0.3, 'policy.compile_ms': 500.0}
+        results = {'events.events_per_s': 60000, 'alert.lock_p99_ms': 165.0,
+                   'alert.first_paint_p99_ms': 0.6, 'policy.compile_ms': 900.0,
+                   'log.records_per_s': 1000}
+        regressed = sorted(metric for metric, _, _, _ in compare(results, baseline))
+        if regressed == ['events.events_per_s', 'policy.compile_ms']:
+            print("✓ Slowdowns beyond the threshold flagged, noise ignored")
+        else:
+            print(f"✗ Unexpected regressions: {regressed}")
+            return False
+        
+        if not compare(results, baseline, {'events.events_per_s': 0.5, 'policy.compile_ms': 1.0}):
+            print("✓ Per-metric thresholds respected")
+        else:
+            print("✗ Per-metric thresholds ignored")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Benchmark baseline test failed: {e}")
+        return False
+
+def test_event_codec():
+    """Test the columnar event file round trip and exports"""
+    print("\nTesting Event Codec...")
+    
+    try:
+        import io
+        import csv
+        import json
+        import tempfile
+        from event_codec import EventTable, load_events
+        
+        drives = [{'drive_letter': 'E:', 'device': '/dev/sdb1', 'fstype': 'vfat', 'name': 'Stick'},
+                  {'drive_letter': 'F:', 'id': 'USBSTOR\\DISK&VEN_TEST', 'name': 'Disk, "quoted"'}]
+        records = [{'timestamp': f"2024-03-0{1 + i % 9}T12:34:56.{i + 1:06d}",
+                    'event': ('DEVICE_CONNECTED', 'DEVICE_REMOVED', 'TEST_EVENT')[i % 3],
+                    'device': drives[i % 2]} for i in range(300)]
+        
+        with tempfile.TemporaryDirectory() as workdir:
+            legacy_path = os.path.join(workdir, 'security_log.json')
+            packed_path = os.path.join(workdir, 'security_log.evc')
+            with open(legacy_path, 'w') as f:
+                json.dump(records, f, indent=2)
+            
+            EventTable.from_legacy_file(legacy_path).write(packed_path)
+            table = load_events(packed_path)
+            if list(table.records()) == records and len(table.device_table) == 2:
+                print("✓ Events survive conversion with devices interned")
+            else:
+                print("✗ Converted events differ from the legacy log")
+                return False
+            
+            if os.path.getsize(packed_path) * 5 < os.path.getsize(legacy_path):
+                print("✓ Packed file is over 5x smaller than the JSON log")
+            else:
+                print("✗ Packed file is not much smaller than the JSON log")
+                return False
+            
+            # A live instance's log directory: read it, never repair or compact it
+            log_dir = os.path.join(workdir, 'logs')
+            os.makedirs(log_dir)
+            with open(os.path.join(log_dir, 'security-000001.jsonl'), 'w') as f:
+                f.write(''.join(json.dumps(record) + "\n" for record in records[:100]))
+                f.write('{"timestamp": "2024-03-0')
+            before = {name: open(os.path.join(log_dir, name), 'rb').read()
+                      for name in os.listdir(log_dir)}
+            table = load_events(log_dir)
+            after = {name: open(os.path.join(log_dir, name), 'rb').read()
+                     for name in os.listdir(log_dir)}
+            if list(table.records()) == records[:100] and after == before:
+                print("✓ Log directory read without modifying it")
+            else:
+                print("✗ Reading a log directory changed it")
+                return False
+            
+            table = load_events(packed_path)
+            with open(packed_path, 'r+b') as f:
+                f.truncate(os.path.getsize(packed_path) - 1)
+            try:
+                EventTable.read(packed_path)
+                print("✗ Truncated file accepted")
+                return False
+            except ValueError:
+                print("✓ Truncated file rejected")
+        
+        output = io.StringIO()
+        table.export_csv(output)
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        if (len(rows) == 300 and rows[1]['name'] == 'Disk, "quoted"'
+                and rows[1]['timestamp'] == records[1]['timestamp'] and rows[0]['fstype'] == 'vfat'):
+            print("✓ CSV export has one row per event")
+        else:
+            print("✗ CSV export is wrong")
+            return False
+        
+        output = io.StringIO()
+        table.export_json(output)
+        if json.loads(output.getvalue()) == records:
+            print("✓ JSON export matches the legacy format")
+        else:
+            print("✗ JSON export is wrong")
+            return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Event codec test failed: {e}")
+        return False
+
+def test_log_shipper():
+    """Test batched, spooled delivery of the security log to a collector"""
+    print("\nTesting Log Shipper...")
+    
+    try:
+        import gzip
+        import json
+        import socket
+        import tempfile
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from security_log import SecurityLog
+        from log_shipper import LogShipper, HttpTransport, SyslogTransport
+        
+        received = []
+        failing = [True]
+        
+        class Collector(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if failing[0]:
+                    self.send_error(503)
+                    return
+                if self.headers['Content-Encoding'] == 'gzip':
+                    body = gzip.decompress(body)
+                received.extend(json.loads(line) for line in body.splitlines())
+                self.send_response(204)
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Collector)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/ingest"
+        
+        with tempfile.TemporaryDirectory() as workdir:
+            log = SecurityLog(os.path.join(workdir, 'logs'), segment_size=4096)
+            shipper = LogShipper(log, HttpTransport(url), batch_size=40, batch_interval=0,
+                                 retry_min=0.01, host='test-host')
+            for i in range(100):
+                log.append('TEST_EVENT', {'device': f'/dev/sd{i}'})
+            log.flush()
+            
+            shipper.collect()
+            if len(shipper.spooled()) == 3 and shipper.deliver() == 0 and len(shipper.spooled()) == 3:
+                print("✓ Batches stay spooled while the collector is down")
+            else:
+                print("✗ Spool did not hold batches during an outage")
+                return False
+            
+            # A restarted shipper resumes from the persisted cursor
+            shipper = LogShipper(log, HttpTransport(url), batch_size=40, batch_interval=0,
+                                 retry_min=0.01, host='test-host')
+            shipper.collect()
+            failing[0] = False
+            shipper.deliver()
+            devices = [event['record']['device']['device'] for event in received]
+            if devices == [f'/dev/sd{i}' for i in range(100)] and not shipper.spooled():
+                print("✓ Events delivered once each, in order, across segments and restarts")
+            else:
+                print(f"✗ Collector received {len(devices)} events")
+                return False
+            
+            ids = {event['id'] for event in received}
+            if len(ids) == 100 and all(event['host'] == 'test-host' for event in received):
+                print("✓ Every event carries a stable dedup id")
+            else:
+                print("✗ Event ids are missing or repeated")
+                return False
+            
+            # Background thread: woken by log writes, batches by time
+            shipper.batch_interval = 0.05
+            shipper.start()
+            log.append('TEST_EVENT', {'device': '/dev/live'})
+            deadline = time.time() + 5
+            while time.time() < deadline and len(received) < 101:
+                time.sleep(0.02)
+            if received[-1]['record']['device']['device'] == '/dev/live':
+                print("✓ New events are shipped in the background")
+            else:
+                print("✗ Background shipping did not deliver the new event")
+                return False
+            
+            # Clearing the log spools what has not been shipped yet
+            failing[0] = True
+            shipper.retry_min = 60
+            log.append('TEST_EVENT', {'device': '/dev/before-clear'})
+            log.clear()
+            batches = shipper.spooled()
+            if batches and b'/dev/before-clear' in b''.join(batches[-1].lines()):
+                print("✓ Unshipped events are spooled before the log is cleared")
+            else:
+                print("✗ Events were lost when the log was cleared")
+                return False
+            shipper.stop()
+            log.close()
+            
+            # Syslog over TCP with octet-counted framing
+            listener = socket.socket()
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            transport = SyslogTransport('127.0.0.1', listener.getsockname()[1], 'tcp')
+            threading.Thread(target=transport.send, args=(batches[-1],), daemon=True).start()
+            connection, _ = listener.accept()
+            data = b''
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            connection.close()
+            listener.close()
+            length, _, message = data.partition(b' ')
+            if int(length) == len(message) and message.startswith(b'<37>1 ') and b'/dev/before-clear' in message:
+                print("✓ Syslog transport sends framed RFC 5424 messages")
+            else:
+                print(f"✗ Unexpected syslog data: {data[:80]!r}")
+                return False
+        
+        server.shutdown()
+        server.server_close()
+        return True
+        
+    except Exception as e:
+        print(f"✗ Log shipper test failed: {e}")
+        return False
+
+def test_whitelist_manifest():
+    """Test signed whitelist manifests and incremental apply"""
+    print("\nTesting Whitelist Manifest...")
+    
+    try:
+        import tempfile
+        from whitelist_store import WhitelistStore
+        from whitelist_manifest import (ManagedWhitelist, ManifestError, sign_manifest,
+                                        parse_manifest)
+        
+        fleet = [{'id': f"USBSTOR\\DISK&VEN_FLEET&PROD_{i:08d}", 'name': f"Drive {i}"}
+                 for i in range(100000)]
+        key = b'fleet-secret'
+        data = sign_manifest(fleet, 1, key)
+        
+        unsigned = sign_manifest(fleet[:10], 1)
+        for label, tampered, use_key in (("Tampered", data.replace(b'Drive 7"', b'Drive X"'), key),
+                                         ("Wrong key", data, b'other'),
+                                         ("Unsigned", unsigned, key),
+                                         ("Keyless", unsigned, None)):
+            try:
+                parse_manifest(tampered, use_key)
+                print(f"✗ {label} manifest accepted")
+                return False
+            except ManifestError:
+                pass
+        print("✓ Tampered, wrongly keyed and unsigned manifests rejected")
+        
+        integrity_only = parse_manifest(unsigned, integrity_only=True)
+        if len(integrity_only) == 10 and not integrity_only.authenticated and parse_manifest(data, key).authenticated:
+            print("✓ Keyless manifest only accepted as integrity-only, marked unauthenticated")
+        else:
+            print("✗ Keyless manifest not labelled unauthenticated")
+            return False
+        
+        with tempfile.TemporaryDirectory() as workdir:
+            key_path = os.path.join(workdir, 'manifest.key')
+            with open(key_path, 'wb') as f:
+                f.write(key)
+            source = os.path.join(workdir, 'fleet.manifest')
+            with open(source, 'wb') as f:
+                f.write(data)
+            
+            store = WhitelistStore([{'id': 'LOCAL-STICK', 'name': 'Local'}])
+            managed = ManagedWhitelist(os.path.join(workdir, 'active.manifest'), key_path)
+            start = time.perf_counter()
+            manifest, diff = managed.prepare(source)
+            managed.apply(store, manifest, diff)
+            elapsed = time.perf_counter() - start
+            if len(store) == 100001 and store.is_whitelisted(fleet[5]['id']) and elapsed < 1.0:
+                print(f"✓ 100,000-entry manifest verified and applied in {elapsed * 1000:.0f} ms")
+            else:
+                print(f"✗ Manifest import gave {len(store)} entries in {elapsed:.2f}s")
+                return False
+            
+            # Next version: drop 1,000 entries, rename one, add one
+            update = fleet[1000:] + [{'id': 'NEW-STICK', 'name': 'New'}]
+            update[0] = dict(update[0], name='Renamed')
+            with open(source, 'wb') as f:
+                f.write(sign_manifest(update + [{'id': 'LOCAL-STICK', 'name': 'Also fleet'}], 2, key))
+            manifest, diff = managed.prepare(source)
+            with open(source, 'wb') as f:
+                f.write(sign_manifest(update, 3, key))
+            managed.apply(store, manifest, diff)
+            manifest, diff = managed.prepare(source)
+            managed.apply(store, manifest, diff, local_entries=[{'id': 'LOCAL-STICK'}])
+            if (len(diff.added) == 0 and len(diff.removed) == 1 and len(store) == 99002
+                    and not store.is_whitelisted(fleet[0]['id']) and store.is_whitelisted('new-stick')
+                    and store.is_whitelisted('LOCAL-STICK') and store.get(update[0]['id'])['name'] == 'Renamed'):
+                print("✓ Only the difference is applied and local entries are kept")
+            else:
+                print(f"✗ Diff apply left {len(store)} entries")
+                return False
+            
+            with open(source, 'wb') as f:
+                f.write(data)
+            try:
+                managed.prepare(source)
+                print("✗ Older manifest version accepted")
+                return False
+            except ManifestError:
+                print("✓ Rollback to an older manifest version refused")
+            
+            # A restart re-reads the saved active manifest
+            restarted = ManagedWhitelist(managed.path, key_path)
+            manifest, diff = restarted.load_active()
+            if manifest.version == 3 and len(diff.added) == 99001:
+                print("✓ Active manifest persisted for the next start")
+            else:
+                print("✗ Active manifest was not persisted")
+                return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Whitelist manifest test failed: {e}")
+        return False
+
+def test_whitelist_search():
+    """Test the whitelist prefix index and its paged list model"""
+    print("\nTesting Whitelist Search...")
+    
+    try:
+        import random
+        from whitelist_store import WhitelistStore, WhitelistSearch
+        
+        store = WhitelistStore()
+        rng = random.Random(7)
+        store.apply_changes((f"usbstor\\disk&prod_{i:06d}",
+                             {'id': f"USBSTOR\\DISK&PROD_{i:06d}", 'name': f"Drive {rng.randrange(100000)}"})
+                            for i in range(50000))
+        store.add('DRIVE-NAMED-ID', 'Drive 1 by id')
+        search = WhitelistSearch(store)
+        search.rebuild()
+        
+        def collect(prefix, limit):
+            rows, cursor = search.search(prefix, limit=limit)
+            while cursor is not None:
+                page, cursor = search.search(prefix, cursor, limit)
+                rows.extend(page)
+            return [key for _, _, key in rows]
+        
+        for prefix in ('', 'drive 1', 'usbstor\\disk&prod_0012', 'DRIVE 99'):
+            keys = collect(prefix, 37)
+            expected = {key for key, entry in store._entries.items()
+                        if key.startswith(prefix.lower()) or entry['name'].lower().startswith(prefix.lower())}
+            if len(keys) != len(expected) or set(keys) != expected:
+                print(f"✗ Prefix {prefix!r} gave {len(keys)} rows, expected {len(expected)}")
+                return False
+        if collect('drive', 100)[0] != 'drive-named-id':
+            print("✗ Id matches are not listed before name matches")
+            return False
+        print("✓ Paged prefix search matches a full scan (ids first, no duplicates)")
+        
+        store.add('USBSTOR\\DISK&PROD_001200x', 'Drive extra')
+        store.remove('USBSTOR\\DISK&PROD_001201')
+        keys = collect('usbstor\\disk&prod_00120', 3)
+        if 'usbstor\\disk&prod_001200x' not in keys or 'usbstor\\disk&prod_001201' in keys:
+            print(f"✗ Incremental edits not reflected: {keys}")
+            return False
+        
+        # Edits made while a (worker thread) build runs are replayed on install
+        snapshot = search.snapshot()
+        store.add('LATE-STICK', 'Late')
+        store.remove('USBSTOR\\DISK&PROD_000000')
+        built = search.build(snapshot)
+        stale = search.build(search.snapshot())
+        if search.install(built) or not search.install(stale):
+            print("✗ A superseded build was installed")
+            return False
+        if collect('late', 10) != ['late-stick'] or collect('usbstor\\disk&prod_000000', 10):
+            print("✗ Edits made during a build were lost")
+            return False
+        print("✓ Edits update the index incrementally, also during a build")
+        
+        from PyQt5.QtWidgets import QApplication
+        from PyQt5.QtCore import QModelIndex
+        app = QApplication.instance() or QApplication(sys.argv)
+        from main import WhitelistListModel
+        
+        store.clear()
+        model = WhitelistListModel(store, page_size=50)
+        store.import_entries({'id': f"STICK-{i:04d}", 'name': f"Stick {i}"} for i in range(500))
+        model.set_prefix('stick-00')
+        deadline = time.time() + 10
+        while not search.ready and time.time() < deadline:
+            app.processEvents()
+            time.sleep(0.01)
+        if model.rowCount() != 50 or not model.canFetchMore(QModelIndex()):
+            print(f"✗ Model loaded {model.rowCount()} rows after indexing, expected one page")
+            return False
+        model.fetchMore(QModelIndex())
+        if model.rowCount() != 100 or model.canFetchMore(QModelIndex()):
+            print(f"✗ Model paged to {model.rowCount()} rows, expected 100")
+            return False
+        store.add('STICK-0005a', 'Inserted')
+        store.remove('STICK-0050')
+        store.add('OTHER', 'Not matching')
+        keys = [model.key_at(row) for row in range(model.rowCount())]
+        if keys[6] != 'stick-0005a' or 'stick-0050' in keys or len(keys) != 100:
+            print("✗ Model did not follow store edits row by row")
+            return False
+        print("✓ List model indexes off-thread, pages rows in and follows edits")
+        return True
+    except Exception as e:
+        print(f"✗ Whitelist search test failed: {e}")
+        return False
+
+def test_content_scanner():
+    """Test the device content scan against temporary directories"""
+    print("\nTesting Content Scanner...")
+    
+    try:
+        import shutil
+        import hashlib
+        import tempfile
+        from blocklist import Blocklist, import_feed, read_feed
+        from content_scanner import ContentScanner, FileTypeRules, hash_file, MMAP_THRESHOLD
+        
+        with tempfile.TemporaryDirectory() as workdir:
+            volume = os.path.join(workdir, 'volume')
+            for i in range(200):
+                folder = os.path.join(volume, f"photos{i % 8}")
+                os.makedirs(folder, exist_ok=True)
+                with open(os.path.join(folder, f"img{i}.jpg"), 'wb') as f:
+                    f.write(os.urandom(32 * 1024))
+            large = os.path.join(volume, 'backup.img')
+            with open(large, 'wb') as f:
+                f.write(os.urandom(MMAP_THRESHOLD + 12345))
+            with open(large, 'rb') as f:
+                if hash_file(large)[0] != hashlib.sha256(f.read()).hexdigest():
+                    print("✗ mmap hashing gave a wrong digest")
+                    return False
+            
+            bad_content = b'known bad payload'
+            feed_path = os.path.join(workdir, 'hash_feed.txt')
+            with open(feed_path, 'w') as f:
+                f.write("# threat feed\n")
+                f.write(''.join(hashlib.sha256(str(i).encode()).hexdigest() + "\n" for i in range(1000)))
+                f.write(hashlib.sha256(bad_content).hexdigest().upper() + "  # sample\n")
+            blocklist_dir = os.path.join(workdir, 'blocklists')
+            import_feed('hashes', read_feed(feed_path), blocklist_dir)
+            blocklist = Blocklist('hashes', blocklist_dir)
+            scanner = ContentScanner(blocklist, workers=2)
+            
+            result = scanner.scan_now(volume)
+            if result.verdict != 'allow' or result.files != 201 or result.mb_per_s <= 0 or result.files_per_s <= 0:
+                print(f"✗ Clean volume gave {result.verdict}: {result.summary()}")
+                return False
+            print(f"✓ Clean volume allowed: {result.summary()}")
+            
+            dropped = os.path.join(volume, 'photos3', 'invoice.pdf')
+            with open(dropped, 'wb') as f:
+                f.write(bad_content)
+            result = scanner.scan_now(volume)
+            if len(blocklist) != 1001 or result.verdict != 'block' or result.path != dropped:
+                print(f"✗ Blocklisted file gave {result.verdict} ({result.reason})")
+                return False
+            os.remove(dropped)
+            
+            with open(os.path.join(volume, 'setup.txt'), 'wb') as f:
+                f.write(b'MZ\x90\x00' + os.urandom(100))
+            strict = ContentScanner(blocklist, FileTypeRules(blocked_extensions=['lnk'], block_executables=True),
+                                    workers=2)
+            if strict.scan_now(volume).reason != 'Windows executable':
+                print("✗ Disguised executable not blocked")
+                return False
+            with open(os.path.join(volume, 'Autorun.inf'), 'w') as f:
+                f.write("[autorun]\n")
+            if scanner.scan_now(volume).verdict != 'block':
+                print("✗ autorun.inf not blocked")
+                return False
+            os.remove(os.path.join(volume, 'Autorun.inf'))
+            print("✓ Blocklisted hashes, disguised executables and autorun.inf blocked")
+            
+            locked = os.path.join(volume, 'private')
+            os.makedirs(locked)
+            with open(os.path.join(locked, 'hidden.bin'), 'wb') as f:
+                f.write(bad_content)
+            os.chmod(locked, 0)
+            try:
+                if os.access(locked, os.R_OK):
+                    print("✓ Unreadable directory check skipped (running as root)")
+                else:
+                    result = scanner.scan_now(volume)
+                    if result.verdict != 'incomplete' or not result.errors:
+                        print(f"✗ Unreadable directory gave {result.verdict} ({result.errors} errors)")
+                        return False
+                    print(f"✓ Unreadable directory left the scan incomplete: {result.reason}")
+            finally:
+                os.chmod(locked, 0o755)
+                shutil.rmtree(locked)
+            
+            # 4 MB/s across two workers: about 4 s for this volume, cancelled after 1
+            progress = []
+            throttled = ContentScanner(blocklist, workers=2, max_bytes_per_s=4 * 1024 * 1024,
+                                       batch_files=16, progress_interval=0.2)
+            job = throttled.scan(volume, on_progress=lambda r: progress.append(r.bytes))
+            time.sleep(1.0)
+            job.cancel()
+            cancelled = time.monotonic()
+            result = job.wait(10)
+            stopped = time.monotonic() - cancelled
+            if result.verdict != 'cancelled' or stopped > 2.0 or not progress:
+                print(f"✗ Cancel gave {result.verdict} after {stopped:.1f}s ({len(progress)} progress reports)")
+                return False
+            if result.bytes / result.elapsed > 6 * 1024 * 1024:
+                print(f"✗ Bandwidth cap exceeded: {result.mb_per_s:.1f} MB/s")
+                return False
+            print(f"✓ Throttled scan ({result.mb_per_s:.1f} MB/s) cancelled within {stopped:.2f}s")
+        return True
+    except Exception as e:
+        print(f"✗ Content scanner test failed: {e}")
+        return False
+
+def test_blocklist():
+    """Test the compiled known-bad serial and hash blocklists"""
+    print("\nTesting Blocklist...")
+    
+    try:
+        import shutil
+        import hashlib
+        import tempfile
+        from blocklist import Blocklist, import_feed, list_generations, serial_key
+        from policy_engine import PolicyStore, is_device_authorized
+        from whitelist_store import WhitelistStore
+        from device_identity import DeviceIdentityCache
+        
+        workdir = tempfile.mkdtemp()
+        serials = [f"SN{i:08d}" for i in range(200000)]
+        path, count = import_feed('serials', serials + [' sn00000007 ', ''], workdir)
+        serial_list = Blocklist('serials', workdir)
+        if not serial_list.refresh() or count != 200000 or len(serial_list) != 200000:
+            print(f"✗ Import gave {count} keys, mapped {len(serial_list)}")
+            return False
+        if not all(serial in serial_list for serial in serials[::7]) or 'sn00000042' not in serial_list:
+            print("✗ Listed serial not found")
+            return False
+        
+        # Only the bloom filter's rare false positives reach the key search
+        unknown = [serial_key(f"OTHER{i}") for i in range(100000)]
+        if any(serial_list.contains_key(key) for key in unknown):
+            print("✗ Unlisted serial reported as listed")
+            return False
+        bloom, bits = serial_list._table[0], serial_list._table[1]
+        passed = sum(1 for key in unknown
+                     if all(bloom[(half % bits) >> 3] >> ((half % bits) & 7) & 1
+                            for half in (int.from_bytes(key[:8], 'little'), int.from_bytes(key[8:], 'little'))))
+        started = time.perf_counter()
+        for key in unknown:
+            serial_list.contains_key(key)
+        lookup_ns = (time.perf_counter() - started) / len(unknown) * 1e9
+        if passed / len(unknown) > 0.02:
+            print(f"✗ Bloom filter passes {passed / len(unknown):.2%} of unlisted keys")
+            return False
+        print(f"✓ 200k serials: no false negatives, bloom passes {passed / len(unknown):.2%}, "
+              f"{lookup_ns:.0f} ns per lookup")
+        
+        # A reader keeps answering from its mapped generation until it refreshes
+        digests = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(1000)]
+        import_feed('hashes', digests[:500], workdir)
+        hash_list = Blocklist('hashes', workdir)
+        hash_list.refresh()
+        new_path, _ = import_feed('hashes', digests[500:], workdir)
+        if digests[0] not in hash_list or digests[999] in hash_list:
+            print("✗ Old generation changed under its reader")
+            return False
+        if not hash_list.refresh() or hash_list.path != new_path or digests[0] in hash_list \
+                or digests[999].upper() not in hash_list or len(list_generations('hashes', workdir)) != 1:
+            print("✗ New generation not swapped in")
+            return False
+        print("✓ Feed update swapped in atomically; older generations retired")
+        
+        # A damaged next generation is refused and the current one kept
+        with open(new_path, 'rb') as f:
+            data = f.read()
+        with open(os.path.join(workdir, 'hashes-999999.blk'), 'wb') as f:
+            f.write(data[:-5])
+        if hash_list.refresh() or hash_list.path != new_path or digests[999] not in hash_list:
+            print("✗ Truncated blocklist file was loaded")
+            return False
+        # Completed in place (the directory is unchanged): the next refresh retries it
+        with open(os.path.join(workdir, 'hashes-999999.blk'), 'wb') as f:
+            f.write(data)
+        if not hash_list.refresh() or not hash_list.path.endswith('hashes-999999.blk'):
+            print("✗ Blocklist not retried after a failed load")
+            return False
+        print("✓ Truncated blocklist file refused, then retried")
+        
+        # Device path: a listed serial is refused even when the whitelist trusts it
+        whitelist = WhitelistStore([{'vendor_id': '0781', 'product_id': '5581'}])
+        identity = DeviceIdentityCache(os.path.join(workdir, 'fingerprints.json'),
+                                       probe=lambda node: {}, uuid_lookup=lambda node: '')
+        policy = PolicyStore(os.path.join(workdir, 'no_policy.json'))
+        trusted = {'device': '/dev/sdb1', 'vendor_id': '0781', 'product_id': '5581', 'serial': 'GOOD1'}
+        listed = dict(trusted, device='/dev/sdc1', serial=serials[123])
+        if not is_device_authorized(policy, whitelist, identity, trusted, blocklist=serial_list) \
+                or is_device_authorized(policy, whitelist, identity, listed, blocklist=serial_list):
+            print("✗ Listed serial not refused on the device path")
+            return False
+        print("✓ Known-bad serial blocked before the whitelist")
+        
+        shutil.rmtree(workdir, ignore_errors=True)
+        return True
+    except Exception as e:
+        print(f"✗ Blocklist test failed: {e}")
+        return False
+
 def test_system_requirements():
     """Test system requirements"""
     print("\nTesting System Requirements...")
@@ -229,6 +1801,28 @@ def main():
         ("Device Monitor", test_device_monitor),
         ("Security Overlay", test_security_overlay),
         ("Logging", test_logging),
+        ("Security Log", test_security_log),
+        ("Log Query", test_log_query),
+        ("Whitelist Store", test_whitelist_store),
+        ("Device Table", test_device_table),
+        ("Device Sources", test_device_sources),
+        ("Event Coalescer", test_event_coalescer),
+        ("Device Identity", test_device_identity),
+        ("Background Writer", test_background_writer),
+        ("Overlay Rendering", test_overlay_rendering),
+        ("Daemon", test_daemon),
+        ("Instance Lock", test_instance_lock),
+        ("Policy Engine", test_policy_engine),
+        ("Config Service", test_config_service),
+        ("Metrics", test_metrics),
+        ("Reconcile Lockout", test_reconcile_lockout),
+        ("Benchmark Baseline", test_benchmark_baseline),
+        ("Event Codec", test_event_codec),
+        ("Log Shipper", test_log_shipper),
+        ("Whitelist Manifest", test_whitelist_manifest),
+        ("Whitelist Search", test_whitelist_search),
+        ("Content Scanner", test_content_scanner),
+        ("Blocklist", test_blocklist),
     ]
     
     passed = 0
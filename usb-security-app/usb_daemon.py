@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+Headless USB Security daemon
+Owns device detection, whitelist policy and the security log without
+loading Qt, and serves them on a Unix-domain socket (see daemon_client.py
+for the protocol). Tray sessions connect with --source daemon and only
+show what the daemon decides, so one daemon can serve several sessions
+Usage: python usb_daemon.py [--socket PATH] [--source SPEC] [--metrics-port PORT]
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import shutil
+import signal
+import socket
+import threading
+
+from security_log import SecurityLog, LOG_DIR
+from log_query import LogQuery
+from whitelist_store import WhitelistStore
+from device_state import DeviceTable
+from event_coalescer import EventCoalescer, DEVICE_CONNECTED
+from device_identity import DeviceIdentityCache
+from policy_engine import PolicyStore, is_device_authorized, POLICY_FILE
+from blocklist import Blocklist
+from background_writer import BackgroundWriter
+from config_service import ConfigService
+from log_shipper import create_shipper
+from whitelist_manifest import ManagedWhitelist, MANIFEST_FILE
+from device_sources import create_device_source
+from daemon_client import SOCKET_PATH, MAX_MESSAGE, encode_message
+from instance_lock import peer_uid
+from metrics import MetricsExporter, registry, stamp, EVENTS, ALERTS, DETECTION_LATENCY
+
+SETTINGS_PATH = os.path.join('config', 'settings.json')
+# Separate from the tray's config/metrics.prom when both run in one directory
+METRICS_PATH = os.path.join('config', 'daemon_metrics.prom')
+
+# Requests that change state are only accepted from root or the daemon's own user
+PRIVILEGED_METHODS = {'whitelist_add', 'whitelist_remove', 'reload_whitelist', 'import_manifest',
+                      'clear_log'}
+# Requests that reveal the log, devices or trusted ids: root, the daemon's own
+# user and, with a socket group, whoever the 0660 socket lets connect
+READ_METHODS = {'devices', 'count_log', 'query_log', 'whitelist', 'metrics'}
+
+
+class _Connection:
+    """Buffers of one connected client"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbox = b''
+        self.outbox = bytearray()
+        self.subscribed = False
+        self.uid = peer_uid(sock)
+
+
+class SecurityDaemon:
+    """Device monitoring, policy and logging behind a local JSON socket"""
+
+    RECONCILE_INTERVAL = 30.0
+    # A subscriber that falls this far behind is disconnected
+    MAX_OUTBOX = 1024 * 1024
+
+    def __init__(self, socket_path=SOCKET_PATH, source_spec='auto',
+                 settings_path=SETTINGS_PATH, log_dir=LOG_DIR, policy_path=POLICY_FILE,
+                 metrics_path=METRICS_PATH, metrics_port=0, manifest_path=MANIFEST_FILE,
+                 socket_group=None):
+        self.socket_path = socket_path
+        self.socket_group = socket_group
+        self.source_spec = source_spec
+        self.settings_path = settings_path
+        self.log_dir = log_dir
+        self.policy_path = policy_path
+        self.metrics_exporter = MetricsExporter(path=metrics_path, port=metrics_port)
+        self.managed_whitelist = ManagedWhitelist(
+            manifest_path, os.path.join(os.path.dirname(manifest_path), 'manifest.key'))
+        self.log_shipper = None
+        self.serial_blocklist = Blocklist('serials')
+        self.locked = False
+        self.started_at = None
+        self._lockout_lock = threading.Lock()
+        # Whitelist, policy, identity cache and device table change on the server,
+        # config watcher and coalescer threads; every decision and edit holds this
+        self._policy_lock = threading.RLock()
+
+        self._connections = {}   # socket -> _Connection
+        self._connections_lock = threading.Lock()
+        self._listener = None
+        self._running = False
+        self._wake_read, self._wake_write = os.pipe()
+
+        self.methods = {
+            'status': self.rpc_status,
+            'devices': self.rpc_devices,
+            'subscribe': None,   # handled by the connection loop
+            'count_log': self.rpc_count_log,
+            'query_log': self.rpc_query_log,
+            'clear_log': self.rpc_clear_log,
+            'whitelist': self.rpc_whitelist,
+            'whitelist_add': self.rpc_whitelist_add,
+            'whitelist_remove': self.rpc_whitelist_remove,
+            'reload_whitelist': self.rpc_reload_whitelist,
+            'import_manifest': self.rpc_import_manifest,
+            'metrics': self.rpc_metrics,
+        }
+
+    # Startup and shutdown
+
+    def start(self):
+        """Open the log, start the device source and listen on the socket"""
+        self.config_writer = BackgroundWriter()
+        self.config_service = ConfigService(self.settings_path, writer=self.config_writer)
+        settings = self.config_service.settings
+        self.security_log = SecurityLog(self.log_dir)
+        self.security_log.import_legacy()
+        self.log_query = LogQuery(self.security_log)
+        self.whitelist_store = WhitelistStore(settings['whitelist'])
+        self.managed_whitelist.integrity_only = settings['manifest_integrity_only']
+        try:
+            active = self.managed_whitelist.load_active()
+            if active:
+                self.managed_whitelist.apply(self.whitelist_store, *active)
+        except (OSError, ValueError) as e:
+            print(f"Whitelist manifest not loaded: {e}")
+        self.policy_store = PolicyStore(self.policy_path, on_change=self.on_policy_changed)
+        self.device_identity = DeviceIdentityCache(writer=self.config_writer)
+        self.device_table = DeviceTable(self.is_drive_authorized,
+                                        on_removed=self.device_identity.forget)
+        self.event_coalescer = EventCoalescer(
+            self.on_device_batch,
+            window=settings['debounce_window_ms'] / 1000.0
+        )
+
+        self.device_source = create_device_source(self.source_spec, self.handle_device_event)
+        if self.device_source is None:
+            raise RuntimeError("No device source available on this platform "
+                               "(use --source poll or replay:<file>)")
+
+        self._listener = self.listen()
+        self._running = True
+        self.started_at = time.time()
+        self.device_source.start()
+        self.policy_store.start()
+        self.config_service.start(self.on_config_changed)
+        self.metrics_exporter.start()
+        self.start_log_shipping()
+        self.reconcile_devices()
+
+    def listen(self):
+        """Bind the control socket, replacing a stale one left by a crash"""
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+            except OSError:
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        if self.socket_group:
+            try:
+                shutil.chown(self.socket_path, group=self.socket_group)
+            except LookupError as e:
+                listener.close()
+                os.unlink(self.socket_path)
+                raise ValueError(f"Unknown socket group {self.socket_group}: {e}")
+            os.chmod(self.socket_path, 0o660)
+        else:
+            # Every session may subscribe; reads and changes are checked per request
+            os.chmod(self.socket_path, 0o666)
+        listener.listen(16)
+        listener.setblocking(False)
+        return listener
+
+    def stop(self):
+        """Ask serve_forever() to return (safe from signal handlers and other threads)"""
+        self._running = False
+        try:
+            os.write(self._wake_write, b'x')
+        except OSError:
+            pass
+
+    def shutdown(self):
+        """Stop detection, flush the log and remove the socket"""
+        self.device_source.stop()
+        self.event_coalescer.stop()
+        self.policy_store.stop()
+        self.config_service.stop()
+        self.metrics_exporter.stop()
+        if self.log_shipper:
+            self.log_shipper.stop()
+        with self._connections_lock:
+            connections, self._connections = self._connections, {}
+        for sock in connections:
+            sock.close()
+        if self._listener:
+            self._listener.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        self.security_log.close()
+        self.config_writer.close()
+
+    def start_log_shipping(self):
+        """Ship the security log to settings['log_collector'], if one is set"""
+        if self.log_shipper:
+            self.log_shipper.stop()
+        self.log_shipper = create_shipper(self.security_log, self.config_service.settings)
+        if self.log_shipper:
+            self.log_shipper.start()
+
+    # Policy
+
+    def is_drive_authorized(self, drive):
+        return is_device_authorized(self.policy_store, self.whitelist_store,
+                                    self.device_identity, drive, blocklist=self.serial_blocklist)
+
+    def on_policy_changed(self):
+        """Re-check connected devices after the policy file was reloaded"""
+        with self._policy_lock:
+            self.device_table.reevaluate()
+            self.update_lockout()
+
+    def handle_device_event(self, event_type, device_info):
+        """Source callback: start the event's trace, then debounce it"""
+        stamp(device_info, 'detected')
+        EVENTS.inc(1, event_type)
+        self.event_coalescer.submit(event_type, device_info)
+
+    def on_device_batch(self, events):
+        """Apply a coalesced batch to the device table, log it and notify clients"""
+        now = time.monotonic()
+        self.serial_blocklist.refresh()
+        for event_type, device_info in events:
+            # Only the detection stamp travels on; the tray adds its own stages
+            trace = {'detected': device_info.get('trace', {}).get('detected', now)}
+            DETECTION_LATENCY.observe(now - trace['detected'])
+            with self._policy_lock:
+                for partition in device_info.get('partitions', [device_info]):
+                    if event_type == DEVICE_CONNECTED:
+                        # The node may have been reused by another device since it was cached
+                        partition['fingerprint'] = self.device_identity.identify(partition, fresh=True)
+                        partition['authorized'] = not self.device_table.device_connected(partition)
+                    else:
+                        self.device_table.device_removed(partition)
+                        self.device_identity.forget(partition)
+            if 'partitions' in device_info:
+                first = device_info['partitions'][0]
+                device_info['fingerprint'] = first.get('fingerprint')
+                device_info['authorized'] = all(p.get('authorized', True)
+                                                for p in device_info['partitions'])
+
+            device_info.pop('trace', None)
+            for partition in device_info.get('partitions', []):
+                partition.pop('trace', None)
+            self.security_log.append(event_type.upper(), device_info)
+            self.broadcast({'event': event_type, 'device': dict(device_info, trace=trace)})
+        self.update_lockout()
+
+    def update_lockout(self):
+        """Tell subscribers when the unauthorized-device state flips"""
+        with self._lockout_lock:
+            locked = self.device_table.unauthorized_count() > 0
+            if locked == self.locked:
+                return
+            self.locked = locked
+            if locked:
+                ALERTS.inc()
+            self.broadcast({'event': 'lockout', 'active': locked})
+
+    def reconcile_devices(self):
+        drives = self.device_source.get_connected_removable_drives()
+        with self._policy_lock:
+            if self.serial_blocklist.refresh():
+                # A new known-bad feed can lock out devices that are already connected
+                self.device_table.reevaluate()
+                self.update_lockout()
+            if self.device_table.reconcile(drives):
+                self.update_lockout()
+
+    def on_config_changed(self, changes):
+        """Apply settings.json changes (config watcher thread)"""
+        keys = {change.key for change in changes}
+        if 'manifest_integrity_only' in keys:
+            self.managed_whitelist.integrity_only = self.config_service.get('manifest_integrity_only')
+        if 'whitelist' in keys:
+            self.rebuild_whitelist()
+        if 'debounce_window_ms' in keys:
+            self.event_coalescer.window = self.config_service.get('debounce_window_ms') / 1000.0
+        if keys & {'log_collector', 'log_compression'}:
+            self.start_log_shipping()
+        print(f"Settings updated: {', '.join(sorted(keys))}")
+
+    def rebuild_whitelist(self):
+        with self._policy_lock:
+            self.whitelist_store.clear()
+            self.whitelist_store.import_entries(self.config_service.get('whitelist', []))
+            self.managed_whitelist.restore(self.whitelist_store)
+            self.device_table.reevaluate()
+            self.update_lockout()
+
+    def save_whitelist(self):
+        """Write the whitelist back into settings.json (manifest entries stay in the manifest)"""
+        managed = self.managed_whitelist.entries
+        local = [entry for entry in self.whitelist_store.export_entries()
+                 if WhitelistStore.entry_key(entry) not in managed]
+        self.config_service.save(dict(self.config_service.settings, whitelist=local))
+
+    # RPC methods (run on the server thread)
+
+    def rpc_status(self):
+        return {
+            'pid': os.getpid(),
+            'source': self.device_source.name,
+            'uptime': time.time() - self.started_at,
+            'locked': self.locked,
+            'devices': len(self.device_table),
+            'unauthorized': self.device_table.unauthorized_count(),
+            'whitelist': len(self.whitelist_store),
+            'policy_rules': len(self.policy_store.policy),
+            'blocked_serials': len(self.serial_blocklist),
+            'subscribers': sum(1 for c in self._connections.values() if c.subscribed),
+            'log_shipping': self.log_shipper.stats() if self.log_shipper else None,
+            'source_stats': self.device_source.stats() if hasattr(self.device_source, 'stats') else None,
+        }
+
+    def rpc_metrics(self):
+        """Hot-path counters and latencies as Prometheus text"""
+        return registry.render()
+
+    def rpc_devices(self):
+        return self.device_table.connected_devices()
+
+    def rpc_count_log(self):
+        return self.log_query.count()
+
+    def rpc_query_log(self, limit=50, cursor=None, start=None, end=None, event=None, device=None):
+        records, next_cursor = self.log_query.query(
+            limit=min(int(limit), 1000), cursor=tuple(cursor) if cursor else None,
+            start=start, end=end, event=event, device=device
+        )
+        return {'records': records, 'cursor': next_cursor}
+
+    def rpc_clear_log(self):
+        self.security_log.clear()
+        return True
+
+    def rpc_whitelist(self):
+        with self._policy_lock:
+            return self.whitelist_store.export_entries()
+
+    def rpc_whitelist_add(self, id=None, name=None, vendor_id=None, product_id=None):
+        with self._policy_lock:
+            added = self.whitelist_store.add(id, name, vendor_id, product_id)
+            self.save_whitelist()
+            self.device_table.reevaluate()
+            self.update_lockout()
+        return bool(added)
+
+    def rpc_whitelist_remove(self, key):
+        with self._policy_lock:
+            removed = self.whitelist_store.remove(key)
+            self.save_whitelist()
+            self.device_table.reevaluate()
+            self.update_lockout()
+        return bool(removed)
+
+    def rpc_reload_whitelist(self):
+        self.config_service.reload()
+        self.rebuild_whitelist()
+        return len(self.whitelist_store)
+
+    def rpc_import_manifest(self, path):
+        """Verify a manifest file and apply its difference to the active whitelist"""
+        manifest, diff = self.managed_whitelist.prepare(path)
+        with self._policy_lock:
+            self.managed_whitelist.apply(self.whitelist_store, manifest, diff,
+                                         self.config_service.get('whitelist', []), self.config_writer)
+            if diff:
+                self.device_table.reevaluate()
+                self.update_lockout()
+        return {'version': manifest.version, 'entries': len(manifest),
+                'authenticated': manifest.authenticated,
+                'added': len(diff.added), 'removed': len(diff.removed)}
+
+    # Connection handling
+
+    def broadcast(self, message):
+        """Queue a notification for every subscriber (any thread)"""
+        data = encode_message(message)
+        with self._connections_lock:
+            for connection in self._connections.values():
+                if connection.subscribed:
+                    connection.outbox += data
+        try:
+            os.write(self._wake_write, b'x')
+        except OSError:
+            pass
+
+    def handle_request(self, connection, line):
+        """Run one request line and return (reply, method)"""
+        try:
+            request = json.loads(line)
+            method = request.get('method')
+            params = request.get('params') or {}
+        except (ValueError, AttributeError):
+            return {'id': None, 'error': "Malformed request"}, None
+
+        reply = {'id': request.get('id')}
+        if method not in self.methods:
+            reply['error'] = f"Unknown method: {method}"
+        elif not self.permitted(method, connection.uid):
+            reply['error'] = f"Not permitted: {method}"
+        elif method == 'subscribe':
+            reply['result'] = True
+        else:
+            try:
+                reply['result'] = self.methods[method](**params)
+            except Exception as e:
+                reply['error'] = f"{method} failed: {e}"
+        return reply, method
+
+    def permitted(self, method, uid):
+        """Whether a peer of this uid may call a method (None: uid unknown)"""
+        # A peer of unknown uid is never trusted
+        trusted = uid in (0, os.getuid())
+        if method in PRIVILEGED_METHODS:
+            return trusted
+        if method in READ_METHODS:
+            return trusted or bool(self.socket_group)
+        return True
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        with self._connections_lock:
+            self._connections[sock] = _Connection(sock)
+
+    def _drop(self, sock):
+        with self._connections_lock:
+            self._connections.pop(sock, None)
+        sock.close()
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b''
+        if not data:
+            self._drop(connection.sock)
+            return
+
+        connection.inbox += data
+        while b'\n' in connection.inbox:
+            line, connection.inbox = connection.inbox.split(b'\n', 1)
+            if line.strip():
+                reply, method = self.handle_request(connection, line)
+                with self._connections_lock:
+                    connection.outbox += encode_message(reply)
+                    # Events only start after the subscribe reply
+                    if method == 'subscribe' and 'error' not in reply:
+                        connection.subscribed = True
+        if len(connection.inbox) > MAX_MESSAGE:
+            self._drop(connection.sock)
+
+    def _write(self, connection):
+        with self._connections_lock:
+            pending = bytes(connection.outbox)
+        try:
+            sent = connection.sock.send(pending)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._drop(connection.sock)
+            return
+        with self._connections_lock:
+            del connection.outbox[:sent]
+
+    def serve_forever(self):
+        """Serve clients until stop(); reconciles the device table between requests"""
+        next_reconcile = time.monotonic() + self.RECONCILE_INTERVAL
+        while self._running:
+            with self._connections_lock:
+                connections = list(self._connections.values())
+            for connection in connections:
+                if len(connection.outbox) > self.MAX_OUTBOX:
+                    print("Dropping a subscriber that stopped reading")
+                    self._drop(connection.sock)
+            readers = [self._listener, self._wake_read] + [c.sock for c in connections]
+            writers = [c.sock for c in connections if c.outbox]
+
+            timeout = max(0.0, next_reconcile - time.monotonic())
+            try:
+                readable, writable, _ = select.select(readers, writers, [], timeout)
+            except InterruptedError:
+                continue
+            except ValueError:
+                continue   # a socket was closed under us
+
+            for sock in readable:
+                if sock is self._listener:
+                    self._accept()
+                elif sock == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                elif sock in self._connections:
+                    self._read(self._connections[sock])
+            for sock in writable:
+                if sock in self._connections:
+                    self._write(self._connections[sock])
+
+            if time.monotonic() >= next_reconcile:
+                self.reconcile_devices()
+                next_reconcile = time.monotonic() + self.RECONCILE_INTERVAL
+
+
+def parse_arguments(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="USB Security daemon (no GUI)")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="control socket path")
+    parser.add_argument('--source', default='auto',
+                        help="device event source: auto, netlink, poll[:seconds] or replay:<file>")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="also serve Prometheus metrics on 127.0.0.1:PORT")
+    parser.add_argument('--socket-group',
+                        help="make the socket 0660 for this group and let its members read "
+                             "devices and the log (default: 0666, reads for root and owner only)")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    daemon = SecurityDaemon(socket_path=args.socket, source_spec=args.source,
+                            metrics_port=args.metrics_port, socket_group=args.socket_group)
+    try:
+        daemon.start()
+    except (RuntimeError, OSError, ValueError) as e:
+        print(f"Error starting daemon: {e}")
+        return 1
+
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    print(f"USB Security daemon listening on {args.socket}")
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Signed whitelist manifests for fleet provisioning
+A manifest is one JSON header line followed by a JSON array of whitelist
+entries. The header carries a version and an HMAC-SHA256 over the version
+and the raw entry bytes, so verification needs no re-serialization. A plain
+SHA-256 (no shared key) only detects corruption, not forgery, and is only
+accepted when integrity-only manifests are explicitly allowed. Applying a
+manifest diffs it against the previously applied one and touches only the
+entries that changed
+Usage: python whitelist_manifest.py sign <entries.json | entries.csv> <out.manifest> --version N [--key FILE | --integrity-only]
+       python whitelist_manifest.py verify <file.manifest> [--key FILE | --integrity-only]
+"""
+
+import os
+import sys
+import csv
+import hmac
+import json
+import hashlib
+
+from whitelist_store import WhitelistStore, CSV_FIELDS
+
+MANIFEST_FILE = os.path.join('config', 'whitelist.manifest')
+# Shared secret; without it, manifests are only accepted as integrity-only
+KEY_FILE = os.path.join('config', 'manifest.key')
+
+FORMAT = 'usb-security-whitelist'
+ALGORITHMS = ('hmac-sha256', 'sha256')
+
+
+class ManifestError(ValueError):
+    """Raised for a manifest that is malformed, unsigned, tampered with or stale"""
+
+
+def load_key(path=KEY_FILE):
+    """Return the manifest key bytes, or None if no key is configured"""
+    try:
+        with open(path, 'rb') as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return key or None
+
+
+def _digest(version, body, key):
+    signed = str(version).encode('ascii') + b'\n' + body
+    if key is not None:
+        return hmac.new(key, signed, hashlib.sha256).hexdigest()
+    return hashlib.sha256(signed).hexdigest()
+
+
+def sign_manifest(entries, version, key=None):
+    """Build manifest bytes for a list of entry dicts"""
+    body = json.dumps([{k: str(v) for k, v in entry.items() if k in CSV_FIELDS and v}
+                       for entry in entries], separators=(',', ':')).encode('utf-8')
+    header = {
+        'format': FORMAT,
+        'version': int(version),
+        'algorithm': 'hmac-sha256' if key is not None else 'sha256',
+        'count': len(entries),
+        'digest': _digest(int(version), body, key),
+    }
+    return json.dumps(header, separators=(',', ':')).encode('utf-8') + b'\n' + body
+
+
+class Manifest:
+    """
+    A verified manifest: version, digest and entries by whitelist key.
+    authenticated is False for a keyless (integrity-only) manifest.
+    """
+
+    def __init__(self, version, digest, entries, data, source=None, authenticated=True):
+        self.version = version
+        self.digest = digest
+        self.entries = entries
+        self.data = data
+        self.source = source
+        self.authenticated = authenticated
+
+    @property
+    def label(self):
+        return "signed" if self.authenticated else "unauthenticated, integrity only"
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def parse_manifest(data, key=None, integrity_only=False):
+    """
+    Verify manifest bytes and return a Manifest; raises ManifestError.
+    Without a key, a plain SHA-256 manifest is only accepted with
+    integrity_only (anyone can recompute it)
+    """
+    header_line, newline, body = data.partition(b'\n')
+    if not newline:
+        raise ManifestError("Not a whitelist manifest")
+    try:
+        header = json.loads(header_line)
+    except ValueError:
+        raise ManifestError("Not a whitelist manifest")
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise ManifestError("Not a whitelist manifest")
+
+    algorithm = header.get('algorithm')
+    version = header.get('version')
+    if algorithm not in ALGORITHMS:
+        raise ManifestError(f"Unsupported manifest algorithm {algorithm!r}")
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        raise ManifestError("Manifest version must be a non-negative integer")
+    if key is not None and algorithm != 'hmac-sha256':
+        raise ManifestError("Manifest is not signed, but a manifest key is configured")
+    if key is None and algorithm == 'hmac-sha256':
+        raise ManifestError(f"Manifest is signed, but no key is configured in {KEY_FILE}")
+    if key is None and not integrity_only:
+        raise ManifestError(f"Manifest is not signed: configure a key in {KEY_FILE} "
+                            f"or allow integrity-only manifests")
+    digest = _digest(version, body, key)
+    if not hmac.compare_digest(digest, str(header.get('digest', ''))):
+        raise ManifestError("Manifest signature does not match its contents")
+
+    try:
+        raw_entries = json.loads(body)
+    except ValueError as e:
+        raise ManifestError(f"Manifest entries are not valid JSON: {e}")
+    if not isinstance(raw_entries, list):
+        raise ManifestError("Manifest entries must be a JSON array")
+
+    # All or nothing: one bad entry rejects the whole manifest
+    entries = {}
+    entry_key = WhitelistStore.entry_key
+    for position, entry in enumerate(raw_entries):
+        if not isinstance(entry, dict) or not all(isinstance(v, str) for v in entry.values()):
+            raise ManifestError(f"Manifest entry {position + 1} is not an object of strings")
+        key_value = entry_key(entry)
+        if key_value in ('name:', 'usb:0000:'):
+            raise ManifestError(f"Manifest entry {position + 1} has no id, name or vendor id")
+        entries[key_value] = entry
+    if header.get('count') is not None and header['count'] != len(raw_entries):
+        raise ManifestError("Manifest entry count does not match its header")
+    return Manifest(version, digest, entries, data, authenticated=key is not None)
+
+
+def read_manifest(path, key=None, integrity_only=False):
+    with open(path, 'rb') as f:
+        manifest = parse_manifest(f.read(), key, integrity_only)
+    manifest.source = path
+    return manifest
+
+
+class ManifestDiff:
+    """
+    (key, entry) pairs to add and keys to remove to move from one manifest
+    to the next
+    """
+
+    def __init__(self, added, removed, unchanged):
+        self.added = added
+        self.removed = removed
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+    def summary(self):
+        return f"+{len(self.added):,} / -{len(self.removed):,} ({self.unchanged:,} unchanged)"
+
+
+def diff_manifest(old_entries, new_entries):
+    """Compare two {key: entry} maps; a changed entry counts as added (it replaces the old one)"""
+    added = []
+    unchanged = 0
+    for key, entry in new_entries.items():
+        if old_entries.get(key) == entry:
+            unchanged += 1
+        else:
+            added.append((key, entry))
+    removed = [key for key in old_entries if key not in new_entries]
+    return ManifestDiff(added, removed, unchanged)
+
+
+class ManagedWhitelist:
+    """
+    The whitelist entries provisioned by the active manifest. prepare()
+    does the file reading, verification and diffing and may run on a
+    worker thread; apply() mutates the store and must run on the thread
+    that owns it.
+    """
+
+    def __init__(self, path=MANIFEST_FILE, key_path=KEY_FILE, integrity_only=False):
+        self.path = path
+        self.key_path = key_path
+        # Accept keyless manifests (the manifest_integrity_only setting)
+        self.integrity_only = integrity_only
+        self.version = None
+        self.digest = None
+        self.entries = {}
+
+    def prepare(self, source=None):
+        """Verify a manifest (default: the active one) and diff it with the active entries"""
+        source = source or self.path
+        manifest = read_manifest(source, load_key(self.key_path), self.integrity_only)
+        if not manifest.authenticated:
+            print(f"Warning: whitelist manifest {source} is not signed; "
+                  f"its origin cannot be verified")
+        if self.version is not None:
+            if manifest.version < self.version:
+                raise ManifestError(f"Manifest version {manifest.version} is older than the "
+                                    f"active version {self.version}")
+            if manifest.version == self.version and manifest.digest != self.digest:
+                raise ManifestError(f"Manifest version {manifest.version} differs from the "
+                                    f"active manifest with the same version")
+        return manifest, diff_manifest(self.entries, manifest.entries)
+
+    def load_active(self):
+        """Read the active manifest at startup; returns (manifest, diff) or None"""
+        if not os.path.exists(self.path):
+            return None
+        return self.prepare(self.path)
+
+    def apply(self, store, manifest, diff, local_entries=(), writer=None):
+        """
+        Apply a prepared diff to a WhitelistStore in one pass and make the
+        manifest the active one. Entries that also come from a local source
+        are left in place when the manifest drops them.
+        """
+        protected = {WhitelistStore.entry_key(entry) for entry in local_entries}
+        store.apply_changes(diff.added, [key for key in diff.removed if key not in protected])
+
+        if manifest.source is None or os.path.abspath(manifest.source) != os.path.abspath(self.path):
+            self.save(manifest.data, writer)
+        self.version = manifest.version
+        self.digest = manifest.digest
+        self.entries = manifest.entries
+
+    def restore(self, store):
+        """Re-add the active manifest's entries after the store was rebuilt"""
+        store.apply_changes(self.entries.items())
+
+    def save(self, data, writer=None):
+        """Keep a copy of the manifest bytes as the active manifest"""
+        if writer:
+            writer.write(self.path, data)
+        else:
+            from background_writer import atomic_write
+            atomic_write(self.path, data)
+
+
+def _read_entries(path):
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', newline='') as f:
+            return [{k: v for k, v in row.items() if k in CSV_FIELDS and v} for row in csv.DictReader(f)]
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Sign or verify whitelist manifests")
+    parser.add_argument('command', choices=('sign', 'verify'))
+    parser.add_argument('source')
+    parser.add_argument('target', nargs='?')
+    parser.add_argument('--version', type=int, default=None, help="manifest version (sign)")
+    parser.add_argument('--key', default=KEY_FILE, help="HMAC key file")
+    parser.add_argument('--integrity-only', action='store_true',
+                        help="without a key, use/accept a plain SHA-256 (detects corruption, not forgery)")
+    args = parser.parse_args(argv)
+    key = load_key(args.key)
+
+    try:
+        if args.command == 'sign':
+            if not args.target or args.version is None:
+                parser.error("sign needs a target file and --version")
+            if key is None and not args.integrity_only:
+                parser.error(f"no key in {args.key}; pass --integrity-only for an unsigned manifest")
+            entries = _read_entries(args.source)
+            with open(args.target, 'wb') as f:
+                f.write(sign_manifest(entries, args.version, key))
+            print(f"Signed {len(entries):,} entries as version {args.version} "
+                  f"({'hmac-sha256' if key else 'sha256 only, unauthenticated'})")
+        else:
+            manifest = read_manifest(args.source, key, args.integrity_only)
+            print(f"Manifest version {manifest.version}: {len(manifest):,} entries, "
+                  f"{'signature valid' if manifest.authenticated else 'intact but unauthenticated'}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Indexed device whitelist for USB Security Software
+Answers "is this device trusted?" with hash lookups instead of scanning
+the whitelist entry by entry
+"""
+
+import csv
+import json
+import bisect
+import fnmatch
+
+WILDCARD_CHARS = '*?['
+CSV_FIELDS = ['id', 'name', 'vendor_id', 'product_id']
+
+
+def normalize_id(value):
+    """Normalize a device id or rule pattern for lookups"""
+    return str(value or '').strip().casefold()
+
+
+def normalize_usb_id(value):
+    """Normalize a USB vendor/product id ('0x0781', '781' -> '0781')"""
+    text = str(value or '').strip().lower()
+    if text.startswith('0x'):
+        text = text[2:]
+    return text.zfill(4) if text else ''
+
+
+class WhitelistStore:
+    """
+    Whitelist entries are dicts with 'id' and 'name', optionally 'vendor_id'
+    and 'product_id'. An id ending in '*' is a prefix rule, other ids with
+    wildcard characters are glob rules, an entry with only vendor/product id
+    trusts that hardware model and an entry with only a name trusts that name.
+    """
+
+    def __init__(self, entries=None):
+        # Optional WhitelistSearch kept in step with every edit
+        self.search_index = None
+        self.clear()
+        if entries:
+            self.import_entries(entries)
+
+    def clear(self):
+        """Remove all entries and indexes"""
+        self._entries = {}      # normalized key -> entry
+        self._ids = set()       # exact device ids
+        self._names = set()     # name-only rules
+        self._models = set()    # (vendor_id, product_id); product '' = any
+        self._prefixes = {}     # prefix length -> set of prefixes
+        self._globs = {}        # normalized pattern -> entry
+        if self.search_index is not None:
+            self.search_index.invalidate()
+
+    @staticmethod
+    def entry_key(entry):
+        """Return the unique key an entry is stored under"""
+        if entry.get('id'):
+            return normalize_id(entry['id'])
+        if entry.get('vendor_id'):
+            return (f"usb:{normalize_usb_id(entry['vendor_id'])}:"
+                    f"{normalize_usb_id(entry.get('product_id'))}")
+        return 'name:' + normalize_id(entry.get('name'))
+
+    def _index(self, key, entry):
+        device_id = normalize_id(entry.get('id'))
+        if device_id:
+            if device_id.endswith('*') and not any(c in device_id[:-1] for c in WILDCARD_CHARS):
+                prefix = device_id[:-1]
+                self._prefixes.setdefault(len(prefix), set()).add(prefix)
+            elif any(c in device_id for c in WILDCARD_CHARS):
+                self._globs[device_id] = entry
+            else:
+                self._ids.add(device_id)
+        elif entry.get('vendor_id'):
+            self._models.add((normalize_usb_id(entry['vendor_id']),
+                              normalize_usb_id(entry.get('product_id'))))
+        elif entry.get('name'):
+            self._names.add(normalize_id(entry['name']))
+
+    def _unindex(self, entry):
+        device_id = normalize_id(entry.get('id'))
+        if device_id:
+            if device_id.endswith('*') and not any(c in device_id[:-1] for c in WILDCARD_CHARS):
+                prefix = device_id[:-1]
+                bucket = self._prefixes.get(len(prefix))
+                if bucket is not None:
+                    bucket.discard(prefix)
+                    if not bucket:
+                        del self._prefixes[len(prefix)]
+            elif any(c in device_id for c in WILDCARD_CHARS):
+                self._globs.pop(device_id, None)
+            else:
+                self._ids.discard(device_id)
+        elif entry.get('vendor_id'):
+            self._models.discard((normalize_usb_id(entry['vendor_id']),
+                                  normalize_usb_id(entry.get('product_id'))))
+        elif entry.get('name'):
+            self._names.discard(normalize_id(entry['name']))
+
+    # Editing
+
+    def add(self, device_id=None, device_name=None, vendor_id=None, product_id=None):
+        """Add an entry; returns False if an equivalent entry already exists"""
+        entry = {'id': device_id or '', 'name': device_name or ''}
+        if vendor_id:
+            entry['vendor_id'] = normalize_usb_id(vendor_id)
+        if product_id:
+            entry['product_id'] = normalize_usb_id(product_id)
+        return self.add_entry(entry)
+
+    def add_entry(self, entry):
+        """Add a whitelist entry dict"""
+        key = self.entry_key(entry)
+        if not key or key in ('name:', 'usb:0000:') or key in self._entries:
+            return False
+        self._entries[key] = entry
+        self._index(key, entry)
+        if self.search_index is not None:
+            self.search_index.changed(True, key, entry)
+        return True
+
+    def remove(self, key_or_entry):
+        """Remove an entry by device id, entry dict or entry key"""
+        if isinstance(key_or_entry, dict):
+            key = self.entry_key(key_or_entry)
+        else:
+            key = normalize_id(key_or_entry)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._unindex(entry)
+        if self.search_index is not None:
+            self.search_index.changed(False, key, entry)
+        return True
+
+    def apply_changes(self, added=(), removed=()):
+        """
+        Bulk edit: remove the `removed` keys, then add `added` (key, entry)
+        pairs whose keys were computed with entry_key (e.g. off-thread).
+        An added entry replaces one stored under the same key.
+        """
+        search = self.search_index
+        if search is not None:
+            added, removed = list(added), list(removed)
+            if len(added) + len(removed) > search.BULK_CHANGES:
+                # Cheaper to re-sort once than to insert one by one
+                search.invalidate()
+                search = None
+
+        entries = self._entries
+        for key in removed:
+            entry = entries.pop(key, None)
+            if entry is not None:
+                self._unindex(entry)
+                if search is not None:
+                    search.changed(False, key, entry)
+        ids = self._ids
+        for key, entry in added:
+            old = entries.get(key)
+            if old is not None:
+                self._unindex(old)
+                if search is not None:
+                    search.changed(False, key, old)
+            entries[key] = entry
+            if search is not None:
+                search.changed(True, key, entry)
+            # Plain device ids (the bulk of a fleet whitelist) skip _index
+            if entry.get('id') and '*' not in key and '?' not in key and '[' not in key:
+                ids.add(key)
+            else:
+                self._index(key, entry)
+
+    # Lookups
+
+    def is_whitelisted(self, device_id, device_name=None, vendor_id=None, product_id=None):
+        """Return True if any rule trusts the device"""
+        device_id = normalize_id(device_id)
+        if device_id:
+            if device_id in self._ids:
+                return True
+            for length, prefixes in self._prefixes.items():
+                if device_id[:length] in prefixes:
+                    return True
+
+        if vendor_id and self._models:
+            vendor_id = normalize_usb_id(vendor_id)
+            if (vendor_id, '') in self._models:
+                return True
+            if product_id and (vendor_id, normalize_usb_id(product_id)) in self._models:
+                return True
+
+        if device_name and self._names and normalize_id(device_name) in self._names:
+            return True
+
+        # Glob rules are expected to be few; they are the only linear scan
+        if device_id:
+            for pattern in self._globs:
+                if fnmatch.fnmatchcase(device_id, pattern):
+                    return True
+
+        return False
+
+    def get(self, key):
+        """Return the entry stored under a device id or key, or None"""
+        return self._entries.get(normalize_id(key))
+
+    def __contains__(self, device_id):
+        return self.is_whitelisted(device_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    # Bulk import/export
+
+    def import_entries(self, entries):
+        """Add many entries at once; returns the number added"""
+        added = 0
+        for entry in entries:
+            if self.add_entry(dict(entry)):
+                added += 1
+        return added
+
+    def export_entries(self):
+        """Return all entries as a list of dicts"""
+        return [dict(entry) for entry in self._entries.values()]
+
+    def load_json(self, path):
+        """Import entries from a JSON list file"""
+        with open(path, 'r') as f:
+            return self.import_entries(json.load(f))
+
+    def save_json(self, path):
+        """Export entries to a JSON list file"""
+        with open(path, 'w') as f:
+            json.dump(self.export_entries(), f, indent=2)
+
+    def load_csv(self, path):
+        """Import entries from a CSV file with id,name,vendor_id,product_id columns"""
+        with open(path, 'r', newline='') as f:
+            rows = ({k: v for k, v in row.items() if k in CSV_FIELDS and v}
+                    for row in csv.DictReader(f))
+            return self.import_entries(rows)
+
+    def save_csv(self, path):
+        """Export entries to a CSV file"""
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for entry in self._entries.values():
+                writer.writerow(entry)
+
+
+def _merge_in_steps(left, right, chunk):
+    """Merge two sorted lists, sorting at most 2 * chunk items per step"""
+    merged = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        left_stop = min(i + chunk, len(left))
+        right_stop = min(j + chunk, len(right))
+        # Everything up to the smaller of the two chunk ends can be placed
+        pivot = min(left[left_stop - 1], right[right_stop - 1])
+        left_end = bisect.bisect_right(left, pivot, i, left_stop)
+        right_end = bisect.bisect_right(right, pivot, j, right_stop)
+        piece = left[i:left_end] + right[j:right_end]
+        piece.sort()
+        merged.extend(piece)
+        i, j = left_end, right_end
+    rest, position = (left, i) if i < len(left) else (right, j)
+    for start in range(position, len(rest), chunk):
+        merged.extend(rest[start:start + chunk])
+    return merged
+
+
+def _sort_in_steps(items, chunk=16384):
+    """
+    sorted(items) as many short sorts and merges. list.sort holds the GIL,
+    so on a worker thread this keeps each hold short enough for the GUI
+    thread to stay responsive.
+    """
+    runs = [sorted(items[i:i + chunk]) for i in range(0, len(items), chunk)]
+    while len(runs) > 1:
+        runs = [_merge_in_steps(runs[i], runs[i + 1], chunk) if i + 1 < len(runs) else runs[i]
+                for i in range(0, len(runs), 2)]
+    return runs[0] if runs else []
+
+
+class WhitelistSearch:
+    """
+    Prefix index over the ids and names of a WhitelistStore: one sorted
+    list of entry keys and one of 'name\0key' terms (plain strings, which
+    the garbage collector never has to scan). A prefix matches a contiguous
+    range of each, found by bisection. build() may run on a worker thread;
+    snapshot(), install() and edits belong to the thread that owns the
+    store. Edits made while a build runs are replayed by install().
+    """
+
+    # An apply_changes() larger than this invalidates instead of updating
+    BULK_CHANGES = 1000
+    SEPARATOR = '\0'
+
+    def __init__(self, store):
+        self.store = store
+        self.ids = []
+        self.names = []
+        self.ready = False
+        self.building = False
+        self._log = []
+        self._generation = 0
+        # listener(added, key, entry) on edits; listener(None, None, None)
+        # when the index is rebuilt or invalidated
+        self.listeners = []
+        store.search_index = self
+
+    def _notify(self, added, key, entry):
+        for listener in self.listeners:
+            listener(added, key, entry)
+
+    @classmethod
+    def name_term(cls, key, entry):
+        name = normalize_id(entry.get('name'))
+        return name + cls.SEPARATOR + key if name else None
+
+    # Building
+
+    def snapshot(self):
+        """Start a build: returns what build() needs"""
+        self.building = True
+        self._log = []
+        self._generation += 1
+        return self._generation, list(self.store._entries)
+
+    def build(self, snapshot):
+        """Sort the terms of a snapshot (any thread)"""
+        generation, keys = snapshot
+        entries = self.store._entries
+        names = []
+        for key in keys:
+            # Entries edited since the snapshot are fixed up by install()
+            entry = entries.get(key)
+            term = self.name_term(key, entry) if entry is not None else None
+            if term:
+                names.append(term)
+        return generation, _sort_in_steps(keys), _sort_in_steps(names)
+
+    def install(self, built):
+        """Adopt a finished build and replay the edits made meanwhile; False if it is stale"""
+        generation, ids, names = built
+        if not self.building or generation != self._generation:
+            return False   # invalidated while building
+        self.ids, self.names = ids, names
+        log, self._log = self._log, []
+        for added, key, entry in log:
+            (self._insert if added else self._delete)(key, entry)
+        self.building = False
+        self.ready = True
+        self._notify(None, None, None)
+        return True
+
+    def rebuild(self):
+        """Build synchronously"""
+        self.install(self.build(self.snapshot()))
+
+    def invalidate(self):
+        self.ids = []
+        self.names = []
+        self.ready = False
+        self.building = False
+        self._log = []
+        self._notify(None, None, None)
+
+    # Incremental upkeep
+
+    def changed(self, added, key, entry):
+        """Called by the store for every single add or remove"""
+        if self.building:
+            self._log.append((added, key, entry))
+        elif self.ready:
+            (self._insert if added else self._delete)(key, entry)
+            self._notify(added, key, entry)
+
+    @staticmethod
+    def _add_term(terms, term):
+        position = bisect.bisect_left(terms, term)
+        if position == len(terms) or terms[position] != term:
+            terms.insert(position, term)
+
+    @staticmethod
+    def _remove_term(terms, term):
+        position = bisect.bisect_left(terms, term)
+        if position < len(terms) and terms[position] == term:
+            del terms[position]
+
+    def _insert(self, key, entry):
+        self._add_term(self.ids, key)
+        term = self.name_term(key, entry)
+        if term:
+            self._add_term(self.names, term)
+
+    def _delete(self, key, entry):
+        self._remove_term(self.ids, key)
+        term = self.name_term(key, entry)
+        if term:
+            self._remove_term(self.names, term)
+
+    # Queries
+
+    def result_row(self, prefix, key, entry):
+        """The row search(prefix) lists an entry as, or None if it does not match"""
+        prefix = normalize_id(prefix)
+        if key.startswith(prefix):
+            return ('id', key, key)
+        term = self.name_term(key, entry)
+        if term and term.startswith(prefix):
+            return ('name', term, key)
+        return None
+
+    def search(self, prefix='', after=None, limit=100):
+        """
+        Return (rows, cursor): up to `limit` (phase, term, key) rows for the
+        entries whose id starts with prefix, in id order, then those that
+        match only by name, in name order; rows sort in listing order. Pass
+        cursor back for the next page; it is None once there are no more
+        matches.
+        """
+        prefix = normalize_id(prefix)
+        phase, last = after or ('id', None)
+        rows = []
+        if phase == 'id':
+            ids = self.ids
+            position = bisect.bisect_right(ids, last) if last is not None else bisect.bisect_left(ids, prefix)
+            while position < len(ids) and ids[position].startswith(prefix):
+                if len(rows) == limit:
+                    return rows, ('id', rows[-1][2])
+                key = ids[position]
+                rows.append(('id', key, key))
+                position += 1
+            if not prefix:
+                return rows, None   # every entry has been listed by id
+            phase, last = 'name', None
+
+        names = self.names
+        position = bisect.bisect_right(names, last) if last is not None else bisect.bisect_left(names, prefix)
+        while position < len(names) and names[position].startswith(prefix):
+            term = names[position]
+            position += 1
+            key = term.partition(self.SEPARATOR)[2]
+            if key.startswith(prefix):
+                continue   # already listed by id
+            if len(rows) == limit:
+                return rows, ('name', last)
+            rows.append(('name', term, key))
+            last = term
+        return rows, None